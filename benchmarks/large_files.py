@@ -0,0 +1,158 @@
+"""Build a package with very large test data files and measure the peak
+memory of the build.
+
+    python -m benchmarks.large_files --size 2048
+    python -m benchmarks.large_files --size 4500 --mode direct
+
+Run from the repository root. Every build runs in its own process, its
+peak RSS has to stay below --max-rss whatever the size of the files, the
+exit code is 1 otherwise. Files of 4 GiB and more need ZIP64 entries,
+which are checked in the written archive.
+"""
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+import zipfile
+
+import click
+
+from benchmarks.synthetic import SyntheticParams, generate
+
+REPOSITORY = Path(__file__).parent.parent
+MODES = {
+    "staged": [],
+    "direct": ["--direct"],
+    "pipeline": ["--pipeline"],
+}
+MIB = 1024 * 1024
+
+
+def _build(
+    package_path: Path, args: typing.List[str], env: dict
+) -> typing.Tuple[float, int]:
+    """Run 'pfcli build' in package_path. Returns the seconds it took and
+    its peak RSS in bytes.
+    """
+    start = time.perf_counter()
+    # with a running 'pfcli serve' only the client would be measured.
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "pfcli.client",
+            "build",
+            "--force",
+            "--no-server",
+            *args,
+        ],
+        cwd=package_path,
+        env=env,
+    )
+    # wait4 gives the resource usage of this child only.
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise click.ClickException(f"build failed with exit code {proc.returncode}")
+    # ru_maxrss is in KiB on Linux, in bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return seconds, rusage.ru_maxrss * scale
+
+
+def _check_archive(archive: Path, size: int, count: int) -> typing.List[str]:
+    """Check that archive has the count large files of size bytes. Sizes
+    of 4 GiB and more can only be read from ZIP64 entries.
+    """
+    with zipfile.ZipFile(archive) as zf:
+        found = sum(1 for info in zf.infolist() if info.file_size == size)
+    if found != count:
+        return [f"{found} of {count} entries of {size} bytes in '{archive}'"]
+    return []
+
+
+@click.command()
+@click.option(
+    "--size",
+    type=click.IntRange(min=1),
+    default=2048,
+    show_default=True,
+    help="Size of each large test data file in MiB.",
+)
+@click.option("--count", type=click.IntRange(min=1), default=1, show_default=True)
+@click.option(
+    "--mode",
+    "modes",
+    type=click.Choice(list(MODES)),
+    multiple=True,
+    default=list(MODES),
+    show_default=True,
+    help="How the package is built, can be given more than once.",
+)
+@click.option("-j", "--jobs", type=click.IntRange(min=1), default=1, show_default=True)
+@click.option(
+    "--compression-level",
+    type=click.IntRange(min=0, max=9),
+    default=1,
+    show_default=True,
+)
+@click.option(
+    "--max-rss",
+    type=click.IntRange(min=1),
+    default=200,
+    show_default=True,
+    help="Peak RSS in MiB a build may use.",
+)
+@click.option(
+    "--workdir",
+    type=click.Path(file_okay=False, exists=True, path_type=Path),
+    default=None,
+    help="Where the package tree is generated, the temp directory if not set. "
+    "Needs room for about three times size times count.",
+)
+def main(size, count, modes, jobs, compression_level, max_rss, workdir):
+    root = Path(tempfile.mkdtemp(prefix="pfcli-large-", dir=workdir))
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(
+            filter(None, [str(REPOSITORY), os.environ.get("PYTHONPATH")])
+        ),
+        PFCLI_CACHE_DIR=str(root.joinpath("cache")),
+    )
+    params = SyntheticParams(
+        packages=2, files=5, testdata=count, testdata_size=size * MIB
+    )
+    failed = False
+    try:
+        click.echo(f"generating {count} file(s) of {size} MiB in '{root}'")
+        package_path = generate(root, params)
+        archive = package_path.joinpath("synthetic.zip")
+
+        click.echo(f"{'mode':<10}{'seconds':>9}{'MiB/s':>9}{'peak RSS':>10}")
+        for mode in modes:
+            args = MODES[mode] + ["-j", str(jobs)]
+            args += ["--compression-level", str(compression_level)]
+            seconds, rss = _build(package_path, args, env)
+            problems = _check_archive(archive, size * MIB, count)
+            too_large = rss > max_rss * MIB
+            failed = failed or too_large or bool(problems)
+            click.echo(
+                f"{mode:<10}{seconds:>9.1f}{size * count / seconds:>9.1f}"
+                f"{rss / MIB:>9.0f}M" + ("  TOO LARGE" if too_large else "")
+            )
+            for problem in problems:
+                click.echo(f"  {problem}")
+            # don't keep several copies of the data on disk.
+            archive.unlink(missing_ok=True)
+            shutil.rmtree(package_path.joinpath("_build"), ignore_errors=True)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
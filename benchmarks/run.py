@@ -0,0 +1,231 @@
+"""Time the build steps on a synthetic package tree.
+
+    python -m benchmarks.run --save-baseline
+    python -m benchmarks.run --packages 100 --files 200
+
+Run from the repository root. The results are compared to the stored
+baseline and the exit code is 1 if a step got slower by more than
+--tolerance. Timings depend on the machine, so store a baseline on the
+machine the comparisons run on.
+"""
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import typing
+
+import click
+
+from pfcli import config
+from pfcli.package import clear_package_cache, load_package
+from pfcli.builder import Builder
+from benchmarks.synthetic import SyntheticParams, generate
+
+BASELINE = Path(__file__).parent.joinpath("baseline.json")
+# differences below this are noise, even if they are large relative ones.
+MIN_DIFFERENCE = 0.002
+
+STEPS = [
+    "load_package",
+    "Builder",
+    "copy_files",
+    "copy_files (unchanged)",
+    "generate_package_file",
+    "zip_package",
+    "pipeline_package",
+]
+
+
+def _time(f: typing.Callable) -> typing.Tuple[float, typing.Any]:
+    start = time.perf_counter()
+    result = f()
+    return time.perf_counter() - start, result
+
+
+def run_once(package_path: Path) -> typing.Dict[str, float]:
+    """Build the package at package_path from scratch, timing each step."""
+    timings = {}
+    clear_package_cache()
+    timings["load_package"], package = _time(lambda: load_package(package_path))
+    timings["Builder"], builder = _time(lambda: Builder(package))
+
+    builder.initialise_build_path(clean=True)
+    timings["copy_files"], _ = _time(builder.copy_files)
+    # a new builder, so nothing is known about the files.
+    builder = Builder(package)
+    timings["copy_files (unchanged)"], _ = _time(builder.copy_files)
+    timings["generate_package_file"], _ = _time(builder.generate_package_file)
+    timings["zip_package"], _ = _time(builder.zip_package)
+
+    # copy_files, generate_package_file and zip_package in one pass.
+    builder = Builder(package)
+    builder.initialise_build_path(clean=True)
+    timings["pipeline_package"], _ = _time(builder.pipeline_package)
+    return timings
+
+
+def run(
+    params: SyntheticParams, repeat: int, workdir: typing.Optional[Path] = None
+) -> dict:
+    """Generate the package tree and time repeat builds of it."""
+    root = Path(tempfile.mkdtemp(prefix="pfcli-bench-", dir=workdir))
+    cwd = os.getcwd()
+    try:
+        package_path = generate(root, params)
+        # the package xml has paths relative to the current directory.
+        os.chdir(package_path)
+        runs = [run_once(package_path) for _ in range(repeat)]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+    results = {}
+    for step in STEPS:
+        seconds = [timings[step] for timings in runs]
+        results[step] = {
+            "min": min(seconds),
+            "median": statistics.median(seconds),
+        }
+    return {
+        "params": params.as_dict(),
+        "repeat": repeat,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+
+
+def compare(
+    results: dict, baseline: dict, tolerance: float
+) -> typing.Tuple[typing.List[str], bool]:
+    """Compare the medians of results to baseline.
+
+    Returns the report lines and if any step is slower than the baseline
+    by more than tolerance.
+    """
+    lines = []
+    if results["params"] != baseline["params"]:
+        lines.append(
+            "warning: the baseline was measured with different parameters "
+            f"{baseline['params']}"
+        )
+
+    regression = False
+    lines.append(f"{'step':<24}{'median':>10}{'baseline':>10}{'change':>9}")
+    for step in STEPS:
+        median = results["results"][step]["median"]
+        try:
+            base = baseline["results"][step]["median"]
+        except KeyError:
+            lines.append(f"{step:<24}{median:>10.4f}{'-':>10}{'-':>9}")
+            continue
+        change = median / base - 1 if base else 0.0
+        slower = change > tolerance and median - base > MIN_DIFFERENCE
+        regression = regression or slower
+        lines.append(
+            f"{step:<24}{median:>10.4f}{base:>10.4f}{change:>+9.1%}"
+            + ("  SLOWER" if slower else "")
+        )
+    return lines, regression
+
+
+@click.command()
+@click.option("--packages", type=click.IntRange(min=0), default=20, show_default=True)
+@click.option("--depth", type=click.IntRange(min=1), default=3, show_default=True)
+@click.option("--fanout", type=click.IntRange(min=1), default=2, show_default=True)
+@click.option(
+    "--files",
+    type=click.IntRange(min=0),
+    default=50,
+    show_default=True,
+    help="Source files per package.",
+)
+@click.option(
+    "--file-size",
+    type=click.IntRange(min=0),
+    default=4096,
+    show_default=True,
+    help="Size of each file in bytes.",
+)
+@click.option("--testdata", type=click.IntRange(min=0), default=10, show_default=True)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--repeat", type=click.IntRange(min=1), default=5, show_default=True)
+@click.option(
+    "--baseline",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=BASELINE,
+    show_default=True,
+)
+@click.option(
+    "--save-baseline",
+    is_flag=True,
+    default=False,
+    help="Store the results as the new baseline.",
+)
+@click.option(
+    "--tolerance",
+    type=float,
+    default=0.2,
+    show_default=True,
+    help="How much slower than the baseline a step may get.",
+)
+@click.option(
+    "--workdir",
+    type=click.Path(file_okay=False, exists=True, path_type=Path),
+    default=None,
+    help="Where the package tree is generated, the temp directory if not set.",
+)
+@click.option(
+    "--json",
+    "json_file",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Also write the results to this file.",
+)
+def main(
+    packages,
+    depth,
+    fanout,
+    files,
+    file_size,
+    testdata,
+    seed,
+    repeat,
+    baseline,
+    save_baseline,
+    tolerance,
+    workdir,
+    json_file,
+):
+    # measure the parsing, not the cache of parsed configs.
+    config.set_use_cache(False)
+    params = SyntheticParams(packages, depth, fanout, files, file_size, testdata, seed)
+    results = run(params, repeat, workdir)
+
+    if json_file:
+        json_file.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    if save_baseline:
+        baseline.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        click.echo(f"saved baseline to '{baseline}'")
+
+    if baseline.exists():
+        lines, regression = compare(
+            results, json.loads(baseline.read_text(encoding="utf-8")), tolerance
+        )
+    else:
+        lines, regression = compare(results, {"params": params.as_dict()}, tolerance)
+        lines.insert(0, f"no baseline at '{baseline}'")
+
+    click.echo("\n".join(lines))
+    sys.exit(1 if regression else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+from dataclasses import dataclass, asdict
+from pathlib import Path
+import random
+import typing
+
+ROOT_PACKAGE = "ROOT"
+# files are written in chunks of this size, so large files don't have to
+# fit into memory.
+_CHUNK_SIZE = 1024 * 1024
+
+# words for the file content, so it compresses about like real forms.
+_WORDS = [
+    b"field",
+    b"subform",
+    b"<draw>",
+    b"</draw>",
+    b"font",
+    b"Helvetica",
+    b"margin",
+    b"10mm",
+    b"value",
+    b"caption",
+    b"\n",
+    b"  ",
+]
+
+
+@dataclass
+class SyntheticParams:
+    """The shape of a synthetic package tree.
+
+    packages include packages are arranged in depth layers. The build
+    package includes the first layer and every include includes fanout
+    packages of the next layer, so packages further down are shared by
+    several includes. Every package has files source files of file_size
+    bytes, the build package also has testdata test data files of
+    testdata_size bytes, file_size if it isn't set.
+    """
+
+    packages: int = 20
+    depth: int = 3
+    fanout: int = 2
+    files: int = 50
+    file_size: int = 4096
+    testdata: int = 10
+    seed: int = 0
+    testdata_size: typing.Optional[int] = None
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _content(rnd: random.Random, size: int) -> bytes:
+    chunks = []
+    length = 0
+    while length < size:
+        word = rnd.choice(_WORDS) if rnd.random() < 0.9 else rnd.randbytes(8)
+        chunks.append(word)
+        length += len(word)
+    return b"".join(chunks)[:size]
+
+
+def _write_content(rnd: random.Random, path: Path, size: int):
+    # larger files repeat their first chunk, generating gigabytes of
+    # content would take longer than the build. The chunk is larger than
+    # the deflate window, so it doesn't make the file compress better.
+    chunk = _content(rnd, min(size, _CHUNK_SIZE))
+    with open(path, "wb") as f:
+        while size > 0:
+            f.write(chunk[:size])
+            size -= len(chunk)
+
+
+def _write_files(
+    rnd: random.Random, basepath: Path, directory: str, count: int, size: int
+) -> typing.List[str]:
+    """Write count files below basepath/directory, spread over a few
+    subdirectories. Returns their paths relative to basepath.
+    """
+    paths = []
+    for i in range(count):
+        # every 4th file in a subdirectory, to exercise '**' patterns.
+        subdir = f"sub{i % 3}/" if i % 4 == 0 else ""
+        rel_path = f"{directory}/{subdir}file{i:05d}.dat"
+        path = basepath.joinpath(rel_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _write_content(rnd, path, size)
+        paths.append(rel_path)
+    return paths
+
+
+def _layers(params: SyntheticParams) -> typing.List[typing.List[str]]:
+    depth = max(1, min(params.depth, params.packages))
+    layers = [[] for _ in range(depth)]
+    for i in range(params.packages):
+        layers[i * depth // params.packages].append(f"INC_{i:04d}")
+    return [layer for layer in layers if layer]
+
+
+def _includes(layer: typing.List[str], index: int, fanout: int) -> typing.List[str]:
+    """fanout packages of layer, starting at index."""
+    count = min(fanout, len(layer))
+    return [layer[(index * fanout + i) % len(layer)] for i in range(count)]
+
+
+def _include_package_toml(name: str, includes: typing.List[str]) -> str:
+    include = ", ".join(f'"../{i}"' for i in includes)
+    return f"""type = "include"
+include = [{include}]
+
+[[destination]]
+  name = "{name.lower()}"
+  path = "./{name.lower()}"
+
+[[source]]
+  type = "config"
+  destination = "{name.lower()}"
+  paths = ["src/**/*.dat"]
+"""
+
+
+def _root_package_toml(includes: typing.List[str], testdata: typing.List[str]) -> str:
+    include = ", ".join(f'"../{i}"' for i in includes)
+    toml = f"""type = "rs_package"
+name = "Synthetic"
+description = "A generated package for benchmarks"
+archive_name = "synthetic"
+version = "0.0.1"
+include = [{include}]
+transaction_form = "./forms/form.xdp"
+
+[[runtime_environment]]
+  name = "bench"
+  platform = "Linux"
+  command_line = ""
+  program_version = "5.10.*"
+  program_result_log = "*.log"
+  program_result_preview = "*.pdf"
+  program_result_type = "ReturnCode"
+  program_result_value = 0
+
+[[transaction_form_material]]
+  name = "A4"
+  description = "StandardA4"
+  width = "210mm"
+  height = "297mm"
+  thickness = "0.1mm"
+  weight = "4.99g"
+
+[[destination]]
+  name = "etc"
+  path = "./etc"
+
+[[destination]]
+  name = "forms"
+  path = "./forms"
+
+[[destination]]
+  name = "testdata"
+  path = "./testdata"
+
+[[destination]]
+  name = "backgrounds"
+  path = "./backgrounds"
+
+[[source]]
+  type = "config"
+  destination = "etc"
+  paths = ["etc/**/*.dat"]
+
+[[source]]
+  type = "forms"
+  destination = "forms"
+  paths = ["forms/*.xdp"]
+
+[fontdefinition]
+  path = "./etc/fonts.ini"
+  destination = "etc"
+
+[testdata]
+  destination = "testdata"
+"""
+    for i, path in enumerate(testdata):
+        toml += f"""
+[[testdata.file]]
+  name = "Testdata {i}"
+  description = "generated"
+  path = "./{path}"
+"""
+    toml += """
+[transaction_form_page_background]
+  destination = "backgrounds"
+
+[[transaction_form_page_background.file]]
+  page_name = "first_page"
+  path = "./backgrounds/first_page.png"
+
+[[input_variable]]
+  name = "GD_DATA"
+  description = "generated"
+
+[supplement.logical]
+  allowed = true
+  use_only_transaction_form_paper = true
+
+[supplement.physical]
+  allowed = false
+
+[shipment.postage]
+  optional_supplement_can_exceed_postage = true
+  whitespace_can_exceed_postage = false
+
+[whitespace]
+  allowed = true
+  max_space = 50
+  overflow = "ALLOWTOCREATEBACKPAGE"
+"""
+    return toml
+
+
+def generate(root: Path, params: SyntheticParams) -> Path:
+    """Create a synthetic package tree below root.
+
+    The same params always create the same files. Returns the path of
+    the build package.
+    """
+    rnd = random.Random(params.seed)
+    layers = _layers(params)
+
+    for depth, layer in enumerate(layers):
+        for index, name in enumerate(layer):
+            basepath = root.joinpath(name)
+            basepath.mkdir(parents=True, exist_ok=True)
+            includes = []
+            if depth + 1 < len(layers):
+                includes = _includes(layers[depth + 1], index, params.fanout)
+            _write_files(rnd, basepath, "src", params.files, params.file_size)
+            basepath.joinpath("package.toml").write_text(
+                _include_package_toml(name, includes), encoding="utf-8"
+            )
+
+    basepath = root.joinpath(ROOT_PACKAGE)
+    basepath.mkdir(parents=True, exist_ok=True)
+    _write_files(rnd, basepath, "etc", params.files, params.file_size)
+    basepath.joinpath("etc", "fonts.ini").write_text("[fonts]\n", encoding="utf-8")
+    basepath.joinpath("forms").mkdir(exist_ok=True)
+    basepath.joinpath("forms", "form.xdp").write_bytes(_content(rnd, params.file_size))
+    basepath.joinpath("backgrounds").mkdir(exist_ok=True)
+    basepath.joinpath("backgrounds", "first_page.png").write_bytes(
+        rnd.randbytes(params.file_size)
+    )
+    testdata_size = params.file_size
+    if params.testdata_size is not None:
+        testdata_size = params.testdata_size
+    testdata = _write_files(rnd, basepath, "testdata", params.testdata, testdata_size)
+    includes = layers[0] if layers else []
+    basepath.joinpath("package.toml").write_text(
+        _root_package_toml(includes, testdata), encoding="utf-8"
+    )
+    return basepath
@@ -1,9 +1,15 @@
+from dataclasses import dataclass, field
 from functools import cached_property
+import io
+import os
 from pathlib import Path
 from pprint import pformat
-from shutil import rmtree, copy2, make_archive
+from shutil import rmtree
+import threading
 import typing
 
+import click
+
 from pfcli.package import (
     Package,
     Destination,
@@ -12,68 +18,136 @@ from pfcli.package import (
     TransactionFormPageBackground,
     TransactionFormMaterial,
 )
-from pfcli.config import decho, BUILD_DIR, BUILD_DIR_FILE, RS_PACKAGE_CONFIGURATION
+from pfcli import profile
+from pfcli.package.graph import resolve_include_order
+from pfcli.package.scanner import StatIndex
+from pfcli.config import (
+    decho,
+    warn,
+    BUILD_DIR,
+    BUILD_DIR_FILE,
+    BUILD_MANIFEST,
+    RS_PACKAGE_CONFIGURATION,
+    ERROR,
+    WARN,
+)
+from .archive import (
+    ArchiveOptions,
+    build_path_entries,
+    package_file_entries,
+    planned_build_path_entries,
+    write_archive,
+    write_archive_pipelined,
+)
+from .copy import copy_package_files, unique_destinations, COPY
+from .fingerprint import BuildRecord, compute_fingerprint
+from .dedupe import (
+    ContentIndex,
+    DestinationConflictError,
+    describe_conflict,
+    find_conflicts,
+)
+from .manifest import BuildManifest
+from .references import prune_package_files
+from .resolved import ResolvedConfig
 from .xml_generator import get_rs_package_xml_generator
 
 
+def _package_file(
+    source: Path, dest: Path, package: Package, section: str, destination: Destination
+) -> dict:
+    """An entry of the build plan. Only source and dest are needed to
+    build, the others say where the entry comes from.
+    """
+    return {
+        "source": source,
+        "dest": dest,
+        "package": package.name,
+        "section": section,
+        "destination": destination,
+    }
+
+
+@dataclass
+class BuildOptions:
+    """How Builder.build builds a package."""
+
+    clean: bool = False
+    jobs: int = 1
+    staging: str = COPY
+    direct: bool = False
+    # copy files with the same content once.
+    dedupe: bool = False
+    # what to do if files with different content go to one destination.
+    conflicts: str = WARN
+    # build even if nothing changed since the last build.
+    force: bool = False
+    # copy, compress and write the archive at the same time.
+    pipeline: bool = False
+    # package only the files the forms use, see Builder.prune_package_files.
+    prune: bool = False
+    archive: ArchiveOptions = field(default_factory=ArchiveOptions)
+
+    @classmethod
+    def create(
+        cls, compression_level: typing.Optional[int] = None, **kwargs
+    ) -> "BuildOptions":
+        """BuildOptions from the options of the build command. The archive
+        is compressed with the same jobs and dedupe setting.
+        """
+        options = cls(**kwargs)
+        options.archive = ArchiveOptions(
+            compresslevel=compression_level, jobs=options.jobs, dedupe=options.dedupe
+        )
+        return options
+
+
 class Builder:
-    def __init__(self, package: Package):
-        self.packages: typing.List[Package] = []
+    def __init__(self, package: Package, archive_dir: typing.Optional[Path] = None):
         self.build_package = package
-        self.packages.append(package)
-        self.packages.extend(self._resolve_includes(package))
-        self.packages = list(reversed(self.packages))
+        self.archive_dir = archive_dir
+        # the includes first, the build package last.
+        self.packages: typing.List[Package] = self.resolve_packages()
+        self.stat_index = StatIndex()
+        self.content_index = ContentIndex(self.stat_index)
+        self._destination_paths: typing.Dict[Destination, Path] = {}
+        self.prune = False
+
+    def resolve_packages(self) -> typing.List[Package]:
+        """The packages that make up the build, see resolve_include_order."""
+        with profile.span("resolve includes") as span:
+            packages = resolve_include_order(self.build_package)
+            span.add(packages=len(packages))
+        return packages
 
     @cached_property
     def build_path(self) -> Path:
-        return self.build_package.basepath.joinpath(BUILD_DIR)
+        return self.build_package.basepath.joinpath(BUILD_DIR).resolve()
+
+    def _dest(self, dest_path: Path, path: Path) -> Path:
+        """Where path goes in the build directory. Not resolved, the file
+        there may be a link to its source from a build with symlinks.
+        """
+        return Path(os.path.normpath(self.build_path.joinpath(dest_path, path)))
 
     @cached_property
     def available_destinations(self) -> typing.List[Destination]:
         """Retrieve the list of all configured destinations
         from the package and it's includes.
         """
-        destinations = []
-
-        for package in self.packages:
-            decho(f"package {package.name}")
-            _destinations = package.get_destinations()
-
-            for destination in _destinations:
-                if destination in destinations:
-                    raise ValueError(
-                        f"Destination '{destination}' from package '{package.name}' has already been defined.\n"
-                        "Redefinition of destinations is not allowed"
-                    )
-
-            destinations.extend(_destinations)
-
-        return destinations
+        return list(self.resolved_config.destinations)
 
     @cached_property
     def required_destinations(self) -> typing.List[Destination]:
-        destinations = []
-
-        try:
-            for package in self.packages:
-                sources = package.get_all_sources()
-                for source in sources:
-                    destinations.append(source.destination)
-        except KeyError:
-            raise KeyError(
-                f"No destination defined in source '{source}' in package '{package}'"
-            )
-
-        return destinations
+        return list(self.resolved_config.sources)
 
-    def _resolve_includes(self, package):
-        includes = []
-        for include in package.includes:
-            includes.append(include)
-            includes.extend(self._resolve_includes(include))
-        return includes
+    def initialise_build_path(self, clean: bool = False):
+        """Prepare the build directory.
 
-    def initialise_build_path(self):
+        With clean the build directory is emptied, otherwise the files
+        of the previous build are kept, so that copy_files only has to
+        copy what changed.
+        """
         build_dir_file = self.build_path.joinpath(BUILD_DIR_FILE)
         if self.build_path.exists():
             if not self.build_path.is_dir():
@@ -87,152 +161,110 @@ class Builder:
                     f"It is missing the { BUILD_DIR_FILE } file."
                 )
 
-        # make sure build dir is emtpy
-        rmtree(self.build_path, ignore_errors=True)
-        self.build_path.mkdir()
+        # without a manifest we can't tell which files are stale.
+        if clean or not self.build_path.joinpath(BUILD_MANIFEST).exists():
+            # make sure build dir is emtpy
+            rmtree(self.build_path, ignore_errors=True)
+        self.build_path.mkdir(exist_ok=True)
         build_dir_file.touch()
 
-    def get_destination_path(self, destination: Destination) -> Path:
-        for package in self.packages:
-            try:
-                dest_path = package.get_destination_path(destination)
+    @cached_property
+    def resolved_config(self) -> ResolvedConfig:
+        return ResolvedConfig(self.packages)
 
-                p = self.build_path.joinpath(dest_path).resolve()
+    def _packages_names(self):
+        return f"{ *[p.name for p in self.packages],}"
 
-                path_valid = not (
-                    not p.is_relative_to(self.build_path) or dest_path.is_absolute()
-                )
+    def get_destination_path(self, destination: Destination) -> Path:
+        try:
+            return self._destination_paths[destination]
+        except KeyError:
+            pass
 
-                if not path_valid:
-                    raise ValueError(
-                        f"Destination path '{dest_path}' for destination '{destination}' is invalid.\n"
-                        f"Destination paths can't be absolute or traverse out of the build directory."
-                    )
-                return dest_path
-            except KeyError:
-                pass  # we just continue with the net package
+        resolved = self.resolved_config.destination(destination)
+        if resolved is None:
+            raise ValueError(
+                f"Unknown destination '{destination}'.\n"
+                f"Destination '{destination}' isn't defined in any of the processed packages '{self._packages_names()}'."
+            )
+
+        dest_path = resolved.value
+        p = self.build_path.joinpath(dest_path).resolve()
 
-        raise ValueError(
-            f"Unknown destination '{destination}'.\n"
-            f"Destination '{destination}' isn't defined in any of the processed packages '{ *[p.name for p in self.packages],}'."
+        path_valid = not (
+            not p.is_relative_to(self.build_path) or dest_path.is_absolute()
         )
 
-    def get_font_definition(self):
-        for package in reversed(self.packages):
-            try:
-                return package.get_font_definition()
-            except KeyError:
-                pass  # we just continue with the next package
+        if not path_valid:
+            raise ValueError(
+                f"Destination path '{dest_path}' for destination '{destination}' is invalid.\n"
+                f"Destination paths can't be absolute or traverse out of the build directory."
+            )
 
-        raise ValueError(
-            f"No section fontdefinition.\n"
-            f"The section fontdefinition isn't defined in any of the processed packages '{ *[p.name for p in self.packages],}'."
-        )
+        self._destination_paths[destination] = dest_path
+        return dest_path
 
-    def get_supplement_logical(self):
-        for package in reversed(self.packages):
-            try:
-                return package.get_supplement_logical()
-            except KeyError:
-                pass  # we just continue with the next package
+    def _get_section(self, name: str):
+        resolved = self.resolved_config.section(name)
+        if resolved is None:
+            raise ValueError(
+                f"No section {name}.\n"
+                f"The section {name} isn't defined in any of the processed packages '{self._packages_names()}'."
+            )
+        return resolved.value
 
-        raise ValueError(
-            f"No section supplement.logical.\n"
-            f"The section supplement.logical isn't defined in any of the processed packages '{ *[p.name for p in self.packages],}'."
-        )
+    def get_font_definition(self):
+        return self._get_section("fontdefinition")
 
-    def get_supplement_physical(self):
-        for package in reversed(self.packages):
-            try:
-                return package.get_supplement_physical()
-            except KeyError:
-                pass  # we just continue with the next package
+    def get_supplement_logical(self):
+        return self._get_section("supplement.logical")
 
-        raise ValueError(
-            f"No section supplement.physical.\n"
-            f"The section supplement.physical isn't defined in any of the processed packages '{ *[p.name for p in self.packages],}'."
-        )
+    def get_supplement_physical(self):
+        return self._get_section("supplement.physical")
 
     def get_shipment_postage(self):
-        for package in reversed(self.packages):
-            try:
-                return package.get_shipment_postage()
-            except KeyError:
-                pass  # we just continue with the next package
-
-        raise ValueError(
-            f"No section shipment.postage.\n"
-            f"The section shipment.postage isn't defined in any of the processed packages '{ *[p.name for p in self.packages],}'."
-        )
+        return self._get_section("shipment.postage")
 
     def get_whitespace(self):
-        for package in reversed(self.packages):
-            try:
-                return package.get_whitespace()
-            except KeyError:
-                pass  # we just continue with the next package
-
-        raise ValueError(
-            f"No section whitespace.\n"
-            f"The section whitespace isn't defined in any of the processed packages '{ *[p.name for p in self.packages],}'."
-        )
+        return self._get_section("whitespace")
 
     def get_transaction_form_page_background(self) -> TransactionFormPageBackground:
-        for package in reversed(self.packages):
-            try:
-                return package.get_transaction_form_page_background()
-            except KeyError:
-                pass  # we just continue with the next package
-
-        raise ValueError(
-            f"No section transaction_form_page_background.\n"
-            f"The section transaction_form_page_background isn't defined in any of the processed packages '{ *[p.name for p in self.packages],}'."
-        )
+        return self._get_section("transaction_form_page_background")
 
     def get_input_variables(self) -> typing.List:
-        for package in reversed(self.packages):
-            try:
-                return package.get_input_variables()
-            except KeyError:
-                pass  # we just continue with the next package
-        return []
+        resolved = self.resolved_config.section("input_variable")
+        return [] if resolved is None else resolved.value
 
     def get_transaction_form_materials(self) -> typing.List[TransactionFormMaterial]:
-        for package in reversed(self.packages):
-            try:
-                return package.get_transaction_form_materials()
-            except KeyError:
-                pass  # not all package have to have materials defined
-        raise KeyError(
-            f"no material defined.\n"
-            f"At least one material has to be defined in one of the processed packages '{ *[p.name for p in self.packages],}'."
-        )
+        resolved = self.resolved_config.section("transaction_form_material")
+        if resolved is None:
+            raise KeyError(
+                f"no material defined.\n"
+                f"At least one material has to be defined in one of the processed packages '{self._packages_names()}'."
+            )
+        return resolved.value
 
     def get_runtime_environments(self) -> typing.List[RuntimeEnvironment]:
-        runtimes = []
-        for package in reversed(self.packages):
-            try:
-                _re = package.get_runtime_environments()
-                runtimes.extend(_re)
-            except KeyError:
-                pass  # not all package have to have runtime environments defined
+        runtimes = [r.value for r in self.resolved_config.runtime_environments]
         if not runtimes:
             raise KeyError(
                 f"no runtime_environment defined.\n"
-                f"At least one runtime_environment has to be defined in one of the processed packages '{ *[p.name for p in self.packages],}'."
+                f"At least one runtime_environment has to be defined in one of the processed packages '{self._packages_names()}'."
             )
 
         return runtimes
 
     def get_test_data(self) -> Testdata:
-        for package in reversed(self.packages):
-            try:
-                return package.get_test_data()
-            except KeyError:
-                pass  # we just continue with the next package
-        return None
+        resolved = self.resolved_config.section("testdata")
+        return None if resolved is None else resolved.value
 
-    def copy_files(self):
+    def get_package_files(self) -> typing.List[dict]:
+        """Compute which source file goes to which destination in the
+        build directory.
+
+        Returns a list of dicts with the keys source and dest, and package,
+        section and destination saying where they come from.
+        """
         dests_in_sources = self.required_destinations
 
         for source_destination in dests_in_sources:
@@ -245,10 +277,72 @@ class Builder:
 
         package_files = []
         for package in self.packages:
-            decho(f"Package basepath:{package.basepath}")
-            for destination in self.available_destinations:
-                decho(f"Destination:{destination}")
-                files = package.get_source_files(destination)
+            with profile.span(f"plan {package.name}", "plan") as span:
+                _package_files = self._get_package_files_of(package)
+                span.add(files=len(_package_files))
+            package_files.extend(_package_files)
+
+        return package_files
+
+    @cached_property
+    def package_files(self) -> typing.List[dict]:
+        """The result of get_package_files, computed once. With prune set,
+        the files no form uses are left out, see prune_package_files.
+        """
+        package_files = self.get_package_files()
+        if self.prune:
+            with profile.span("prune") as span:
+                package_files = self.prune_package_files(package_files)
+                span.add(files=len(package_files))
+        return package_files
+
+    def prune_package_files(
+        self, package_files: typing.List[dict]
+    ) -> typing.List[dict]:
+        """Leave out the subforms, includes and images of the sources that
+        aren't referenced by the transaction form, directly or through the
+        files it references, or by a file that is always packaged, like
+        the .tci configs. The dropped files are reported.
+        """
+        transaction_form = self.build_package.basepath.joinpath(
+            self.build_package.transaction_form
+        ).resolve()
+        used, dropped = prune_package_files(
+            package_files, self.build_path, transaction_form
+        )
+        # on stderr, 'pfcli plan' prints the plan on stdout.
+        if dropped:
+            click.echo(f"pruned {len(dropped)} unreferenced file(s):", err=True)
+            for pf in dropped:
+                click.echo(f"  {pf['source']} ({pf['package']})", err=True)
+        return used
+
+    def set_prune(self, prune: bool):
+        if prune != self.prune:
+            self.prune = prune
+            self.__dict__.pop("package_files", None)
+
+    def invalidate(self, path: Path):
+        """Forget what is known about the file path, after it changed."""
+        self.stat_index.invalidate(path)
+        self.content_index.invalidate(path)
+        if self.prune:
+            # the file may reference other files now.
+            self.__dict__.pop("package_files", None)
+
+    def _get_package_files_of(self, package: Package) -> typing.List[dict]:
+        package_files = []
+        decho(f"Package basepath:{package.basepath}")
+        with profile.span(f"scan {package.name}", "plan") as span:
+            source_files = package.scan_sources(self.stat_index)
+            span.add(files=sum(len(files) for files in source_files.values()))
+        for destination in self.available_destinations:
+            decho(f"Destination:{destination}")
+            files = source_files.get(destination, [])
+            if not files:
+                continue
+            with profile.span(f"{package.name} / {destination}", "plan") as span:
+                span.add(files=len(files))
                 dest_path = self.get_destination_path(destination)
                 for f in files:
                     source = package.basepath.joinpath(f).resolve()
@@ -257,102 +351,416 @@ class Builder:
                     if len(f.parents) > 1:
                         f = f.relative_to(f.parents[0])
 
-                    dest = self.build_path.joinpath(dest_path, f).resolve()
+                    dest = self._dest(dest_path, f)
                     decho(f"copy from '{source}' to '{dest}'")
-                    package_files.append({"source": source, "dest": dest})
+                    package_files.append(
+                        _package_file(source, dest, package, "source", destination)
+                    )
 
-            # copy the test data
-            # test data isn't required so we catch KeyError"
+        # copy the test data
+        # test data isn't required so we catch KeyError"
+        try:
+            testdata = package.get_test_data()
             try:
-                testdata = package.get_test_data()
-                try:
-                    dest_path = self.get_destination_path(testdata.destination)
-                except KeyError:
-                    raise ValueError(
-                        f"destination missing.\n"
-                        f"testdata section in package {package.name} must have a destination."
-                    )
+                dest_path = self.get_destination_path(testdata.destination)
+            except KeyError:
+                raise ValueError(
+                    f"destination missing.\n"
+                    f"testdata section in package {package.name} must have a destination."
+                )
 
-                for testdata_file in testdata.files:
-                    testfile = testdata_file.path
-                    source = package.basepath.joinpath(testfile).resolve()
-                    # if the source file is in a subdirectory pop of
-                    # the first subdirectory.
-                    if len(testfile.parents) > 1:
-                        testfile = testfile.relative_to(testfile.parents[0])
+            for testdata_file in testdata.files:
+                testfile = testdata_file.path
+                source = package.basepath.joinpath(testfile).resolve()
+                # if the source file is in a subdirectory pop of
+                # the first subdirectory.
+                if len(testfile.parents) > 1:
+                    testfile = testfile.relative_to(testfile.parents[0])
 
-                    dest = self.build_path.joinpath(dest_path, testfile).resolve()
+                dest = self._dest(dest_path, testfile)
 
-                    decho(f"copy testdata from '{source}' to '{dest}'")
-                    package_files.append({"source": source, "dest": dest})
-            except KeyError:
-                pass
+                decho(f"copy testdata from '{source}' to '{dest}'")
+                package_files.append(
+                    _package_file(
+                        source, dest, package, "testdata", testdata.destination
+                    )
+                )
+        except KeyError:
+            pass
 
-            # copy the backgrounds
-            # backgrounds aren't required so we catch KeyError"
+        # copy the backgrounds
+        # backgrounds aren't required so we catch KeyError"
+        try:
+            backgrounds = package.get_transaction_form_page_background()
             try:
-                backgrounds = package.get_transaction_form_page_background()
-                try:
-                    dest_path = self.get_destination_path(backgrounds.destination)
-                except KeyError:
-                    raise ValueError(
-                        f"destination missing.\n"
-                        f"transactionformpagebackgrounds section in package {package.name} must have a destination."
+                dest_path = self.get_destination_path(backgrounds.destination)
+            except KeyError:
+                raise ValueError(
+                    f"destination missing.\n"
+                    f"transactionformpagebackgrounds section in package {package.name} must have a destination."
+                )
+
+            for background_file in backgrounds.files:
+                _file = background_file.path
+                source = package.basepath.joinpath(_file).resolve()
+                # if the source file is in a subdirectory pop of
+                # the first subdirectory.
+                if len(_file.parents) > 1:
+                    _file = _file.relative_to(_file.parents[0])
+
+                dest = self._dest(dest_path, _file)
+
+                decho(f"copy background from '{source}' to '{dest}'")
+                package_files.append(
+                    _package_file(
+                        source,
+                        dest,
+                        package,
+                        "transaction_form_page_background",
+                        backgrounds.destination,
                     )
+                )
+        except KeyError:
+            pass
 
-                for background_file in backgrounds.files:
-                    _file = background_file.path
-                    source = package.basepath.joinpath(_file).resolve()
-                    # if the source file is in a subdirectory pop of
-                    # the first subdirectory.
-                    if len(_file.parents) > 1:
-                        _file = _file.relative_to(_file.parents[0])
+        # copy the font definition fonts.ini
+        # a font definition is required in at least one package"
+        try:
+            fontdef = package.get_font_definition()
+            try:
+                dest_path = self.get_destination_path(fontdef["destination"])
+            except KeyError:
+                raise ValueError(
+                    f"destination missing.\n"
+                    f"fontdefinition section in package {package.name} must have a destination."
+                )
 
-                    dest = self.build_path.joinpath(dest_path, _file).resolve()
+            font_ini = fontdef["path"]
+            source = package.basepath.joinpath(font_ini).resolve()
+            # if the source file is in a subdirectory pop of
+            # the first subdirectory.
+            if len(font_ini.parents) > 1:
+                font_ini = font_ini.relative_to(font_ini.parents[0])
 
-                    decho(f"copy background from '{source}' to '{dest}'")
-                    package_files.append({"source": source, "dest": dest})
-            except KeyError:
-                pass
+            dest = self._dest(dest_path, font_ini)
 
-            # copy the font definition fonts.ini
-            # a font definition is required in at least one package"
-            try:
-                fontdef = package.get_font_definition()
-                try:
-                    dest_path = self.get_destination_path(fontdef["destination"])
-                except KeyError:
-                    raise ValueError(
-                        f"destination missing.\n"
-                        f"fontdefinition section in package {package.name} must have a destination."
-                    )
+            decho(f"copy testdata from '{source}' to '{dest}'")
+            package_files.append(
+                _package_file(
+                    source, dest, package, "fontdefinition", fontdef["destination"]
+                )
+            )
+        except KeyError:
+            pass
 
-                font_ini = fontdef["path"]
-                source = package.basepath.joinpath(font_ini).resolve()
-                # if the source file is in a subdirectory pop of
-                # the first subdirectory.
-                if len(font_ini.parents) > 1:
-                    font_ini = font_ini.relative_to(font_ini.parents[0])
+        return package_files
 
-                dest = self.build_path.joinpath(dest_path, font_ini).resolve()
+    def check_conflicts(self, package_files: typing.List[dict], conflicts: str = WARN):
+        """Report destinations that get files with different content.
 
-                decho(f"copy testdata from '{source}' to '{dest}'")
-                package_files.append({"source": source, "dest": dest})
-            except KeyError:
-                pass
+        With conflicts set to ERROR a DestinationConflictError is raised,
+        otherwise they are printed as warnings.
+        """
+        _conflicts = find_conflicts(package_files, self.content_index)
+        if _conflicts and conflicts == ERROR:
+            raise DestinationConflictError(_conflicts)
+        for dest, sources in _conflicts.items():
+            warn(
+                f"conflicting sources for {describe_conflict(dest, sources)}, "
+                "using the last one."
+            )
+
+    def copy_files(
+        self,
+        jobs: int = 1,
+        staging: str = COPY,
+        dedupe: bool = False,
+        conflicts: str = WARN,
+    ):
+        with profile.span("plan"):
+            package_files = self.package_files
+            self.check_conflicts(package_files, conflicts)
 
-        for package_file in package_files:
-            package_file["dest"].parent.mkdir(parents=True, exist_ok=True)
-            copy2(package_file["source"], package_file["dest"])
+        manifest = self._remove_stale_files(package_files)
+
+        with profile.span("copy", jobs=jobs, staging=staging) as span:
+            try:
+                copied = copy_package_files(
+                    package_files,
+                    manifest,
+                    jobs=jobs,
+                    staging=staging,
+                    content_index=self.content_index if dedupe else None,
+                )
+                decho(f"copied {copied} file(s)")
+                span.add(files=len(package_files), copied=copied)
+                span.add(bytes=self._planned_bytes(package_files))
+            finally:
+                manifest.save()
+
+    def _remove_stale_files(self, package_files: typing.List[dict]) -> BuildManifest:
+        """Remove the files of the previous build that aren't in
+        package_files. Returns the manifest of the build directory.
+        """
+        with profile.span("remove stale files") as span:
+            manifest = BuildManifest.load(self.build_path, self.stat_index)
+            for stale in manifest.remove_stale(pf["dest"] for pf in package_files):
+                decho(f"removed stale file '{stale}'")
+                span.add(files=1)
+        return manifest
+
+    def pipeline_package(
+        self,
+        options: typing.Optional[ArchiveOptions] = None,
+        staging: str = COPY,
+        conflicts: str = WARN,
+    ):
+        """Copy the files to the build directory and write the archive
+        in one pass.
+
+        Does the same as copy_files, generate_package_file and zip_package
+        together, but a file is compressed as soon as it is copied and
+        written to the archive while the next files are still copied, see
+        write_archive_pipelined. options.jobs threads copy and compress.
+        The archive is the same, except that without options.deterministic
+        the entries may be in another order.
+        """
+        options = options or ArchiveOptions()
+        with profile.span("plan"):
+            package_files = self.package_files
+            self.check_conflicts(package_files, conflicts)
+            package_files = unique_destinations(package_files)
+
+        manifest = self._remove_stale_files(package_files)
+        self.generate_package_file()
+
+        with profile.span("pipeline", jobs=options.jobs, staging=staging) as span:
+            by_dest = {pf["dest"]: pf for pf in package_files}
+            for directory in sorted({dest.parent for dest in by_dest}):
+                directory.mkdir(parents=True, exist_ok=True)
+            entries = planned_build_path_entries(
+                self.build_path,
+                [
+                    self.build_path.joinpath(BUILD_DIR_FILE),
+                    self.build_path.joinpath(RS_PACKAGE_CONFIGURATION),
+                    *by_dest,
+                ],
+            )
+            copied = 0
+            # _copy runs in the worker threads.
+            copied_lock = threading.Lock()
+
+            def _copy(entry):
+                nonlocal copied
+                package_file = by_dest.get(entry.path)
+                if package_file is not None:
+                    n = copy_package_files([package_file], manifest, staging=staging)
+                    with copied_lock:
+                        copied += n
+
+            try:
+                write_archive_pipelined(
+                    self.archive_filename,
+                    entries,
+                    options,
+                    prepare=_copy,
+                )
+            finally:
+                manifest.save()
+            decho(f"copied {copied} file(s)")
+            span.add(files=len(entries), copied=copied)
+            span.add(bytes=os.path.getsize(self.archive_filename))
+
+    def _planned_bytes(self, package_files: typing.List[dict]) -> int:
+        """The size of the source files, as far as they are in the stat
+        index.
+        """
+        size = 0
+        for pf in package_files:
+            if pf["source"] in self.stat_index:
+                size += self.stat_index.stat(pf["source"]).st_size
+        return size
 
     def generate_package_file(self):
         rs_package_file = self.build_path.joinpath(RS_PACKAGE_CONFIGURATION)
-        with open(rs_package_file, "w") as conf_file:
-            generator = get_rs_package_xml_generator(self)
-            _xml = generator.get_xml()
-            conf_file.write(_xml)
-
-    def zip_package(self):
-        _basename = self.build_package.archive_name
-        make_archive(base_name=_basename, format="zip", root_dir=self.build_path)
-        pass
+        # the xml declares utf-8, so don't depend on the locale.
+        with profile.span("generate xml") as span:
+            with open(rs_package_file, "w", encoding="utf-8") as conf_file:
+                self.write_package_xml(conf_file)
+            span.add(files=1, bytes=rs_package_file.stat().st_size)
+
+    def write_package_xml(self, out: typing.TextIO):
+        get_rs_package_xml_generator(self).write_xml(out)
+
+    def get_package_xml(self) -> str:
+        out = io.StringIO()
+        self.write_package_xml(out)
+        return out.getvalue()
+
+    @property
+    def name(self) -> str:
+        return self.build_package.name
+
+    @property
+    def archive_name(self) -> str:
+        return self.build_package.archive_name
+
+    @property
+    def archive_filename(self) -> str:
+        """The archive is written to archive_dir, the current directory
+        if it isn't set.
+        """
+        _filename = f"{self.archive_name}.zip"
+        if self.archive_dir is None:
+            return _filename
+        return str(self.archive_dir.joinpath(_filename))
+
+    def zip_package(self, options: typing.Optional[ArchiveOptions] = None):
+        with profile.span("zip") as span:
+            entries = build_path_entries(
+                self.build_path, exclude=[self.build_path.joinpath(BUILD_MANIFEST)]
+            )
+            # the files of the build directory change with every build, the
+            # content index of the builder only follows the sources.
+            write_archive(self.archive_filename, entries, options, ContentIndex())
+            span.add(files=len(entries), bytes=os.path.getsize(self.archive_filename))
+
+    def stream_package(
+        self,
+        options: typing.Optional[ArchiveOptions] = None,
+        conflicts: str = WARN,
+        pipeline: bool = False,
+    ):
+        """Write the archive straight from the source files, without
+        using the build directory. With pipeline the files are read and
+        compressed while the archive is written, see write_archive_pipelined.
+        """
+        with profile.span("plan"):
+            package_files = self.package_files
+            self.check_conflicts(package_files, conflicts)
+            package_files = unique_destinations(package_files)
+
+        with profile.span("generate xml") as span:
+            _xml = self.get_package_xml().encode("utf-8")
+            span.add(files=1, bytes=len(_xml))
+
+        with profile.span("zip") as span:
+            entries = package_file_entries(
+                self.build_path,
+                package_files,
+                generated={RS_PACKAGE_CONFIGURATION: _xml},
+                stat_index=self.stat_index,
+            )
+            if pipeline:
+                write_archive_pipelined(self.archive_filename, entries, options)
+            else:
+                write_archive(
+                    self.archive_filename, entries, options, self.content_index
+                )
+            span.add(files=len(entries), bytes=os.path.getsize(self.archive_filename))
+
+    def fingerprint(self, record: BuildRecord, options: BuildOptions) -> str:
+        """The fingerprint of building the package with options, see
+        compute_fingerprint. File hashes are taken from record if the
+        files didn't change.
+        """
+        archive = options.archive
+        settings = {
+            "cwd": os.getcwd(),  # the package xml has paths relative to it.
+            "archive": os.path.abspath(self.archive_filename),
+            "staging": options.staging,
+            "direct": options.direct,
+            "dedupe": options.dedupe,
+            "compresslevel": archive.compresslevel,
+            "stored_suffixes": sorted(archive.stored_suffixes),
+            "deterministic": archive.deterministic,
+        }
+        if archive.deterministic:
+            settings["date_time"] = os.environ.get("SOURCE_DATE_EPOCH")
+
+        package_files = self.package_files
+        record.forget_other_files(pf["source"] for pf in package_files)
+        return compute_fingerprint(
+            record, package_files, self.fingerprint_config(), settings
+        )
+
+    def fingerprint_config(self) -> dict:
+        """The configuration part of the fingerprint."""
+        return {
+            "config": self.resolved_config.as_dict(),
+            "xml": self.get_package_xml(),
+        }
+
+    def is_up_to_date(self, record: BuildRecord, fingerprint: str, direct: bool):
+        if not record.is_up_to_date(fingerprint):
+            return False
+        # the build directory is part of the output too.
+        return direct or self.build_path.joinpath(BUILD_MANIFEST).exists()
+
+    def build(self, options: typing.Optional[BuildOptions] = None) -> bool:
+        """Run all build steps.
+
+        The build is skipped if the fingerprint of the package is the same
+        as the one of the last build and its archive is unchanged, unless
+        options.clean or options.force is set. Returns False if the build
+        was skipped.
+        """
+        options = options or BuildOptions()
+        if options.pipeline and options.dedupe:
+            raise ValueError("A pipelined build can't deduplicate files.")
+        self.set_prune(options.prune)
+
+        with profile.span(f"build {self.name}"):
+            if options.clean and not options.direct:
+                # first, whatever is in the build directory can't get in
+                # the way of the build.
+                with profile.span("initialise build path", clean=True):
+                    self.initialise_build_path(clean=True)
+
+            with profile.span("resolve config", packages=len(self.packages)):
+                self.resolved_config
+
+            with profile.span("fingerprint") as span:
+                record = BuildRecord.load(self.archive_filename, self.stat_index)
+                fingerprint = self.fingerprint(record, options)
+                span.add(files=len(self.package_files))
+
+            if (
+                not options.clean
+                and not options.force
+                and self.is_up_to_date(record, fingerprint, options.direct)
+            ):
+                # the caller reports it.
+                return False
+
+            if options.direct:
+                self.stream_package(
+                    options.archive,
+                    conflicts=options.conflicts,
+                    pipeline=options.pipeline,
+                )
+            elif options.pipeline:
+                if not options.clean:
+                    with profile.span("initialise build path", clean=False):
+                        self.initialise_build_path()
+                self.pipeline_package(
+                    options.archive,
+                    staging=options.staging,
+                    conflicts=options.conflicts,
+                )
+            else:
+                if not options.clean:
+                    with profile.span("initialise build path", clean=False):
+                        self.initialise_build_path()
+                self.copy_files(
+                    jobs=options.jobs,
+                    staging=options.staging,
+                    dedupe=options.dedupe,
+                    conflicts=options.conflicts,
+                )
+                self.generate_package_file()
+                self.zip_package(options.archive)
+
+            record.update(fingerprint)
+            record.save()
+            return True
@@ -0,0 +1,569 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import os
+from pathlib import Path
+from shutil import copyfileobj
+import struct
+import tempfile
+import time
+import typing
+import zipfile
+import zlib
+
+from pfcli.config import decho
+from pfcli.package.scanner import StatIndex
+from .dedupe import ContentIndex
+
+_CHUNK_SIZE = 1024 * 1024
+# files from this size on are mentioned in the debug output.
+_LARGE_FILE_SIZE = 1024 * 1024 * 1024
+
+_MIN_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# file types that are compressed already, deflating them again only
+# costs time.
+STORED_SUFFIXES = frozenset(
+    {
+        ".png",
+        ".jpg",
+        ".jpeg",
+        ".gif",
+        ".webp",
+        ".zip",
+        ".gz",
+        ".bz2",
+        ".xz",
+        ".7z",
+    }
+)
+
+
+@dataclass
+class ArchiveOptions:
+    """How the entries of an archive are compressed.
+
+    compresslevel is the zlib level (0-9), None uses the zlib default.
+    Files with a suffix in stored_suffixes aren't compressed. Files of at
+    least parallel_threshold bytes are compressed by jobs worker threads.
+    With dedupe files with the same content are compressed once.
+
+    Files compressed ahead of being written are buffered in a temporary
+    file, so files larger than spool_limit are compressed while they are
+    written instead, to not need a second copy on disk.
+
+    deterministic archives have the entries sorted by name and the same
+    timestamp and permissions for all entries, so the same content always
+    gives the same archive. The timestamp is SOURCE_DATE_EPOCH if it's set,
+    1980-01-01 otherwise.
+    """
+
+    compresslevel: typing.Optional[int] = None
+    stored_suffixes: typing.FrozenSet[str] = STORED_SUFFIXES
+    jobs: int = 1
+    parallel_threshold: int = 1024 * 1024
+    spool_limit: int = 64 * 1024 * 1024
+    dedupe: bool = False
+    deterministic: bool = True
+
+
+@dataclass
+class ArchiveEntry:
+    """A single entry of an archive, either the file or directory at path
+    or the in memory data. stat is the stat result of path, if known.
+    """
+
+    arcname: str
+    path: typing.Optional[Path] = None
+    data: typing.Optional[bytes] = None
+    stat: typing.Optional[os.stat_result] = field(default=None, repr=False)
+
+    @property
+    def is_dir(self) -> bool:
+        return self.arcname.endswith("/")
+
+
+def _directory_info(arcname: str) -> zipfile.ZipInfo:
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(time.time())[:6])
+    zinfo.external_attr = (0o40755 << 16) | 0x10  # MS-DOS directory flag
+    return zinfo
+
+
+def _file_info(arcname: str) -> zipfile.ZipInfo:
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(time.time())[:6])
+    zinfo.external_attr = 0o100644 << 16
+    return zinfo
+
+
+def _fixed_date_time() -> typing.Tuple[int, int, int, int, int, int]:
+    """The timestamp of the entries of deterministic archives."""
+    try:
+        epoch = int(os.environ["SOURCE_DATE_EPOCH"])
+    except (KeyError, ValueError):
+        return _MIN_DATE_TIME
+    # zip can't store timestamps before 1980.
+    return max(time.gmtime(epoch)[:6], _MIN_DATE_TIME)
+
+
+def _path_info(entry: ArchiveEntry) -> zipfile.ZipInfo:
+    """The ZipInfo for entry.path, like ZipInfo.from_file but using the
+    known stat result.
+    """
+    if entry.stat is None:
+        return zipfile.ZipInfo.from_file(entry.path, entry.arcname)
+
+    date_time = time.localtime(entry.stat.st_mtime)[:6]
+    zinfo = zipfile.ZipInfo(entry.arcname, date_time)
+    zinfo.external_attr = (entry.stat.st_mode & 0xFFFF) << 16
+    zinfo.file_size = entry.stat.st_size
+    return zinfo
+
+
+def _entry_info(entry: ArchiveEntry, options: ArchiveOptions) -> zipfile.ZipInfo:
+    if entry.path is not None:
+        zinfo = _path_info(entry)
+    elif entry.is_dir:
+        zinfo = _directory_info(entry.arcname)
+    else:
+        zinfo = _file_info(entry.arcname)
+
+    if options.deterministic:
+        zinfo.date_time = _fixed_date_time()
+        zinfo.create_system = 3  # unix, zipfile uses 0 on windows
+        if entry.is_dir:
+            zinfo.external_attr = (0o40755 << 16) | 0x10
+        elif (zinfo.external_attr >> 16) & 0o111:
+            zinfo.external_attr = 0o100755 << 16
+        else:
+            zinfo.external_attr = 0o100644 << 16
+    return zinfo
+
+
+def _size(entry: ArchiveEntry) -> int:
+    if entry.stat is None:
+        return entry.path.stat().st_size
+    return entry.stat.st_size
+
+
+def _compress_type(entry: ArchiveEntry, options: ArchiveOptions) -> int:
+    if Path(entry.arcname).suffix.lower() in options.stored_suffixes:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+@dataclass
+class _Deflated:
+    crc: int
+    file_size: int
+    compress_size: int
+    data: typing.BinaryIO = field(repr=False)
+
+
+def _deflate(path: Path, compresslevel: typing.Optional[int]) -> _Deflated:
+    """Compress path the way zipfile does, into a temporary file."""
+    if compresslevel is None:
+        compresslevel = zlib.Z_DEFAULT_COMPRESSION
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+
+    data = tempfile.SpooledTemporaryFile(max_size=_CHUNK_SIZE * 8)
+    crc = 0
+    file_size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            data.write(compressor.compress(chunk))
+    data.write(compressor.flush())
+
+    compress_size = data.tell()
+    data.seek(0)
+    return _Deflated(crc, file_size, compress_size, data)
+
+
+def _write_raw(
+    zf: zipfile.ZipFile,
+    zinfo: zipfile.ZipInfo,
+    data: typing.BinaryIO,
+    length: typing.Optional[int] = None,
+):
+    """Append an entry with already compressed data to zf.
+
+    zipfile has no API for this, so this does what ZipFile.write does
+    after compressing. CRC and sizes have to be set in zinfo, the local
+    header is written once and ZIP64 is used when the sizes need it.
+    length bytes are copied from data, all of it if length is None.
+    """
+    zf.fp.seek(zf.start_dir)
+    zinfo.header_offset = zf.fp.tell()
+    zf.fp.write(zinfo.FileHeader(None))
+    if length is None:
+        copyfileobj(data, zf.fp, _CHUNK_SIZE)
+    else:
+        while length > 0:
+            chunk = data.read(min(length, _CHUNK_SIZE))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated data for entry '{zinfo.filename}'")
+            zf.fp.write(chunk)
+            length -= len(chunk)
+
+    zf.start_dir = zf.fp.tell()
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+
+
+def _write_deflated(
+    zf: zipfile.ZipFile,
+    entry: ArchiveEntry,
+    deflated: _Deflated,
+    options: ArchiveOptions,
+):
+    """Write the compressed data of deflated as entry. The data is left
+    open, so it can be written again for entries with the same content.
+    """
+    zinfo = _entry_info(entry, options)
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.CRC = deflated.crc
+    zinfo.file_size = deflated.file_size
+    zinfo.compress_size = deflated.compress_size
+
+    deflated.data.seek(0)
+    _write_raw(zf, zinfo, deflated.data)
+
+
+def _copy_raw(zf: zipfile.ZipFile, source: zipfile.ZipFile, info: zipfile.ZipInfo):
+    """Copy the entry info of source to zf without decompressing it."""
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local header for entry '{info.filename}'")
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    source.fp.seek(
+        info.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+    )
+
+    zinfo = zipfile.ZipInfo(info.filename, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.external_attr = info.external_attr
+    zinfo.create_system = info.create_system
+    zinfo.CRC = info.CRC
+    zinfo.file_size = info.file_size
+    zinfo.compress_size = info.compress_size
+
+    _write_raw(zf, zinfo, source.fp, info.compress_size)
+
+
+def _write_file(
+    zf: zipfile.ZipFile,
+    entry: ArchiveEntry,
+    zinfo: zipfile.ZipInfo,
+    compresslevel: typing.Optional[int],
+):
+    """ZipFile.write, with the given ZipInfo.
+
+    The file is streamed in chunks, zipfile uses ZIP64 for it if its size
+    in zinfo needs it.
+    """
+    zinfo._compresslevel = compresslevel  # what ZipFile.write sets too
+    if zinfo.file_size >= _LARGE_FILE_SIZE:
+        decho(f"writing large file '{entry.path}' ({zinfo.file_size} bytes)")
+    with open(entry.path, "rb") as src, zf.open(zinfo, "w") as dest:
+        copyfileobj(src, dest, _CHUNK_SIZE)
+
+
+def _write_entry(zf: zipfile.ZipFile, entry: ArchiveEntry, options: ArchiveOptions):
+    zinfo = _entry_info(entry, options)
+    if entry.is_dir:
+        zinfo.file_size = 0
+        zf.writestr(zinfo, b"")
+    elif entry.path is not None:
+        zinfo.compress_type = _compress_type(entry, options)
+        _write_file(zf, entry, zinfo, options.compresslevel)
+    else:
+        zf.writestr(zinfo, entry.data, compress_type=_compress_type(entry, options))
+
+
+def _is_spooled_file(entry: ArchiveEntry, options: ArchiveOptions) -> bool:
+    """If entry can be compressed ahead into a temporary file."""
+    return _is_deflated_file(entry, options) and _size(entry) <= options.spool_limit
+
+
+def _is_deflated_file(entry: ArchiveEntry, options: ArchiveOptions) -> bool:
+    return (
+        entry.path is not None
+        and not entry.is_dir
+        and _compress_type(entry, options) == zipfile.ZIP_DEFLATED
+    )
+
+
+def write_archive(
+    zip_filename: str,
+    entries: typing.List[ArchiveEntry],
+    options: typing.Optional[ArchiveOptions] = None,
+    content_index: typing.Optional[ContentIndex] = None,
+):
+    """Write entries to zip_filename in the given order.
+
+    With options.dedupe, files with the same content are compressed once
+    and the compressed data is written for each of them. content_index
+    is used to find them, a new one if it isn't given.
+
+    With options.jobs > 1 the files from options.parallel_threshold up to
+    options.spool_limit bytes are compressed by worker threads, a few
+    entries ahead of the one being written.
+    """
+    options = options or ArchiveOptions()
+    if options.deterministic:
+        entries = sorted(entries, key=lambda entry: entry.arcname)
+
+    # entries with the same content share a key, the others use their index.
+    keys: typing.Dict[int, typing.Any] = {}
+    if options.dedupe:
+        content_index = content_index or ContentIndex()
+        files = {
+            index: entry.path
+            for index, entry in enumerate(entries)
+            if _is_spooled_file(entry, options)
+        }
+        duplicates = content_index.duplicates(files.values())
+        keys = {
+            index: duplicates[path]
+            for index, path in files.items()
+            if path in duplicates
+        }
+    uses = collections.Counter(keys.values())
+
+    with zipfile.ZipFile(
+        zip_filename,
+        "w",
+        compression=zipfile.ZIP_DEFLATED,
+        compresslevel=options.compresslevel,
+        allowZip64=True,
+    ) as zf, ThreadPoolExecutor(max_workers=options.jobs) as executor:
+        # compress the large files in the background, the results are
+        # written in order when it's their turn. Only a few are compressed
+        # ahead, each of them takes memory or temporary disk space.
+        deflating = {}
+        deflated = {}
+        ahead = enumerate(entries if options.jobs > 1 else [])
+        window = options.jobs * 2
+
+        def _compress_ahead():
+            while len(deflating) < window:
+                index, entry = next(ahead, (None, None))
+                if entry is None:
+                    return
+                key = keys.get(index, index)
+                if (
+                    key not in deflating
+                    and key not in deflated
+                    and _is_spooled_file(entry, options)
+                    and _size(entry) >= options.parallel_threshold
+                ):
+                    deflating[key] = executor.submit(
+                        _deflate, entry.path, options.compresslevel
+                    )
+
+        for index, entry in enumerate(entries):
+            _compress_ahead()
+            key = keys.get(index, index)
+            if key in deflating:
+                deflated[key] = deflating.pop(key).result()
+            elif index in keys and key not in deflated:
+                deflated[key] = _deflate(entry.path, options.compresslevel)
+
+            if key not in deflated:
+                _write_entry(zf, entry, options)
+                continue
+
+            _write_deflated(zf, entry, deflated[key], options)
+            uses[key] -= 1
+            if uses[key] <= 0:
+                deflated.pop(key).data.close()
+
+
+def write_archive_pipelined(
+    zip_filename: str,
+    entries: typing.List[ArchiveEntry],
+    options: typing.Optional[ArchiveOptions] = None,
+    prepare: typing.Optional[typing.Callable[[ArchiveEntry], None]] = None,
+):
+    """Write entries to zip_filename like write_archive, with reading,
+    compressing and writing overlapping.
+
+    Every file entry goes through one of options.jobs worker threads:
+    prepare(entry) is called first, to put the file at entry.path, then
+    the file is compressed. The main thread writes the results in order
+    as soon as they are ready, while the workers continue with the next
+    entries. At most a few entries per worker are in flight, so the
+    memory used doesn't depend on the number or size of the files.
+    Files larger than options.spool_limit are compressed by the main
+    thread while they are written.
+    """
+    options = options or ArchiveOptions()
+    if options.deterministic:
+        entries = sorted(entries, key=lambda entry: entry.arcname)
+    window = max(2, options.jobs * 4)
+
+    def _process(entry: ArchiveEntry) -> typing.Optional[_Deflated]:
+        if prepare is not None:
+            prepare(entry)
+        if _is_spooled_file(entry, options):
+            return _deflate(entry.path, options.compresslevel)
+        return None
+
+    with zipfile.ZipFile(
+        zip_filename,
+        "w",
+        compression=zipfile.ZIP_DEFLATED,
+        compresslevel=options.compresslevel,
+        allowZip64=True,
+    ) as zf, ThreadPoolExecutor(max_workers=options.jobs) as executor:
+        pending = collections.deque()
+
+        def _write_next():
+            entry, future = pending.popleft()
+            deflated = None if future is None else future.result()
+            if deflated is None:
+                _write_entry(zf, entry, options)
+            else:
+                with deflated.data:
+                    _write_deflated(zf, entry, deflated, options)
+
+        try:
+            for entry in entries:
+                future = None
+                if entry.path is not None and not entry.is_dir:
+                    future = executor.submit(_process, entry)
+                pending.append((entry, future))
+                while len(pending) > window:
+                    _write_next()
+            while pending:
+                _write_next()
+        except BaseException:
+            for _, future in pending:
+                if future is not None:
+                    future.cancel()
+            raise
+
+
+def update_archive(
+    zip_filename: str,
+    entries: typing.List[ArchiveEntry],
+    options: typing.Optional[ArchiveOptions] = None,
+):
+    """Replace the entries with the same names as entries in the archive
+    zip_filename.
+
+    The other entries are copied as they are, without compressing them
+    again, entries that aren't in the archive yet are appended. The
+    archive is replaced once the new one is complete.
+    """
+    options = options or ArchiveOptions()
+    replacements = {entry.arcname: entry for entry in entries}
+
+    directory = os.path.dirname(os.path.abspath(zip_filename))
+    fd, tmp_name = tempfile.mkstemp(dir=directory, suffix=".zip.tmp")
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(zip_filename) as source, zipfile.ZipFile(
+            tmp_name,
+            "w",
+            compression=zipfile.ZIP_DEFLATED,
+            compresslevel=options.compresslevel,
+            allowZip64=True,
+        ) as zf:
+            for info in source.infolist():
+                entry = replacements.pop(info.filename, None)
+                if entry is None:
+                    _copy_raw(zf, source, info)
+                else:
+                    _write_entry(zf, entry, options)
+            for entry in replacements.values():
+                _write_entry(zf, entry, options)
+        os.replace(tmp_name, zip_filename)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def build_path_entries(
+    build_path: Path, exclude: typing.Iterable[Path] = ()
+) -> typing.List[ArchiveEntry]:
+    """The entries for the content of build_path.
+
+    The layout is the same as the one of shutil.make_archive, paths in
+    exclude are left out.
+    """
+    exclude = set(exclude)
+    entries = []
+
+    for dirpath, dirnames, filenames in os.walk(build_path):
+        dirpath = Path(dirpath)
+        arcdirpath = dirpath.relative_to(build_path)
+        for name in sorted(dirnames):
+            path = dirpath.joinpath(name)
+            entries.append(
+                ArchiveEntry(f"{arcdirpath.joinpath(name).as_posix()}/", path)
+            )
+        for name in filenames:
+            path = dirpath.joinpath(name)
+            if path in exclude or not path.is_file():
+                continue
+            entries.append(ArchiveEntry(arcdirpath.joinpath(name).as_posix(), path))
+
+    return entries
+
+
+def _directory_entries(arcnames: typing.Iterable[str]) -> typing.List[ArchiveEntry]:
+    """The entries for the directories the files arcnames are in."""
+    directories = set()
+    for arcname in arcnames:
+        directories.update(p.as_posix() for p in Path(arcname).parents)
+    directories.discard(".")
+    return [ArchiveEntry(f"{directory}/") for directory in sorted(directories)]
+
+
+def planned_build_path_entries(
+    build_path: Path, paths: typing.Iterable[Path]
+) -> typing.List[ArchiveEntry]:
+    """The entries build_path_entries will return once the files paths
+    are in build_path. The files don't have to exist yet.
+    """
+    arcnames = {path: path.relative_to(build_path).as_posix() for path in paths}
+    entries = _directory_entries(arcnames.values())
+    entries.extend(ArchiveEntry(arcname, path) for path, arcname in arcnames.items())
+    return entries
+
+
+def package_file_entries(
+    build_path: Path,
+    package_files: typing.List[dict],
+    generated: typing.Dict[str, bytes],
+    stat_index: typing.Optional[StatIndex] = None,
+) -> typing.List[ArchiveEntry]:
+    """The entries for package_files, taken straight from their sources.
+
+    The destinations in package_files are paths in build_path, they
+    are stored relative to it, like build_path_entries would if the files
+    had been copied there. generated maps archive names to the content of
+    files that don't exist on disk. Stat results are taken from stat_index.
+    """
+    stat_index = stat_index or StatIndex()
+    arcnames = [
+        package_file["dest"].relative_to(build_path).as_posix()
+        for package_file in package_files
+    ]
+
+    entries = _directory_entries(arcnames)
+    entries.extend(
+        ArchiveEntry(arcname, data=data) for arcname, data in generated.items()
+    )
+    entries.extend(
+        ArchiveEntry(
+            arcname,
+            package_file["source"],
+            stat=stat_index.stat(package_file["source"]),
+        )
+        for arcname, package_file in zip(arcnames, package_files)
+    )
+    return entries
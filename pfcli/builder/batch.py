@@ -0,0 +1,116 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+import time
+import typing
+
+from pfcli import config
+from pfcli.config import decho
+from pfcli.package import load_package
+from pfcli.package.workspace import find_package_paths, RS_PACKAGE
+from . import Builder, BuildOptions
+
+
+@dataclass
+class BuildResult:
+    path: Path
+    name: str
+    ok: bool
+    seconds: float
+    error: typing.Optional[str] = None
+    # False if the package didn't change since the last build.
+    built: bool = True
+
+
+def _init_worker(debug: bool, use_cache: bool):
+    config.set_debug(debug)
+    config.set_use_cache(use_cache)
+
+
+def _build(
+    path: Path, options: BuildOptions, archive_dir: typing.Optional[Path]
+) -> BuildResult:
+    start = time.perf_counter()
+    name = path.name
+    try:
+        package = load_package(path)
+        name = package.name
+        builder = Builder(package, archive_dir=archive_dir or package.basepath)
+        built = builder.build(options)
+    except Exception as err:  # one broken package must not stop the others
+        return BuildResult(
+            path, name, False, time.perf_counter() - start, f"{err}".strip()
+        )
+    return BuildResult(path, name, True, time.perf_counter() - start, built=built)
+
+
+def _package_type(path: Path) -> typing.Optional[str]:
+    """The type in the config of the package path, None if it can't be
+    read.
+    """
+    try:
+        return config.load(path).get("type")
+    except Exception:
+        return None
+
+
+def build_all(
+    root: Path,
+    options: typing.Optional[BuildOptions] = None,
+    processes: int = 1,
+    archive_dir: typing.Optional[Path] = None,
+) -> typing.List[BuildResult]:
+    """Build every package of type rs_package below root.
+
+    All package configs are loaded up front, so each include is parsed
+    once and is in the package cache before the builds start. The builds
+    run in processes worker processes. Workers started with fork inherit
+    the loaded packages, otherwise each worker loads an include once and
+    reuses it for all the builds it runs.
+
+    The archives are written to archive_dir, the directory of each
+    package if it isn't set.
+    """
+    options = options or BuildOptions()
+    results = []
+
+    to_build = []
+    for path in find_package_paths(root):
+        start = time.perf_counter()
+        try:
+            package_type = load_package(path).config.get("type")
+        except Exception as err:
+            # only packages that would be built fail, an include that
+            # can't be loaded fails the packages including it.
+            if _package_type(path) not in (RS_PACKAGE, None):
+                decho(f"skipping '{path}', it can't be loaded: {err}")
+                continue
+            results.append(
+                BuildResult(
+                    path, path.name, False, time.perf_counter() - start, str(err)
+                )
+            )
+            continue
+        if package_type == RS_PACKAGE:
+            to_build.append(path)
+        else:
+            decho(f"skipping '{path}', it isn't a {RS_PACKAGE}")
+
+    if processes > 1 and len(to_build) > 1:
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(config.get_debug(), config.get_use_cache()),
+        ) as executor:
+            results.extend(
+                executor.map(
+                    _build,
+                    to_build,
+                    [options] * len(to_build),
+                    [archive_dir] * len(to_build),
+                )
+            )
+    else:
+        results.extend(_build(path, options, archive_dir) for path in to_build)
+
+    return sorted(results, key=lambda result: result.path)
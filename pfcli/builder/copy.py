@@ -0,0 +1,221 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+from shutil import copy2, copystat
+import typing
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
+
+from pfcli.config import (
+    decho,
+    COPY,
+    HARDLINK,
+    REFLINK,
+    SYMLINK,
+    STAGING_STRATEGIES,
+)
+from .dedupe import ContentIndex
+from .manifest import BuildManifest
+
+# ioctl request to clone a file on linux (btrfs, xfs, ...)
+_FICLONE = 0x40049409
+
+
+class CopyError(OSError):
+    """Raised after all copies have run, if at least one of them failed."""
+
+    def __init__(self, failures: typing.List[typing.Tuple[dict, OSError]]):
+        self.failures = failures
+        lines = [
+            f"copy from '{package_file['source']}' to '{package_file['dest']}' failed: {err}"
+            for package_file, err in failures
+        ]
+        super().__init__(
+            f"{len(failures)} file(s) could not be copied.\n" + "\n".join(lines)
+        )
+
+
+def unique_destinations(package_files: typing.List[dict]) -> typing.List[dict]:
+    """Return package_files with only the last entry for every destination.
+
+    Copying one after the other, the last copy to a destination wins, so
+    the result is the same as copying all entries in order.
+    """
+    by_dest = {}
+    for package_file in package_files:
+        by_dest.pop(package_file["dest"], None)
+        by_dest[package_file["dest"]] = package_file
+    return list(by_dest.values())
+
+
+def _reflink(source: Path, dest: Path):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+    copystat(source, dest)
+
+
+def _copy_file_range(source: Path, dest: Path):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError("copy_file_range is not supported on this platform")
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        size = os.fstat(src.fileno()).st_size
+        copied = 0
+        while True:
+            n = os.copy_file_range(src.fileno(), dst.fileno(), 1024 * 1024 * 1024)
+            if not n:
+                break
+            copied += n
+    # some file systems end the copy early, the next way to stage copies it.
+    if copied != size:
+        raise OSError(f"copy_file_range copied {copied} of {size} bytes")
+    copystat(source, dest)
+
+
+def _symlink(source: Path, dest: Path):
+    os.symlink(source, dest)
+
+
+def _copy(source: Path, dest: Path):
+    copy2(source, dest)
+
+
+# the ways to stage a file, tried in order until one succeeds.
+_STAGING_CHAINS = {
+    # copy_file_range copies in the kernel and can share the data on file
+    # systems with reflinks, the fallback uses sendfile where it can.
+    COPY: [_copy_file_range, _copy],
+    HARDLINK: [os.link, _copy],
+    REFLINK: [_reflink, _copy_file_range, _copy],
+    SYMLINK: [_symlink, _copy],
+}
+
+
+def stage_file(source: Path, dest: Path, staging: str = COPY):
+    """Put source at dest using the staging strategy.
+
+    If the file system can't do the requested strategy the next best one
+    is used, a plain copy being the last resort.
+    """
+    # dest may be a link to source from an earlier build, writing
+    # through it would modify the source.
+    dest.unlink(missing_ok=True)
+
+    *attempts, last = _STAGING_CHAINS[staging]
+    for attempt in attempts:
+        try:
+            attempt(source, dest)
+            return
+        except OSError as err:
+            decho(f"{attempt.__name__} of '{source}' failed ({err}), falling back")
+            dest.unlink(missing_ok=True)
+    last(source, dest)
+
+
+def _copy_file(
+    package_file: dict,
+    manifest: BuildManifest,
+    staging: str,
+    original: typing.Optional[Path] = None,
+    sha256: typing.Optional[str] = None,
+) -> bool:
+    """Copy a package file, unless it's current.
+
+    With original, the file is a hardlink to original, a file in the
+    build directory with the same content, instead.
+    """
+    source, dest = package_file["source"], package_file["dest"]
+    if manifest.is_current(source, dest, staging):
+        decho(f"unchanged '{dest}'")
+        return False
+    # a failed copy must not leave an entry for a half written file.
+    manifest.discard(dest)
+    if original is None:
+        stage_file(source, dest, staging)
+    else:
+        decho(f"'{dest}' has the same content as '{original}'")
+        stage_file(original, dest, HARDLINK)
+    manifest.record(source, dest, staging, sha256=sha256)
+    return True
+
+
+def copy_package_files(
+    package_files: typing.List[dict],
+    manifest: BuildManifest,
+    jobs: int = 1,
+    staging: str = COPY,
+    content_index: typing.Optional[ContentIndex] = None,
+) -> int:
+    """Copy all package files that aren't current in the manifest.
+
+    The destination directories are created up front, the files are then
+    copied by jobs worker threads. Failures don't stop the other copies,
+    they are raised together as CopyError at the end.
+
+    How a file gets to its destination is chosen by staging, see
+    stage_file. With a content_index files with the same content are
+    copied once, the other destinations become hardlinks to that copy.
+    They share the data in the build directory, but not with the sources.
+
+    Returns the number of copied files.
+    """
+    package_files = unique_destinations(package_files)
+
+    for directory in sorted({pf["dest"].parent for pf in package_files}):
+        directory.mkdir(parents=True, exist_ok=True)
+
+    # the first file with some content is copied, the others link to it
+    # once it's there.
+    firsts = []
+    others = []
+    originals = {}
+    if content_index is not None:
+        keys = content_index.duplicates(pf["source"] for pf in package_files)
+        first_dests = {}
+        for package_file in package_files:
+            key = keys.get(package_file["source"], package_file["source"])
+            if key in first_dests:
+                originals[package_file["dest"]] = first_dests[key]
+                others.append(package_file)
+            else:
+                first_dests[key] = package_file["dest"]
+                firsts.append(package_file)
+    else:
+        firsts = package_files
+
+    failures = []
+    copied = 0
+
+    def _run(package_file):
+        original = originals.get(package_file["dest"])
+        sha256 = None
+        if content_index is not None:
+            sha256 = content_index.known_hash(package_file["source"])
+        try:
+            return _copy_file(package_file, manifest, staging, original, sha256), None
+        except OSError as err:
+            return False, err
+
+    for group in (firsts, others):
+        if jobs > 1:
+            # every destination is handled by exactly one worker, so
+            # workers never touch the same manifest entry.
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(_run, group))
+        else:
+            results = [_run(package_file) for package_file in group]
+
+        for package_file, (was_copied, err) in zip(group, results):
+            if err is not None:
+                failures.append((package_file, err))
+            elif was_copied:
+                copied += 1
+
+    if failures:
+        raise CopyError(failures)
+
+    return copied
@@ -0,0 +1,101 @@
+from collections import defaultdict
+from pathlib import Path
+import typing
+
+from pfcli.package.scanner import StatIndex
+from .manifest import file_hash
+
+
+class DestinationConflictError(ValueError):
+    """Raised when different files would be copied to the same destination."""
+
+    def __init__(self, conflicts: typing.Dict[Path, typing.List[Path]]):
+        self.conflicts = conflicts
+        super().__init__(
+            f"{len(conflicts)} destination(s) have more than one source.\n"
+            + "\n".join(
+                describe_conflict(dest, sources) for dest, sources in conflicts.items()
+            )
+        )
+
+
+def describe_conflict(dest: Path, sources: typing.List[Path]) -> str:
+    _sources = ", ".join(f"'{source}'" for source in sources)
+    return f"'{dest}' from {_sources}"
+
+
+class ContentIndex:
+    """Finds files with the same content.
+
+    Only files that have the same size as another file are hashed, the
+    hashes are computed once per path.
+    """
+
+    def __init__(self, stat_index: typing.Optional[StatIndex] = None):
+        self.stat_index = stat_index or StatIndex()
+        self._hashes: typing.Dict[Path, str] = {}
+
+    def hash(self, path: Path) -> str:
+        try:
+            return self._hashes[path]
+        except KeyError:
+            digest = self._hashes[path] = file_hash(path)
+            return digest
+
+    def invalidate(self, path: Path):
+        """Forget the hash of path, e.g. because it changed."""
+        self._hashes.pop(path, None)
+
+    def known_hash(self, path: Path) -> typing.Optional[str]:
+        """The hash of path, if it was computed already."""
+        return self._hashes.get(path)
+
+    def same_content(self, paths: typing.Iterable[Path]) -> bool:
+        paths = list(dict.fromkeys(paths))
+        if len(paths) < 2:
+            return True
+        if len({self.stat_index.stat(path).st_size for path in paths}) > 1:
+            return False
+        return len({self.hash(path) for path in paths}) == 1
+
+    def duplicates(self, paths: typing.Iterable[Path]) -> typing.Dict[Path, str]:
+        """Map every path whose content equals the content of another path
+        to a key identifying that content. Paths with unique content are
+        left out.
+        """
+        by_size = defaultdict(list)
+        for path in dict.fromkeys(paths):
+            by_size[self.stat_index.stat(path).st_size].append(path)
+
+        keys = {}
+        for size, same_size in by_size.items():
+            # there is nothing to save for empty files.
+            if len(same_size) < 2 or size == 0:
+                continue
+            by_hash = defaultdict(list)
+            for path in same_size:
+                by_hash[self.hash(path)].append(path)
+            for digest, same_hash in by_hash.items():
+                if len(same_hash) > 1:
+                    keys.update((path, digest) for path in same_hash)
+        return keys
+
+
+def find_conflicts(
+    package_files: typing.List[dict], content_index: ContentIndex
+) -> typing.Dict[Path, typing.List[Path]]:
+    """The destinations in package_files that get files with different
+    content, with their sources in order.
+
+    The same file or files with identical content copied to one
+    destination aren't a conflict.
+    """
+    sources = defaultdict(list)
+    for package_file in package_files:
+        sources[package_file["dest"]].append(package_file["source"])
+
+    return {
+        dest: list(dict.fromkeys(_sources))
+        for dest, _sources in sources.items()
+        if not content_index.same_content(_sources)
+    }
@@ -0,0 +1,197 @@
+from dataclasses import dataclass, field
+import json
+import os
+import tempfile
+import typing
+import zipfile
+
+from .archive import _copy_raw
+from .manifest import file_hash
+
+DELTA_VERSION = 1
+# the manifest of a delta archive is stored in it under this name.
+DELTA_MANIFEST = ".pfcli-delta.json"
+
+
+def _entry_key(info: zipfile.ZipInfo) -> typing.List:
+    """What has to be the same for an entry to be unchanged. Besides size
+    and CRC that's what makes its compressed data and headers differ, so
+    the new archive can be put together again from the old entries.
+    """
+    return [
+        info.file_size,
+        info.CRC,
+        info.compress_size,
+        info.compress_type,
+        list(info.date_time),
+        info.external_attr,
+    ]
+
+
+@dataclass
+class ArchiveIndex:
+    """What is needed to compare an archive with another one: the sizes,
+    CRC and attributes of each entry from its central directory, and the
+    hash of the archive file.
+    """
+
+    name: str
+    sha256: str
+    entries: typing.Dict[str, typing.List] = field(default_factory=dict)
+
+    @classmethod
+    def read(cls, zip_filename: str) -> "ArchiveIndex":
+        try:
+            with zipfile.ZipFile(zip_filename) as zf:
+                entries = {info.filename: _entry_key(info) for info in zf.infolist()}
+        except zipfile.BadZipFile as err:
+            raise ValueError(f"'{zip_filename}' is not a valid zip archive: {err}")
+        return cls(os.path.basename(zip_filename), file_hash(zip_filename), entries)
+
+
+@dataclass
+class DeltaManifest:
+    """The changes between a base archive and a new one.
+
+    changed entries have a different content, or are compressed or
+    stored differently. entries are the names of all entries of the new
+    archive in their order, so the new archive can be put together again
+    from the base and the delta.
+    """
+
+    base: typing.Dict[str, str]
+    archive: typing.Dict[str, str]
+    added: typing.List[str] = field(default_factory=list)
+    changed: typing.List[str] = field(default_factory=list)
+    removed: typing.List[str] = field(default_factory=list)
+    entries: typing.List[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "version": DELTA_VERSION,
+            "base": self.base,
+            "archive": self.archive,
+            "added": self.added,
+            "changed": self.changed,
+            "removed": self.removed,
+            "entries": self.entries,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DeltaManifest":
+        if data.get("version") != DELTA_VERSION:
+            raise ValueError(f"Unsupported delta version '{data.get('version')}'.")
+        try:
+            return cls(
+                base=data["base"],
+                archive=data["archive"],
+                added=data["added"],
+                changed=data["changed"],
+                removed=data["removed"],
+                entries=data["entries"],
+            )
+        except KeyError as err:
+            raise ValueError(f"Invalid delta manifest, {err} is missing.")
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.added)} added, {len(self.changed)} changed, "
+            f"{len(self.removed)} removed"
+        )
+
+
+def compare_archives(base: ArchiveIndex, new: ArchiveIndex) -> DeltaManifest:
+    return DeltaManifest(
+        base={"name": base.name, "sha256": base.sha256},
+        archive={"name": new.name, "sha256": new.sha256},
+        added=[name for name in new.entries if name not in base.entries],
+        changed=[
+            name
+            for name, info in new.entries.items()
+            if name in base.entries and base.entries[name] != info
+        ],
+        removed=[name for name in base.entries if name not in new.entries],
+        entries=list(new.entries),
+    )
+
+
+def write_delta(
+    base: ArchiveIndex, zip_filename: str, delta_filename: str
+) -> DeltaManifest:
+    """Write the entries of the archive zip_filename that were added or
+    changed since base to delta_filename, with the manifest.
+
+    The entries are copied as they are, without compressing them again.
+    """
+    manifest = compare_archives(base, ArchiveIndex.read(zip_filename))
+    delta_entries = set(manifest.added) | set(manifest.changed)
+
+    with zipfile.ZipFile(zip_filename) as source, zipfile.ZipFile(
+        delta_filename, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True
+    ) as zf:
+        zf.writestr(DELTA_MANIFEST, json.dumps(manifest.to_dict(), indent=2))
+        for info in source.infolist():
+            if info.filename in delta_entries:
+                _copy_raw(zf, source, info)
+    return manifest
+
+
+def read_delta_manifest(delta_filename: str) -> DeltaManifest:
+    try:
+        with zipfile.ZipFile(delta_filename) as zf:
+            data = zf.read(DELTA_MANIFEST)
+    except (zipfile.BadZipFile, KeyError):
+        raise ValueError(f"'{delta_filename}' is not a delta archive.")
+    return DeltaManifest.from_dict(json.loads(data))
+
+
+def apply_delta(
+    base_filename: str, delta_filename: str, zip_filename: str
+) -> DeltaManifest:
+    """Put the archive the delta was made from together from the base
+    archive and the delta, and write it to zip_filename.
+
+    The base has to be the archive the delta was made against. The
+    entries are copied without compressing them again, so the result is
+    the same file as the archive the delta was made from, which is
+    checked by its hash.
+    """
+    manifest = read_delta_manifest(delta_filename)
+    if file_hash(base_filename) != manifest.base["sha256"]:
+        raise ValueError(
+            f"'{base_filename}' is not the archive the delta was made against, "
+            f"that was '{manifest.base['name']}'."
+        )
+
+    directory = os.path.dirname(os.path.abspath(zip_filename))
+    fd, tmp_name = tempfile.mkstemp(dir=directory, suffix=".zip.tmp")
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(base_filename) as base, zipfile.ZipFile(
+            delta_filename
+        ) as delta, zipfile.ZipFile(tmp_name, "w", allowZip64=True) as zf:
+            delta_entries = set(manifest.added) | set(manifest.changed)
+            for name in manifest.entries:
+                source = delta if name in delta_entries else base
+                try:
+                    info = source.getinfo(name)
+                except KeyError:
+                    raise ValueError(
+                        f"Entry '{name}' is missing in '{source.filename}'."
+                    )
+                _copy_raw(zf, source, info)
+
+        if file_hash(tmp_name) != manifest.archive["sha256"]:
+            raise ValueError(
+                f"Applying the delta didn't give the archive "
+                f"'{manifest.archive['name']}' it was made from."
+            )
+        os.replace(tmp_name, zip_filename)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    return manifest
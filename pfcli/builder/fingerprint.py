@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import typing
+
+from pfcli import __version__
+from pfcli.config import decho, cache_dir
+from pfcli.package.scanner import StatIndex
+from .manifest import file_hash
+
+FINGERPRINT_VERSION = 1
+
+
+class BuildRecord:
+    """The fingerprint of the last build of an archive, with what is
+    needed to compute the next one quickly.
+
+    The content hashes of the input files are kept with their size and
+    mtime, so only files that changed are hashed again. Records are
+    stored in the cache directory, one per archive.
+    """
+
+    def __init__(
+        self, archive_filename: str, stat_index: typing.Optional[StatIndex] = None
+    ):
+        self.archive_filename = os.path.abspath(archive_filename)
+        self.stat_index = stat_index or StatIndex()
+        self.fingerprint: typing.Optional[str] = None
+        # size and mtime of the archive written by the build.
+        self.archive: typing.Optional[typing.List[int]] = None
+        # source path -> [size, mtime_ns, sha256]
+        self.files: typing.Dict[str, typing.List] = {}
+
+    @property
+    def path(self) -> Path:
+        name = hashlib.sha1(self.archive_filename.encode("utf-8")).hexdigest()
+        return cache_dir().joinpath("builds", f"{name}.json")
+
+    @classmethod
+    def load(
+        cls, archive_filename: str, stat_index: typing.Optional[StatIndex] = None
+    ) -> "BuildRecord":
+        record = cls(archive_filename, stat_index)
+        try:
+            with open(record.path, "rb") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return record
+
+        if data.get("version") != FINGERPRINT_VERSION:
+            return record
+        record.fingerprint = data["fingerprint"]
+        record.archive = data["archive"]
+        record.files = data["files"]
+        return record
+
+    def save(self):
+        data = {
+            "version": FINGERPRINT_VERSION,
+            "fingerprint": self.fingerprint,
+            "archive": self.archive,
+            "files": self.files,
+        }
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as err:
+            decho(f"could not save the build record '{self.path}': {err}")
+
+    def file_hash(self, source: Path) -> str:
+        """The content hash of source, from the record if the file has
+        the same size and mtime as in the last build.
+        """
+        stat = self.stat_index.stat(source)
+        known = self.files.get(str(source))
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = file_hash(source)
+        self.files[str(source)] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def forget_other_files(self, sources: typing.Iterable[Path]):
+        keep = {str(source) for source in sources}
+        self.files = {k: v for k, v in self.files.items() if k in keep}
+
+    def _archive_stat(self) -> typing.Optional[typing.List[int]]:
+        try:
+            stat = os.stat(self.archive_filename)
+        except FileNotFoundError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def is_up_to_date(self, fingerprint: str) -> bool:
+        """True if the last build had fingerprint and its archive is
+        still there, unchanged.
+        """
+        return (
+            self.fingerprint == fingerprint
+            and self.archive is not None
+            and self._archive_stat() == self.archive
+        )
+
+    def update(self, fingerprint: str):
+        """Record fingerprint for the archive that was just built."""
+        self.fingerprint = fingerprint
+        self.archive = self._archive_stat()
+
+
+def compute_fingerprint(
+    record: BuildRecord,
+    package_files: typing.List[dict],
+    resolved_config: dict,
+    settings: dict,
+) -> str:
+    """A hash of everything that goes into a build: the resolved configs,
+    which file goes where with the hashes of their content, settings that
+    change the output and the pfcli version.
+    """
+    _hash = hashlib.sha256()
+    _hash.update(
+        json.dumps(
+            {
+                "pfcli": __version__,
+                "settings": settings,
+                "config": resolved_config,
+            },
+            sort_keys=True,
+            default=str,
+        ).encode("utf-8")
+    )
+    for package_file in package_files:
+        _hash.update(
+            "\0".join(
+                (
+                    str(package_file["dest"]),
+                    str(package_file["source"]),
+                    record.file_hash(package_file["source"]),
+                )
+            ).encode("utf-8")
+        )
+        _hash.update(b"\n")
+    return _hash.hexdigest()
@@ -0,0 +1,169 @@
+from dataclasses import dataclass, asdict
+import hashlib
+import json
+import os
+from pathlib import Path
+import typing
+
+from pfcli.config import decho, BUILD_MANIFEST
+from pfcli.package.scanner import StatIndex
+
+MANIFEST_VERSION = 1
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(path: Path) -> str:
+    """Return the sha256 hex digest of the content of path."""
+    _hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            _hash.update(chunk)
+    return _hash.hexdigest()
+
+
+@dataclass
+class ManifestEntry:
+    source: str
+    size: int
+    mtime_ns: int
+    sha256: str
+    staging: str = "copy"
+
+
+class BuildManifest:
+    """Records which source file was copied to which destination in the
+    build directory, so unchanged files can be skipped on the next build.
+
+    Destinations are stored relative to the build directory. Source stat
+    results are taken from stat_index.
+    """
+
+    def __init__(self, build_path: Path, stat_index: typing.Optional[StatIndex] = None):
+        self.build_path = build_path
+        self.stat_index = stat_index or StatIndex()
+        self.entries: typing.Dict[str, ManifestEntry] = {}
+
+    @property
+    def path(self) -> Path:
+        return self.build_path.joinpath(BUILD_MANIFEST)
+
+    @classmethod
+    def load(
+        cls, build_path: Path, stat_index: typing.Optional[StatIndex] = None
+    ) -> "BuildManifest":
+        manifest = cls(build_path, stat_index)
+
+        try:
+            with open(manifest.path, "rb") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return manifest
+        except ValueError:
+            decho(f"ignoring invalid build manifest '{manifest.path}'")
+            return manifest
+
+        if data.get("version") != MANIFEST_VERSION:
+            decho(f"ignoring build manifest with version '{data.get('version')}'")
+            return manifest
+
+        manifest.entries = {
+            dest: ManifestEntry(**entry) for dest, entry in data["files"].items()
+        }
+        return manifest
+
+    def save(self):
+        data = {
+            "version": MANIFEST_VERSION,
+            "files": {
+                dest: asdict(entry) for dest, entry in sorted(self.entries.items())
+            },
+        }
+        with open(self.path, "w") as f:
+            json.dump(data, f, indent=2)
+
+    def _key(self, dest: Path) -> str:
+        return dest.relative_to(self.build_path).as_posix()
+
+    def is_current(self, source: Path, dest: Path, staging: str = "copy") -> bool:
+        """Check if dest is an up to date copy of source, staged with
+        the staging strategy.
+
+        Size and mtime are compared first, the content hash is only
+        computed when they differ. If the content is unchanged the entry
+        is refreshed with the new stat values.
+        """
+        entry = self.entries.get(self._key(dest))
+        if entry is None or entry.source != str(source) or entry.staging != staging:
+            return False
+
+        try:
+            dest_stat = dest.stat()
+        except FileNotFoundError:
+            return False
+        if dest_stat.st_size != entry.size:
+            return False
+
+        source_stat = self.stat_index.stat(source)
+        if source_stat.st_size != entry.size:
+            return False
+        if source_stat.st_mtime_ns == entry.mtime_ns:
+            return True
+
+        if file_hash(source) != entry.sha256:
+            return False
+
+        # keep the copy identical to what a full rebuild would produce.
+        os.utime(dest, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+        entry.mtime_ns = source_stat.st_mtime_ns
+        return True
+
+    def discard(self, dest: Path):
+        self.entries.pop(self._key(dest), None)
+
+    def record(
+        self,
+        source: Path,
+        dest: Path,
+        staging: str = "copy",
+        sha256: typing.Optional[str] = None,
+    ):
+        """Record that dest is a copy of source. sha256 is the hash of
+        source, if it is known already.
+        """
+        source_stat = self.stat_index.stat(source)
+        self.entries[self._key(dest)] = ManifestEntry(
+            source=str(source),
+            size=source_stat.st_size,
+            mtime_ns=source_stat.st_mtime_ns,
+            sha256=sha256 or file_hash(source),
+            staging=staging,
+        )
+
+    def remove_stale(self, dests: typing.Iterable[Path]) -> typing.List[Path]:
+        """Delete all recorded files that are not in dests from the build
+        directory and the manifest. Returns the deleted paths.
+        """
+        keep = {self._key(dest) for dest in dests}
+        removed = []
+
+        for key in [key for key in self.entries if key not in keep]:
+            del self.entries[key]
+            stale = self.build_path.joinpath(key)
+            try:
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+            removed.append(stale)
+            self._remove_empty_parents(stale)
+
+        return removed
+
+    def _remove_empty_parents(self, path: Path):
+        for parent in path.parents:
+            if parent == self.build_path or not parent.is_relative_to(self.build_path):
+                break
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
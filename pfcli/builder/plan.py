@@ -0,0 +1,161 @@
+from dataclasses import dataclass, field
+import json
+from pathlib import Path
+import typing
+
+from pfcli.config import CONFIG_FILENAME, RS_PACKAGE_CONFIGURATION
+from pfcli.package import Package
+from . import Builder
+
+PLAN_VERSION = 1
+
+
+@dataclass
+class BuildPlan:
+    """Everything a build does, computed up front.
+
+    files has an entry for every file copied into the package, with its
+    source, its destination in the build directory, and the package,
+    section and destination it comes from. config is the resolved
+    configuration the package xml is generated from, xml the generated
+    package xml. inputs are the package configs the plan was made from.
+
+    cwd is the directory the plan was made in, the paths in the package
+    xml are relative to it. All other paths are absolute.
+    """
+
+    name: str
+    archive_name: str
+    build_path: Path
+    cwd: Path
+    xml: str
+    files: typing.List[dict] = field(default_factory=list)
+    config: dict = field(default_factory=dict)
+    inputs: typing.List[Path] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "version": PLAN_VERSION,
+            "name": self.name,
+            "archive_name": self.archive_name,
+            "build_path": str(self.build_path),
+            "cwd": str(self.cwd),
+            "inputs": [str(path) for path in self.inputs],
+            "files": [
+                {
+                    "source": str(pf["source"]),
+                    "dest": str(pf["dest"]),
+                    "package": pf.get("package"),
+                    "section": pf.get("section"),
+                    "destination": pf.get("destination"),
+                }
+                for pf in self.files
+            ],
+            "config": self.config,
+            "xml": {"name": RS_PACKAGE_CONFIGURATION, "content": self.xml},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BuildPlan":
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError(
+                f"Unsupported build plan version '{data.get('version')}'.\n"
+                f"Only version {PLAN_VERSION} plans can be run, create the plan again."
+            )
+        try:
+            return cls(
+                name=data["name"],
+                archive_name=data["archive_name"],
+                build_path=Path(data["build_path"]),
+                cwd=Path(data["cwd"]),
+                xml=data["xml"]["content"],
+                files=[
+                    dict(pf, source=Path(pf["source"]), dest=Path(pf["dest"]))
+                    for pf in data["files"]
+                ],
+                config=data.get("config", {}),
+                inputs=[Path(path) for path in data.get("inputs", [])],
+            )
+        except (KeyError, TypeError) as err:
+            raise ValueError(f"Invalid build plan, {err} is missing or wrong.")
+
+    def save(self, path: Path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False, default=str)
+
+    @classmethod
+    def load(cls, path: Path) -> "BuildPlan":
+        try:
+            with open(path, "rb") as f:
+                data = json.load(f)
+        except ValueError as err:
+            raise ValueError(f"Build plan '{path}' isn't valid JSON: {err}")
+        return cls.from_dict(data)
+
+
+def make_plan(builder: Builder) -> BuildPlan:
+    """Do the discovery part of a build: resolve the includes and the
+    configuration, find the files and generate the package xml.
+    """
+    return BuildPlan(
+        name=builder.name,
+        archive_name=builder.archive_name,
+        build_path=builder.build_path,
+        cwd=Path.cwd(),
+        xml=builder.get_package_xml(),
+        files=builder.package_files,
+        config=builder.resolved_config.as_dict(),
+        inputs=[
+            package.basepath.joinpath(CONFIG_FILENAME) for package in builder.packages
+        ],
+    )
+
+
+class PlannedBuilder(Builder):
+    """Builds the package of a saved BuildPlan.
+
+    Nothing is discovered: the package configs aren't loaded and the
+    source patterns aren't matched, the files and the package xml are
+    taken from the plan as they are. Without archive_dir the archive is
+    written to the directory the plan was made in, like Builder does.
+    """
+
+    def __init__(self, plan: BuildPlan, archive_dir: typing.Optional[Path] = None):
+        self.plan = plan
+        super().__init__(None, archive_dir or plan.cwd)
+
+    def resolve_packages(self) -> typing.List[Package]:
+        return []
+
+    @property
+    def name(self) -> str:
+        return self.plan.name
+
+    @property
+    def archive_name(self) -> str:
+        return self.plan.archive_name
+
+    @property
+    def build_path(self) -> Path:
+        return self.plan.build_path
+
+    @property
+    def resolved_config(self):
+        return None
+
+    @property
+    def package_files(self) -> typing.List[dict]:
+        return self.plan.files
+
+    def set_prune(self, prune: bool):
+        # the plan has the files of a pruned build already.
+        pass
+
+    def get_package_files(self) -> typing.List[dict]:
+        return self.plan.files
+
+    def write_package_xml(self, out: typing.TextIO):
+        out.write(self.plan.xml)
+
+    def fingerprint_config(self) -> dict:
+        return {"config": self.plan.config, "xml": self.plan.xml}
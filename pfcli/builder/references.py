@@ -0,0 +1,198 @@
+"""Find the files of a package that are referenced by its forms.
+
+The .xdp forms reference images and subforms by href and usehref
+attributes, the .tci and .inc files name the files they include. The
+references are resolved to the files of the build plan, which gives the
+reference graph. Everything that can't be reached from the transaction
+form or from a file that is always packaged, isn't used.
+"""
+from collections import deque
+from pathlib import Path, PurePosixPath
+import re
+import typing
+import xml.etree.ElementTree as ET
+
+from pfcli.config import decho
+
+IMAGE_SUFFIXES = frozenset(
+    {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff", ".svg", ".webp"}
+)
+# files that are scanned for references.
+SCANNED_SUFFIXES = frozenset({".xdp", ".tci", ".inc"})
+# files that are only packaged if they are referenced, subforms, includes
+# and images. All others, like the .tci configs, are always packaged.
+PRUNABLE_SUFFIXES = IMAGE_SUFFIXES | {".xdp", ".inc"}
+# sections other than the sources are always packaged.
+PRUNABLE_SECTIONS = frozenset({"source"})
+
+_REFERENCE_ATTRIBUTES = ("href", "usehref")
+# urls and data uris, but not windows drive letters.
+_URL = re.compile(r"[a-zA-Z][\w+.-]+:")
+_SUFFIXES = "|".join(sorted(s[1:] for s in PRUNABLE_SUFFIXES | SCANNED_SUFFIXES))
+# file names in text, quoted or not, with or without a directory.
+_FILE_NAME = re.compile(
+    rf"""[^\s"'<>=;,()|*?]+\.(?:{_SUFFIXES})(?![\w.])""", re.IGNORECASE
+)
+
+
+def _reference_parts(reference: str) -> typing.Tuple[str, ...]:
+    """The lower case path parts of a reference, without the fragment of
+    a subform reference like 'x.xdp#som($template.#subform[0])' and the
+    parts that lead out of the directory of the referencing file.
+    """
+    reference = reference.split("#", 1)[0].split("?", 1)[0].strip()
+    parts = PurePosixPath(reference.replace("\\", "/").lower()).parts
+    if ".." in parts:
+        parts = parts[len(parts) - parts[::-1].index("..") :]
+    return tuple(p for p in parts if p not in (".", "/"))
+
+
+def _scan_xdp(path: Path) -> typing.Iterator[str]:
+    """The href and usehref attributes of the form path. The form is
+    parsed as a stream, elements are dropped once they are read.
+    """
+    root = None
+    # the elements that are still open, the last one is the innermost.
+    open_elems: typing.List[ET.Element] = []
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "end":
+            # its attributes were read at the start. A finished element is
+            # the last child of its parent, removing it from there lets it
+            # go, so only the open elements are kept. The children of root
+            # are dropped by clearing root.
+            open_elems.pop()
+            elem.clear()
+            if len(open_elems) > 1:
+                del open_elems[-1][-1]
+            root.clear()
+            continue
+        if root is None:
+            root = elem
+        open_elems.append(elem)
+        for attribute in _REFERENCE_ATTRIBUTES:
+            value = elem.get(attribute)
+            if value and not _URL.match(value):
+                yield value
+
+
+def _scan_text(path: Path) -> typing.Iterator[str]:
+    """The file names mentioned in the text file path, line by line."""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            yield from _FILE_NAME.findall(line)
+
+
+def scan_references(path: Path) -> typing.List[str]:
+    """The references in the file path, as they are written in it.
+
+    Forms that aren't well-formed xml are scanned as text.
+    """
+    if path.suffix.lower() == ".xdp":
+        try:
+            return list(_scan_xdp(path))
+        except ET.ParseError as err:
+            decho(f"'{path}' isn't well-formed ({err}), scanning it as text")
+    return list(_scan_text(path))
+
+
+class ReferenceGraph:
+    """Which files of a build plan reference which others.
+
+    A reference is resolved by the file name, case-insensitive like on
+    Windows. If several files have that name, the directories of the
+    reference pick the files whose source or destination path ends with
+    them. If that picks none, all of them are kept.
+    """
+
+    def __init__(self, package_files: typing.List[dict], build_path: Path):
+        self.package_files = package_files
+        self._by_name: typing.Dict[str, typing.List[int]] = {}
+        self._paths: typing.List[typing.Tuple[typing.Tuple[str, ...], ...]] = []
+        for i, pf in enumerate(package_files):
+            source, dest = pf["source"], pf["dest"]
+            self._by_name.setdefault(source.name.lower(), []).append(i)
+            if dest.name.lower() != source.name.lower():
+                self._by_name.setdefault(dest.name.lower(), []).append(i)
+            self._paths.append(
+                (
+                    tuple(p.lower() for p in source.parts),
+                    tuple(p.lower() for p in dest.relative_to(build_path).parts),
+                )
+            )
+        # index -> indexes of the files it references, filled by scan.
+        self.edges: typing.Dict[int, typing.Set[int]] = {}
+
+    def resolve(self, reference: str) -> typing.List[int]:
+        """The indexes of the files reference may mean."""
+        parts = _reference_parts(reference)
+        if not parts:
+            return []
+        candidates = self._by_name.get(parts[-1], [])
+        if len(candidates) < 2 or len(parts) < 2:
+            return candidates
+        matching = [
+            i
+            for i in candidates
+            if any(path[-len(parts) :] == parts for path in self._paths[i])
+        ]
+        return matching or candidates
+
+    def scan(self):
+        """Scan the files that can reference others."""
+        for i, pf in enumerate(self.package_files):
+            source = pf["source"]
+            if source.suffix.lower() not in SCANNED_SUFFIXES:
+                continue
+            edges = self.edges.setdefault(i, set())
+            for reference in scan_references(source):
+                resolved = self.resolve(reference)
+                if not resolved:
+                    decho(f"'{source}' references '{reference}', not in the package")
+                edges.update(j for j in resolved if j != i)
+
+    def reachable(self, roots: typing.Iterable[int]) -> typing.Set[int]:
+        seen = set(roots)
+        todo = deque(seen)
+        while todo:
+            for j in self.edges.get(todo.popleft(), ()):
+                if j not in seen:
+                    seen.add(j)
+                    todo.append(j)
+        return seen
+
+
+def is_prunable(package_file: dict) -> bool:
+    return (
+        package_file["section"] in PRUNABLE_SECTIONS
+        and package_file["source"].suffix.lower() in PRUNABLE_SUFFIXES
+    )
+
+
+def prune_package_files(
+    package_files: typing.List[dict], build_path: Path, transaction_form: Path
+) -> typing.Tuple[typing.List[dict], typing.List[dict]]:
+    """Split package_files into the files that are used and the ones that
+    aren't referenced, directly or indirectly, by the transaction form or
+    a file that isn't prunable.
+
+    The transaction_form is the absolute path of its source file. Returns
+    the used files and the dropped ones, both in the order of the plan.
+    """
+    if not any(pf["source"] == transaction_form for pf in package_files):
+        raise ValueError(
+            f"Can't prune the package, its transaction form '{transaction_form}' "
+            f"isn't one of its files."
+        )
+    roots = [
+        i
+        for i, pf in enumerate(package_files)
+        if not is_prunable(pf) or pf["source"] == transaction_form
+    ]
+
+    graph = ReferenceGraph(package_files, build_path)
+    graph.scan()
+    used = graph.reachable(roots)
+    return (
+        [pf for i, pf in enumerate(package_files) if i in used],
+        [pf for i, pf in enumerate(package_files) if i not in used],
+    )
@@ -0,0 +1,141 @@
+from dataclasses import dataclass
+from pathlib import Path
+import typing
+
+from pfcli.package import Package, Destination, Source
+
+# the getters for the sections that are taken from the first package
+# defining them, the build package first.
+SECTION_GETTERS: typing.Dict[str, typing.Callable[[Package], typing.Any]] = {
+    "fontdefinition": Package.get_font_definition,
+    "supplement.logical": Package.get_supplement_logical,
+    "supplement.physical": Package.get_supplement_physical,
+    "shipment.postage": Package.get_shipment_postage,
+    "whitespace": Package.get_whitespace,
+    "transaction_form_page_background": Package.get_transaction_form_page_background,
+    "input_variable": Package.get_input_variables,
+    "transaction_form_material": Package.get_transaction_form_materials,
+    "testdata": Package.get_test_data,
+}
+
+
+@dataclass
+class ResolvedValue:
+    """A configuration value and the package it was taken from."""
+
+    value: typing.Any
+    package: Package
+
+
+class ResolvedConfig:
+    """The effective configuration of a package and it's includes.
+
+    packages are in Builder order, the build package last. Every value
+    is looked up once and then served from an index.
+    """
+
+    def __init__(self, packages: typing.List[Package]):
+        self.packages = packages
+        self._sections: typing.Dict[str, typing.Optional[ResolvedValue]] = {}
+
+        self.destinations: typing.Dict[Destination, ResolvedValue] = {}
+        for package in packages:
+            for destination in package.get_destinations():
+                if destination in self.destinations:
+                    raise ValueError(
+                        f"Destination '{destination}' from package '{package.name}' has already been defined.\n"
+                        "Redefinition of destinations is not allowed"
+                    )
+                self.destinations[destination] = ResolvedValue(
+                    package.get_destination_path(destination), package
+                )
+
+        self.sources: typing.Dict[Destination, typing.List[ResolvedValue]] = {}
+        for package in packages:
+            for source in package.get_all_sources():
+                self.sources.setdefault(source.destination, []).append(
+                    ResolvedValue(source, package)
+                )
+
+        self.runtime_environments: typing.List[ResolvedValue] = []
+        for package in reversed(packages):
+            try:
+                self.runtime_environments.extend(
+                    ResolvedValue(e, package)
+                    for e in package.get_runtime_environments()
+                )
+            except KeyError:
+                pass  # not all package have to have runtime environments defined
+
+    def section(self, name: str) -> typing.Optional[ResolvedValue]:
+        """The section name from the first package defining it, starting
+        with the build package. None if no package defines it.
+        """
+        try:
+            return self._sections[name]
+        except KeyError:
+            pass
+
+        getter = SECTION_GETTERS[name]
+        resolved = None
+        for package in reversed(self.packages):
+            try:
+                resolved = ResolvedValue(getter(package), package)
+                break
+            except KeyError:
+                pass  # we just continue with the next package
+
+        self._sections[name] = resolved
+        return resolved
+
+    def destination(self, destination: Destination) -> typing.Optional[ResolvedValue]:
+        return self.destinations.get(destination)
+
+    def as_dict(self) -> dict:
+        """The effective configuration with the package that supplied each
+        value, for display.
+        """
+        sections = {}
+        for name in SECTION_GETTERS:
+            try:
+                resolved = self.section(name)
+            except ValueError as err:
+                sections[name] = {"error": str(err)}
+                continue
+            if resolved is not None:
+                sections[name] = _resolved_to_dict(resolved)
+
+        return {
+            "packages": [
+                {"name": p.name, "path": str(p.basepath)} for p in self.packages
+            ],
+            "destinations": {
+                name: _resolved_to_dict(resolved)
+                for name, resolved in self.destinations.items()
+            },
+            "sources": {
+                name: [_resolved_to_dict(r) for r in resolved]
+                for name, resolved in self.sources.items()
+            },
+            "runtime_environments": [
+                _resolved_to_dict(r) for r in self.runtime_environments
+            ],
+            "sections": sections,
+        }
+
+
+def _resolved_to_dict(resolved: ResolvedValue) -> dict:
+    return {"package": resolved.package.name, "value": _plain(resolved.value)}
+
+
+def _plain(value: typing.Any) -> typing.Any:
+    """Turn value into something json can serialize."""
+    if hasattr(value, "__dataclass_fields__"):
+        return {k: _plain(getattr(value, k)) for k in value.__dataclass_fields__}
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, Path):
+        return value.as_posix()
+    return value
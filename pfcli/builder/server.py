@@ -0,0 +1,221 @@
+import contextlib
+import io
+import os
+from pathlib import Path
+import signal
+import socketserver
+import sys
+import traceback
+import typing
+
+import click
+
+from pfcli import __version__, config
+from pfcli.config import decho, CONFIG_FILENAME
+from pfcli.package import clear_package_cache, load_package
+from pfcli.remote import (
+    BUILT,
+    FAILED,
+    PROTOCOL_VERSION,
+    REFUSED,
+    UP_TO_DATE,
+    connect,
+    receive,
+    send,
+)
+from . import Builder, BuildOptions
+from .watch import Snapshot, changed_paths, snapshot
+
+
+class Workspace:
+    """The warm state of the package in one directory: its Builder, with
+    the loaded packages, the resolved includes, the file list and the
+    stat and content indexes.
+
+    Before every build the files of the package and its includes are
+    compared to the snapshot taken before the last one. A changed
+    package.toml loads the packages again, added or removed files scan
+    the sources again and modified files are only stat-ed and hashed
+    again.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.builder: typing.Optional[Builder] = None
+        self.snapshot: Snapshot = {}
+
+    def _roots(self) -> typing.List[Path]:
+        return [package.basepath for package in self.builder.packages]
+
+    def refresh(self) -> Builder:
+        """The Builder for the package, with the state of files that
+        changed since the last build dropped.
+        """
+        if self.builder is None:
+            self.builder = Builder(load_package(self.path))
+            self.snapshot = snapshot(self._roots())
+            return self.builder
+
+        old_snapshot, self.snapshot = self.snapshot, snapshot(self._roots())
+        changed = changed_paths(old_snapshot, self.snapshot)
+        if not changed:
+            decho(f"nothing changed in '{self.path}'")
+        elif any(path.name == CONFIG_FILENAME for path in changed):
+            decho("a package config changed, loading the packages again")
+            clear_package_cache()
+            self.builder = Builder(load_package(self.path))
+            self.snapshot = snapshot(self._roots())
+        elif old_snapshot.keys() != self.snapshot.keys():
+            decho("files were added or removed, scanning the sources again")
+            self.builder = Builder(self.builder.build_package)
+        else:
+            decho(f"{len(changed)} file(s) changed")
+            for path in changed:
+                self.builder.invalidate(path)
+        return self.builder
+
+
+class _Output(io.TextIOBase):
+    """A text stream that sends what's written to it to the client."""
+
+    encoding = "utf-8"
+
+    def __init__(self, f: typing.BinaryIO, err: bool = False):
+        self.f = f
+        self.err = err
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        # click checks if a stream is binary by writing bytes to it.
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        if text:
+            try:
+                send(self.f, {"text": text, "err": self.err})
+            except OSError:
+                pass  # the client is gone, the build still finishes.
+        return len(text)
+
+
+class BuildServer:
+    """Builds packages on request, keeping a Workspace per package
+    directory, see Workspace.
+
+    Requests are handled one at a time, in the order they come in.
+    """
+
+    def __init__(self):
+        self.workspaces: typing.Dict[Path, Workspace] = {}
+
+    def build(self, cwd: Path, params: dict) -> dict:
+        workspace = self.workspaces.get(cwd)
+        if workspace is None:
+            workspace = self.workspaces[cwd] = Workspace(cwd)
+
+        # the package xml has paths relative to the current directory.
+        os.chdir(cwd)
+        try:
+            builder = workspace.refresh()
+            built = builder.build(BuildOptions.create(**params))
+        except Exception:
+            # whatever failed may have left the cached state inconsistent.
+            self.workspaces.pop(cwd, None)
+            clear_package_cache()
+            raise
+        return {
+            "result": BUILT if built else UP_TO_DATE,
+            "archive": builder.archive_filename,
+        }
+
+    def handle(self, request: dict, f: typing.BinaryIO) -> dict:
+        """Handle a request, the output is sent to the client through f.
+        Returns the result message.
+        """
+        if request.get("version") != PROTOCOL_VERSION:
+            return {
+                "result": REFUSED,
+                "message": f"Unsupported protocol version {request.get('version')}.",
+            }
+        if request.get("pfcli") != __version__:
+            return {
+                "result": REFUSED,
+                "message": f"The server runs pfcli {__version__}, "
+                f"not {request.get('pfcli')}.",
+            }
+        if request.get("command") != "build":
+            return {
+                "result": REFUSED,
+                "message": f"Unknown command '{request.get('command')}'.",
+            }
+
+        debug, use_cache = config.get_debug(), config.get_use_cache()
+        config.set_debug(debug or request.get("debug", False))
+        config.set_use_cache(use_cache and request.get("cache", True))
+        stdout = contextlib.redirect_stdout(_Output(f))
+        stderr = contextlib.redirect_stderr(_Output(f, err=True))
+        try:
+            with stdout, stderr:
+                return self.build(Path(request["cwd"]), request.get("params", {}))
+        except click.ClickException as err:
+            return {"result": FAILED, "message": err.format_message()}
+        except (ValueError, KeyError, OSError) as err:
+            return {"result": FAILED, "message": str(err)}
+        except Exception as err:
+            traceback.print_exc()
+            message = f"Internal error of the server: {err!r}"
+            return {"result": FAILED, "message": message}
+        finally:
+            config.set_debug(debug)
+            config.set_use_cache(use_cache)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # one request per connection.
+        for request in receive(self.rfile):
+            result = self.server.build_server.handle(request, self.wfile)
+            try:
+                send(self.wfile, result)
+            except OSError:
+                pass  # the client didn't wait for the result.
+            break
+
+
+class _UnixServer(socketserver.UnixStreamServer):
+    # builds are handled one at a time, the others wait to be accepted.
+    request_queue_size = 64
+
+    def __init__(self, path: Path, build_server: BuildServer):
+        super().__init__(str(path), _RequestHandler)
+        self.build_server = build_server
+
+
+def serve(path: Path):
+    """Run a BuildServer on the Unix socket at path until interrupted.
+
+    A stale socket file of a server that is no longer running is
+    replaced, it is removed when the server stops, also when it is
+    terminated.
+    """
+    if not hasattr(socketserver, "UnixStreamServer"):
+        raise OSError("pfcli serve needs Unix sockets, this platform has none.")
+
+    sock = connect(path)
+    if sock is not None:
+        sock.close()
+        raise ValueError(f"A server is running on '{path}' already.")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.unlink(missing_ok=True)
+
+    cwd = os.getcwd()
+    server = _UnixServer(path, BuildServer())
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        click.echo(f"serving on '{path}', press Ctrl+C to stop.")
+        server.serve_forever()
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+        os.chdir(cwd)
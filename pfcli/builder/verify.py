@@ -0,0 +1,175 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+import typing
+import zipfile
+import zlib
+
+from pfcli import profile
+from pfcli.config import BUILD_DIR_FILE, RS_PACKAGE_CONFIGURATION
+from . import Builder
+from .copy import unique_destinations
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class VerifyResult:
+    """The differences between an archive and the package it was built
+    from.
+
+    missing entries are in the plan but not in the archive, extra ones
+    the other way round. mismatched entries have a different content
+    than their source, corrupt ones can't be read or don't match the CRC
+    stored in the archive.
+    """
+
+    archive: str
+    checked: int = 0
+    # arcname -> source
+    missing: typing.Dict[str, str] = field(default_factory=dict)
+    extra: typing.List[str] = field(default_factory=list)
+    mismatched: typing.Dict[str, str] = field(default_factory=dict)
+    corrupt: typing.Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return not (self.missing or self.extra or self.mismatched or self.corrupt)
+
+    def report(self) -> typing.List[str]:
+        lines = [
+            f"missing '{arcname}' (from '{source}')"
+            for arcname, source in self.missing.items()
+        ]
+        lines.extend(f"extra '{arcname}'" for arcname in self.extra)
+        lines.extend(
+            f"mismatched '{arcname}' (differs from '{source}')"
+            for arcname, source in self.mismatched.items()
+        )
+        lines.extend(
+            f"corrupt '{arcname}': {error}" for arcname, error in self.corrupt.items()
+        )
+        return lines
+
+
+def _crc32(path: Path) -> typing.Tuple[int, int]:
+    """The CRC32 and size of the file path, as stored in zip archives."""
+    crc = 0
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+    return crc, size
+
+
+def _check_entries(
+    zip_filename: str, infos: typing.List[zipfile.ZipInfo]
+) -> typing.Dict[str, str]:
+    """Read the entries infos to the end, zipfile checks their CRC on the
+    way. Returns the errors of the broken ones.
+    """
+    errors = {}
+    # every thread needs its own file handle.
+    with zipfile.ZipFile(zip_filename) as zf:
+        for info in infos:
+            try:
+                with zf.open(info) as f:
+                    while f.read(_CHUNK_SIZE):
+                        pass
+            except (zipfile.BadZipFile, zlib.error, OSError) as err:
+                errors[info.filename] = str(err)
+    return errors
+
+
+def _split(
+    infos: typing.Iterable[zipfile.ZipInfo], count: int
+) -> typing.List[typing.List[zipfile.ZipInfo]]:
+    """Split infos into up to count runs of entries that follow each other
+    in the archive, with about the same amount of data each.
+    """
+    infos = sorted(infos, key=lambda info: info.header_offset)
+    total = sum(info.compress_size for info in infos) or 1
+    runs = [[] for _ in range(count)]
+    offset = 0
+    for info in infos:
+        runs[min(count - 1, offset * count // total)].append(info)
+        offset += info.compress_size
+    return [run for run in runs if run]
+
+
+def verify_archive(
+    builder: Builder,
+    zip_filename: typing.Optional[str] = None,
+    jobs: int = 1,
+    check_data: bool = True,
+) -> VerifyResult:
+    """Compare the archive zip_filename, the archive of builder if it is
+    None, with what a build would put into it.
+
+    Nothing is copied: the files of the plan are compared by size and
+    CRC with the entries of the archive, and the package xml with the
+    one in the archive. With check_data the data of all entries is read
+    too, to find corrupt entries. The source files are hashed and the
+    entries read by jobs worker threads.
+    """
+    zip_filename = zip_filename or builder.archive_filename
+    result = VerifyResult(zip_filename)
+
+    with profile.span("plan"):
+        package_files = unique_destinations(builder.package_files)
+        expected = {
+            pf["dest"].relative_to(builder.build_path).as_posix(): pf["source"]
+            for pf in package_files
+        }
+        xml = builder.get_package_xml().encode("utf-8")
+
+    try:
+        with zipfile.ZipFile(zip_filename) as zf:
+            infos = {info.filename: info for info in zf.infolist()}
+            xml_info = infos.get(RS_PACKAGE_CONFIGURATION)
+            archived_xml = None if xml_info is None else zf.read(xml_info)
+    except zipfile.BadZipFile as err:
+        raise ValueError(f"'{zip_filename}' is not a valid zip archive: {err}")
+
+    if archived_xml is None:
+        result.missing[RS_PACKAGE_CONFIGURATION] = "the generated package xml"
+    elif archived_xml != xml:
+        result.mismatched[RS_PACKAGE_CONFIGURATION] = "the generated package xml"
+
+    # the build directory marker is only in archives of staged builds.
+    known = set(expected) | {RS_PACKAGE_CONFIGURATION, BUILD_DIR_FILE}
+    result.extra = [
+        arcname
+        for arcname, info in infos.items()
+        if arcname not in known and not info.is_dir()
+    ]
+    for arcname, source in expected.items():
+        if arcname not in infos:
+            result.missing[arcname] = str(source)
+
+    present = {a: s for a, s in expected.items() if a in infos}
+    with profile.span("verify", jobs=jobs) as span, ThreadPoolExecutor(
+        max_workers=jobs
+    ) as executor:
+        # map submits everything at once, the sources are hashed while the
+        # entries are read.
+        crcs = executor.map(_crc32, present.values())
+        errors = []
+        if check_data:
+            errors = executor.map(
+                lambda run: _check_entries(zip_filename, run),
+                _split(infos.values(), jobs),
+            )
+        crcs = dict(zip(present, crcs))
+        for run_errors in errors:
+            result.corrupt.update(run_errors)
+        span.add(files=len(present) + (len(infos) if check_data else 0))
+
+    for arcname, source in present.items():
+        info = infos[arcname]
+        if crcs[arcname] != (info.CRC, info.file_size):
+            result.mismatched[arcname] = str(source)
+
+    result.checked = len(present) + 1
+    return result
@@ -0,0 +1,200 @@
+import os
+from pathlib import Path
+import time
+import typing
+
+import click
+
+from pfcli.config import decho, BUILD_DIR, CONFIG_FILENAME
+from pfcli.package import Package, clear_package_cache, load_package
+from pfcli.package.scanner import compile_pattern
+from . import Builder, BuildOptions
+from .archive import ArchiveEntry, update_archive
+from .copy import copy_package_files, unique_destinations
+from .manifest import BuildManifest
+
+Snapshot = typing.Dict[Path, typing.Tuple[int, int]]
+
+
+def snapshot(roots: typing.Iterable[Path]) -> Snapshot:
+    """The mtime and size of all files below roots.
+
+    Build directories and hidden directories are skipped.
+    """
+    files = {}
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [
+                d for d in dirnames if d != BUILD_DIR and not d.startswith(".")
+            ]
+            for name in filenames:
+                path = Path(dirpath, name)
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def changed_paths(old: Snapshot, new: Snapshot) -> typing.Set[Path]:
+    """The files added, removed or modified between two snapshots."""
+    changed = set(old.keys() ^ new.keys())
+    changed.update(path for path in old.keys() & new.keys() if old[path] != new[path])
+    return changed
+
+
+def find_owner(packages: typing.List[Package], path: Path) -> typing.Optional[str]:
+    """Describe which part of the package configs path belongs to, None
+    if it doesn't belong to any.
+    """
+    for package in packages:
+        if not path.is_relative_to(package.basepath):
+            continue
+        rel_path = path.relative_to(package.basepath)
+
+        if rel_path == Path(CONFIG_FILENAME):
+            return f"{CONFIG_FILENAME} of package '{package.name}'"
+
+        for source in package.get_all_sources():
+            for pattern in source.paths:
+                if compile_pattern(pattern).match(rel_path.as_posix()):
+                    return f"[[source]] '{pattern}' of package '{package.name}'"
+
+        for section, getter in (
+            ("testdata", lambda: [f.path for f in package.get_test_data().files]),
+            (
+                "transaction_form_page_background",
+                lambda: [
+                    f.path for f in package.get_transaction_form_page_background().files
+                ],
+            ),
+            ("fontdefinition", lambda: [package.get_font_definition()["path"]]),
+        ):
+            try:
+                if rel_path in getter():
+                    return f"[{section}] of package '{package.name}'"
+            except (KeyError, ValueError):
+                pass  # the package doesn't have the section
+
+    return None
+
+
+class Watcher:
+    """Rebuild a package whenever one of its files or one of the files of
+    its includes changes.
+
+    Changes are found by polling. A change to a package.toml rebuilds
+    everything that changed. A change to files that are already part of
+    the package only copies these files and replaces their archive
+    entries. Added or removed files update the build directory and
+    rewrite the archive, without generating the package xml again.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        options: typing.Optional[BuildOptions] = None,
+        interval: float = 0.5,
+    ):
+        self.path = path
+        self.options = options or BuildOptions()
+        self.interval = interval
+        self.builder: typing.Optional[Builder] = None
+        self.snapshot: Snapshot = {}
+        # the destinations of the last build.
+        self.destinations: typing.Set[Path] = set()
+
+    def _roots(self) -> typing.List[Path]:
+        return [package.basepath for package in self.builder.packages]
+
+    def full_build(self):
+        clear_package_cache()
+        self.builder = Builder(load_package(self.path))
+        self.destinations = set()
+        self.builder.build(self.options)
+        self.destinations = {pf["dest"] for pf in self.builder.get_package_files()}
+        self.snapshot = snapshot(self._roots())
+
+    def _archive_entry(self, dest: Path) -> ArchiveEntry:
+        arcname = dest.relative_to(self.builder.build_path).as_posix()
+        return ArchiveEntry(arcname, dest)
+
+    def update(self, changed: typing.Set[Path]) -> bool:
+        """Rebuild what's affected by the changed paths.
+
+        Returns False if none of the paths belongs to the package.
+        """
+        owners = {path: find_owner(self.builder.packages, path) for path in changed}
+        owned = {path: owner for path, owner in owners.items() if owner is not None}
+        if not owned:
+            return False
+
+        for path, owner in sorted(owned.items()):
+            click.echo(f"changed '{path}' ({owner})")
+
+        if any(path.name == CONFIG_FILENAME for path in owned):
+            self.full_build()
+            return True
+
+        # a fresh builder scans the package again, the configs are cached.
+        self.builder = Builder(self.builder.build_package)
+        package_files = self.builder.get_package_files()
+        destinations = {pf["dest"] for pf in package_files}
+
+        if destinations != self.destinations:
+            self.destinations = destinations
+            decho("files were added or removed, updating the whole archive")
+            self.builder.copy_files(
+                jobs=self.options.jobs,
+                staging=self.options.staging,
+                dedupe=self.options.dedupe,
+                conflicts=self.options.conflicts,
+            )
+            self.builder.zip_package(self.options.archive)
+            return True
+
+        # a file that goes to a destination a later package overrides
+        # doesn't end up in the archive.
+        changed_files = [
+            pf for pf in unique_destinations(package_files) if pf["source"] in owned
+        ]
+        if not changed_files:
+            decho("the changed files are overridden by other packages")
+            return True
+        manifest = BuildManifest.load(self.builder.build_path, self.builder.stat_index)
+        try:
+            copy_package_files(
+                changed_files,
+                manifest,
+                jobs=self.options.jobs,
+                staging=self.options.staging,
+            )
+        finally:
+            manifest.save()
+
+        entries = [self._archive_entry(pf["dest"]) for pf in changed_files]
+        if os.path.exists(self.builder.archive_filename):
+            update_archive(self.builder.archive_filename, entries, self.options.archive)
+        else:
+            self.builder.zip_package(self.options.archive)
+        return True
+
+    def run(self):
+        self.full_build()
+        click.echo(f"watching {len(self.snapshot)} file(s), press Ctrl+C to stop.")
+
+        while True:
+            time.sleep(self.interval)
+            new_snapshot = snapshot(self._roots())
+            changed = changed_paths(self.snapshot, new_snapshot)
+            self.snapshot = new_snapshot
+            if not changed:
+                continue
+
+            start = time.perf_counter()
+            try:
+                if self.update(changed):
+                    click.echo(f"rebuilt in {time.perf_counter() - start:.2f}s")
+            except (ValueError, KeyError, OSError) as err:
+                click.echo(f"build failed: {err}", err=True)
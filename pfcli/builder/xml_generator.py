@@ -1,90 +1,108 @@
 from __future__ import annotations
+import io
 from pathlib import Path
+import typing
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from pfcli.builder import Builder
 
 
+# like xml.sax.saxutils.escape, which imports half of urllib and email.
+def _text(value: typing.Any) -> str:
+    """value escaped for use as element content."""
+    return str(value).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _attr(value: typing.Any) -> str:
+    """value escaped for use in a double quoted attribute."""
+    return _text(value).replace('"', "&quot;")
+
+
 class RsPackage:
+    """Writes the rs_package_configuration.xml of a build.
+
+    The xml is written piece by piece to a text stream, so the memory
+    needed doesn't grow with the number of runtime environments, test
+    data or input variables. All values are escaped.
+    """
+
     def __init__(self, builder: Builder):
         self.builder = builder
         self.home = (
             "${home}"  # Profiforms uses {home} in their package xml, so we define home.
         )
 
-    @property
-    def runtime_environments(self):
-        runtime_envs = self.builder.get_runtime_environments()
-        _string = "\n" + "\n".join(
-            [
-                f"""\t\t<runtimeEnvironment platform="{e.platform}">
-                  <program name="{e.name}" version="{e.program_version}" />
-                  <cmdLine>{e.command_line}</cmdLine>
+    def _write_list(
+        self,
+        out: typing.TextIO,
+        items: typing.Iterable,
+        write_item: typing.Callable[[typing.TextIO, typing.Any], None],
+    ):
+        out.write("\n")
+        for index, item in enumerate(items):
+            if index:
+                out.write("\n")
+            write_item(out, item)
+
+    def write_runtime_environments(self, out: typing.TextIO):
+        def write_item(out, e):
+            out.write(
+                f"""\t\t<runtimeEnvironment platform="{_attr(e.platform)}">
+                  <program name="{_attr(e.name)}" version="{_attr(e.program_version)}" />
+                  <cmdLine>{_text(e.command_line)}</cmdLine>
                   <programResult>
-                    <log>{e.program_result_log}</log>
-                    <preview>{e.program_result_preview}</preview>
-                    <result type="{e.program_result_type}">{e.program_result_value}</result>
+                    <log>{_text(e.program_result_log)}</log>
+                    <preview>{_text(e.program_result_preview)}</preview>
+                    <result type="{_attr(e.program_result_type)}">{_text(e.program_result_value)}</result>
                   </programResult>
                 </runtimeEnvironment>"""
-                for e in runtime_envs
-            ]
-        )
-        return _string
+            )
+
+        self._write_list(out, self.builder.get_runtime_environments(), write_item)
+
+    def write_transaction_form_page_backgrounds(self, out: typing.TextIO):
+        def write_item(out, f):
+            out.write(
+                f'\t\t<transactionFormPageBackground pageName="{_attr(f.page_name)}">{_text(self.make_package_home_path(f.path))}</transactionFormPageBackground>'
+            )
 
-    @property
-    def transaction_form_page_backgrounds(self):
         background = self.builder.get_transaction_form_page_background()
-        _string = "\n" + "\n".join(
-            [
-                f'\t\t<transactionFormPageBackground pageName="{f.page_name}">{self.make_package_home_path(f.path)}</transactionFormPageBackground>'
-                for f in background.files
-            ]
-        )
-        return _string
-
-    @property
-    def materials(self):
-        materials = self.builder.get_transaction_form_materials()
-        _string = "\n" + "\n".join(
-            [
-                f'\t\t<material name="{m.name}" description="{m.description}" width="{m.width}" height="{m.height}" thickness="{m.thickness}" weight="{m.weight}" />'
-                for m in materials
-            ]
-        )
-        return _string
-
-    @property
-    def test_data(self):
-        try:
-            test_data = self.builder.get_test_data()
-            _string = "\n" + "\n".join(
-                [
-                    f"\t\t<testData><name>{f.name}</name><description>{f.description}</description><value>{self.make_package_home_path(f.path)}</value></testData>"
-                    for f in test_data.files
-                ]
+        self._write_list(out, background.files, write_item)
+
+    def write_materials(self, out: typing.TextIO):
+        def write_item(out, m):
+            out.write(
+                f'\t\t<material name="{_attr(m.name)}" description="{_attr(m.description)}" width="{_attr(m.width)}" height="{_attr(m.height)}" thickness="{_attr(m.thickness)}" weight="{_attr(m.weight)}" />'
             )
-            return _string
-        except KeyError:
-            pass
-
-    @property
-    def input_variables(self):
-        variables = self.builder.get_input_variables()
-        _string = "\n" + "\n".join(
-            [
-                f'\t\t<inputVariable><name>{v["name"]}</name><description>{v["description"]}</description></inputVariable>'
-                for v in variables
-            ]
-        )
-        return _string
+
+        self._write_list(out, self.builder.get_transaction_form_materials(), write_item)
+
+    def write_test_data(self, out: typing.TextIO):
+        def write_item(out, f):
+            out.write(
+                f"\t\t<testData><name>{_text(f.name)}</name><description>{_text(f.description)}</description><value>{_text(self.make_package_home_path(f.path))}</value></testData>"
+            )
+
+        test_data = self.builder.get_test_data()
+        if test_data is not None:
+            self._write_list(out, test_data.files, write_item)
+
+    def write_input_variables(self, out: typing.TextIO):
+        def write_item(out, v):
+            out.write(
+                f'\t\t<inputVariable><name>{_text(v["name"])}</name><description>{_text(v["description"])}</description></inputVariable>'
+            )
+
+        self._write_list(out, self.builder.get_input_variables(), write_item)
 
     def make_package_home_path(self, path: Path) -> Path:
         _abs = path.absolute()
         _path = _abs.relative_to(Path.cwd())
         return f"{self.home}/{_path}"
 
-    def get_xml(self):
+    def write_xml(self, out: typing.TextIO):
+        """Write the package xml to out."""
         package = self.builder.build_package
         # FIX: acutally use the path in the package
         font_def_loc = self.builder.get_font_definition()["path"]
@@ -93,43 +111,71 @@ class RsPackage:
         shipment_postage = self.builder.get_shipment_postage()
         whitespace = self.builder.get_whitespace()
 
-        return f"""<?xml version="1.0" encoding="utf-8"?>
+        out.write(
+            f"""<?xml version="1.0" encoding="utf-8"?>
 <?pte APIVersion="0.0.02"?>
-<package type="transaction" name="{package.name}" description="{package.description}" version="3.1">
+<package type="transaction" name="{_attr(package.name)}" description="{_attr(package.description)}" version="3.1">
   <configurationSet>
-    <runtimeEnvironments>{self.runtime_environments}</runtimeEnvironments>
-    <transactionForm>{self.make_package_home_path(package.transaction_form)}</transactionForm>
-    <transactionFormPageBackgrounds>{self.transaction_form_page_backgrounds}</transactionFormPageBackgrounds>
+    <runtimeEnvironments>"""
+        )
+        self.write_runtime_environments(out)
+        out.write(
+            f"""</runtimeEnvironments>
+    <transactionForm>{_text(self.make_package_home_path(package.transaction_form))}</transactionForm>
+    <transactionFormPageBackgrounds>"""
+        )
+        self.write_transaction_form_page_backgrounds(out)
+        out.write(
+            f"""</transactionFormPageBackgrounds>
     <fontDef>
-        <location>{self.make_package_home_path(font_def_loc)}</location>
+        <location>{_text(self.make_package_home_path(font_def_loc))}</location>
     </fontDef>
-    <transactionFormMaterials>{self.materials}</transactionFormMaterials>
-    <testDataSet>{self.test_data}</testDataSet>
-    <inputVariableSet>{self.input_variables}</inputVariableSet>
+    <transactionFormMaterials>"""
+        )
+        self.write_materials(out)
+        out.write(
+            """</transactionFormMaterials>
+    <testDataSet>"""
+        )
+        self.write_test_data(out)
+        out.write(
+            """</testDataSet>
+    <inputVariableSet>"""
+        )
+        self.write_input_variables(out)
+        out.write(
+            f"""</inputVariableSet>
   </configurationSet>
   <supplement>
     <logicalSupplement>
-      <allowed>{supplement_logical["allowed"]}</allowed>
-      <useOnlyTransactionFormPaper>{supplement_logical["use_only_transaction_form_paper"]}</useOnlyTransactionFormPaper>
+      <allowed>{_text(supplement_logical["allowed"])}</allowed>
+      <useOnlyTransactionFormPaper>{_text(supplement_logical["use_only_transaction_form_paper"])}</useOnlyTransactionFormPaper>
     </logicalSupplement>
     <physicalSupplement>
-      <allowed>{supplement_physical["allowed"]}</allowed>
+      <allowed>{_text(supplement_physical["allowed"])}</allowed>
     </physicalSupplement>
   </supplement>
   <shipment>
     <postage>
-      <optionalSupplementCanExceedPostage>{shipment_postage["optional_supplement_can_exceed_postage"]}</optionalSupplementCanExceedPostage>
-      <whitespaceCanExceedPostage>{shipment_postage["whitespace_can_exceed_postage"]}</whitespaceCanExceedPostage>
+      <optionalSupplementCanExceedPostage>{_text(shipment_postage["optional_supplement_can_exceed_postage"])}</optionalSupplementCanExceedPostage>
+      <whitespaceCanExceedPostage>{_text(shipment_postage["whitespace_can_exceed_postage"])}</whitespaceCanExceedPostage>
     </postage>
   </shipment>
   <whitespace>
-    <allowed>{whitespace["allowed"]}</allowed>
-    <maxSpace>{whitespace["max_space"]}</maxSpace>
-    <overflow>{whitespace["overflow"]}</overflow>
+    <allowed>{_text(whitespace["allowed"])}</allowed>
+    <maxSpace>{_text(whitespace["max_space"])}</maxSpace>
+    <overflow>{_text(whitespace["overflow"])}</overflow>
     <partSet />
   </whitespace>
 </package>
 """
+        )
+
+    def get_xml(self) -> str:
+        """The package xml as a string."""
+        out = io.StringIO()
+        self.write_xml(out)
+        return out.getvalue()
 
 
 class RsPackageAPIVersion_0_0_02(RsPackage):
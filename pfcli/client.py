@@ -1,39 +1,679 @@
+from __future__ import annotations
+from functools import update_wrapper
+import json
 import os
 from pathlib import Path
+import textwrap
+import typing
+from typing import TYPE_CHECKING
 
 import click
 
-from pfcli import config
-from pfcli.package import Package, load_package
-from pfcli.builder import Builder
+from pfcli import config, __version__
+from pfcli.config import STAGING_STRATEGIES, COPY, CONFLICT_POLICIES, WARN
+
+# The builder and the packages are only imported by the commands that use
+# them, so the cli starts fast for --help and cheap commands.
+if TYPE_CHECKING:
+    from pfcli.package import Package
 
 
 @click.group()
+@click.version_option(__version__)
 @click.option("--debug/--no-debug", default=False)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Use the cache of parsed package configs.",
+)
 @click.pass_context
-def cli(ctx: click.Context, debug: bool):
+def cli(ctx: click.Context, debug: bool, cache: bool):
     config.set_debug(debug)
+    config.set_use_cache(cache)
+
+
+def _package(ctx: click.Context) -> Package:
+    """The package in the current directory, loaded on first use."""
+    from pfcli.package import load_package
+
+    if ctx.obj is None:
+        ctx.obj = load_package(Path.cwd())
+    return ctx.obj
+
+
+def pass_package(f):
+    """Pass the package in the current directory as first argument.
 
-    ctx.obj = load_package(Path.cwd())
+    The package is only loaded for commands that need it.
+    """
+
+    @click.pass_context
+    def new_func(ctx: click.Context, *args, **kwargs):
+        return ctx.invoke(f, _package(ctx), *args, **kwargs)
+
+    return update_wrapper(new_func, f)
 
 
 @cli.command()
-@click.pass_obj
-def build(package: Package):
+@click.option(
+    "--clean/--incremental",
+    default=False,
+    help="Empty the build directory first instead of only copying changed files.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Build even if nothing changed since the last build.",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of files copied or compressed in parallel.",
+)
+@click.option(
+    "--compression-level",
+    type=click.IntRange(min=0, max=9),
+    default=None,
+    help="zlib compression level for the archive, the zlib default if not set.",
+)
+@click.option(
+    "--staging",
+    type=click.Choice(STAGING_STRATEGIES),
+    default=COPY,
+    show_default=True,
+    help="How files are put into the build directory. "
+    "Falls back to a copy if the file system doesn't support it.",
+)
+@click.option(
+    "--direct",
+    is_flag=True,
+    default=False,
+    help="Write the archive straight from the sources, without a build directory.",
+)
+@click.option(
+    "--pipeline",
+    is_flag=True,
+    default=False,
+    help="Compress and write the archive while the files are still copied.",
+)
+@click.option(
+    "--dedupe",
+    is_flag=True,
+    default=False,
+    help="Copy and compress files with the same content only once.",
+)
+@click.option(
+    "--prune",
+    is_flag=True,
+    default=False,
+    help="Leave out the subforms, includes and images of the sources that "
+    "no form or config references.",
+)
+@click.option(
+    "--conflicts",
+    type=click.Choice(CONFLICT_POLICIES),
+    default=WARN,
+    show_default=True,
+    help="Warn or fail if files with different content go to the same destination.",
+)
+@click.option(
+    "--profile",
+    "show_profile",
+    is_flag=True,
+    default=False,
+    help="Print how long each build step took.",
+)
+@click.option(
+    "--trace-file",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Write the timings of the build steps as a Chrome trace to this file.",
+)
+@click.option(
+    "--plan",
+    "plan_file",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="Build from a plan saved by 'pfcli plan', without loading the package.",
+)
+@click.option(
+    "--delta-from",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="Also write an archive with only the entries that changed since this "
+    "archive. It may be the archive the build replaces.",
+)
+@click.option(
+    "--delta-output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Where the delta archive is written, <archive name>.delta.zip if not set.",
+)
+@click.option(
+    "--server/--no-server",
+    "use_server",
+    default=True,
+    show_default=True,
+    help="Hand the build to 'pfcli serve' if it is running.",
+)
+@click.pass_context
+def build(
+    ctx: click.Context,
+    clean: bool,
+    force: bool,
+    jobs: int,
+    compression_level: int,
+    staging: str,
+    direct: bool,
+    pipeline: bool,
+    dedupe: bool,
+    prune: bool,
+    conflicts: str,
+    show_profile: bool,
+    trace_file: typing.Optional[Path],
+    plan_file: typing.Optional[Path],
+    delta_from: typing.Optional[Path],
+    delta_output: typing.Optional[Path],
+    use_server: bool,
+):
     """
     Build a package for the Redaktionssystem.
     """
+    if prune and plan_file is not None:
+        raise click.UsageError(
+            "--prune can't be used with --plan, "
+            "make the plan with 'pfcli plan --prune'."
+        )
+
+    base = None
+    if delta_from is not None:
+        from pfcli.builder.delta import ArchiveIndex
+
+        try:
+            # read before the build, which may replace it.
+            base = ArchiveIndex.read(str(delta_from))
+        except ValueError as e:
+            raise click.UsageError(str(e))
+
+    params = dict(
+        clean=clean,
+        force=force,
+        jobs=jobs,
+        compression_level=compression_level,
+        staging=staging,
+        direct=direct,
+        pipeline=pipeline,
+        dedupe=dedupe,
+        prune=prune,
+        conflicts=conflicts,
+    )
+    # profiles and plans are only done locally.
+    if use_server and plan_file is None and not (show_profile or trace_file):
+        from pfcli.remote import request_build, UP_TO_DATE
+
+        try:
+            result = request_build(Path.cwd(), params)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        if result is not None:
+            if result["result"] == UP_TO_DATE:
+                click.echo(f"'{result['archive']}' is up to date.")
+            if base is not None:
+                _write_delta(base, result["archive"], delta_output)
+            return
+
+    from pfcli import profile
+    from pfcli.builder import Builder, BuildOptions
+
+    options = BuildOptions.create(**params)
+    profiler = profile.enable() if show_profile or trace_file else None
     try:
-        builder = Builder(package)
+        if plan_file is None:
+            builder = Builder(_package(ctx))
+        else:
+            from pfcli.builder.plan import BuildPlan, PlannedBuilder
 
-        builder.initialise_build_path()
-        builder.copy_files()
-        builder.generate_package_file()
-        builder.zip_package()
+            builder = PlannedBuilder(BuildPlan.load(plan_file))
+        if not builder.build(options):
+            click.echo(f"'{builder.archive_filename}' is up to date.")
+        if base is not None:
+            _write_delta(base, builder.archive_filename, delta_output)
     except (ValueError, KeyError) as e:
         raise click.UsageError(str(e))
     except OSError as os_error:
         raise click.UsageError(str(os_error))
+    finally:
+        if profiler is not None:
+            profile.disable()
+            if show_profile:
+                click.echo(profiler.summary(), err=True)
+            if trace_file:
+                profiler.write_chrome_trace(trace_file)
+
+
+def _write_delta(base, archive_filename: str, delta_output: typing.Optional[Path]):
+    from pfcli.builder.delta import write_delta
+
+    if delta_output is None:
+        delta_output = Path(archive_filename).with_suffix(".delta.zip")
+    manifest = write_delta(base, archive_filename, str(delta_output))
+    click.echo(f"wrote delta '{delta_output}': {manifest.summary()}")
+
+
+@cli.command("apply-delta")
+@click.argument("base", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.argument("delta", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False, path_type=Path),
+    required=True,
+    help="Where the complete archive is written, it may be BASE.",
+)
+def apply_delta(base: Path, delta: Path, output: Path):
+    """
+    Put a complete archive together from the archive BASE and a DELTA
+    written by 'pfcli build --delta-from BASE'.
+    """
+    from pfcli.builder.delta import apply_delta as _apply_delta
+
+    try:
+        manifest = _apply_delta(str(base), str(delta), str(output))
+    except (ValueError, OSError) as e:
+        raise click.UsageError(str(e))
+    click.echo(f"wrote '{output}': {manifest.summary()}")
+
+
+@cli.command()
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Write the plan to this file instead of printing it.",
+)
+@click.option(
+    "--prune",
+    is_flag=True,
+    default=False,
+    help="Leave out the files no form or config references, like 'build --prune'.",
+)
+@pass_package
+def plan(package: Package, output: typing.Optional[Path], prune: bool):
+    """
+    Show what a build would do as JSON: every file with its source,
+    destination, package and section, and the package xml.
+    """
+    from pfcli.builder import Builder
+    from pfcli.builder.plan import make_plan
+
+    try:
+        builder = Builder(package)
+        builder.set_prune(prune)
+        _plan = make_plan(builder)
+    except (ValueError, KeyError) as e:
+        raise click.UsageError(str(e))
+
+    if output is None:
+        click.echo(
+            json.dumps(_plan.to_dict(), indent=2, ensure_ascii=False, default=str)
+        )
+    else:
+        _plan.save(output)
+
+
+@cli.command()
+@click.argument(
+    "archive",
+    required=False,
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default="number of CPUs",
+    help="Number of files hashed or read in parallel.",
+)
+@click.option(
+    "--quick",
+    is_flag=True,
+    default=False,
+    help="Trust the CRCs in the archive's directory, don't read the entries.",
+)
+@click.option(
+    "--prune",
+    is_flag=True,
+    default=False,
+    help="Check against a build with --prune.",
+)
+@click.pass_context
+def verify(
+    ctx: click.Context,
+    archive: typing.Optional[Path],
+    jobs: int,
+    quick: bool,
+    prune: bool,
+):
+    """
+    Check that ARCHIVE, the package's archive if not given, has exactly the
+    files and package xml a build of the package would put into it.
+    Exits with 1 if it doesn't.
+    """
+    from pfcli.builder import Builder
+    from pfcli.builder.verify import verify_archive
+
+    try:
+        builder = Builder(_package(ctx))
+        builder.set_prune(prune)
+        result = verify_archive(
+            builder,
+            None if archive is None else str(archive),
+            jobs=jobs,
+            check_data=not quick,
+        )
+    except (ValueError, KeyError, OSError) as e:
+        raise click.UsageError(str(e))
+
+    for line in result.report():
+        click.echo(line)
+    if not result.ok:
+        click.echo(f"'{result.archive}' doesn't match the package.")
+        ctx.exit(1)
+    click.echo(f"'{result.archive}' matches the package, {result.checked} file(s).")
+
+
+@cli.command("build-all")
+@click.argument(
+    "root",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default=".",
+)
+@click.option(
+    "--processes",
+    "-p",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default=True,
+    help="Number of packages built in parallel.",
+)
+@click.option(
+    "--archive-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Write all archives to this directory instead of the package directories.",
+)
+@click.option(
+    "--clean/--incremental",
+    default=False,
+    help="Empty the build directories first instead of only copying changed files.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Build even if nothing changed since the last build.",
+)
+@click.option(
+    "--compression-level",
+    type=click.IntRange(min=0, max=9),
+    default=None,
+    help="zlib compression level for the archives, the zlib default if not set.",
+)
+@click.option(
+    "--staging",
+    type=click.Choice(STAGING_STRATEGIES),
+    default=COPY,
+    show_default=True,
+    help="How files are put into the build directories.",
+)
+@click.option(
+    "--direct",
+    is_flag=True,
+    default=False,
+    help="Write the archives straight from the sources, without build directories.",
+)
+@click.option(
+    "--dedupe",
+    is_flag=True,
+    default=False,
+    help="Copy and compress files with the same content only once.",
+)
+@click.option(
+    "--conflicts",
+    type=click.Choice(CONFLICT_POLICIES),
+    default=WARN,
+    show_default=True,
+    help="Warn or fail if files with different content go to the same destination.",
+)
+@click.pass_context
+def build_all(
+    ctx: click.Context,
+    root: Path,
+    processes: int,
+    archive_dir: typing.Optional[Path],
+    clean: bool,
+    force: bool,
+    compression_level: int,
+    staging: str,
+    direct: bool,
+    dedupe: bool,
+    conflicts: str,
+):
+    """
+    Build all packages of type rs_package below ROOT.
+    """
+    from pfcli.builder import BuildOptions, batch
+    from pfcli.builder.archive import ArchiveOptions
+
+    options = BuildOptions(
+        clean=clean,
+        force=force,
+        staging=staging,
+        direct=direct,
+        dedupe=dedupe,
+        conflicts=conflicts,
+        archive=ArchiveOptions(compresslevel=compression_level, dedupe=dedupe),
+    )
+    if archive_dir is not None:
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        archive_dir = archive_dir.resolve()
+
+    results = batch.build_all(
+        root.resolve(), options, processes=processes, archive_dir=archive_dir
+    )
+
+    for result in results:
+        status = "ok" if result.ok else "FAILED"
+        up_to_date = "" if result.built else ", up to date"
+        click.echo(
+            f"{status:<6} {result.seconds:8.2f}s  {result.name} ({result.path}{up_to_date})"
+        )
+        if result.error:
+            click.echo(textwrap.indent(result.error, "         "))
+
+    failed = sum(1 for result in results if not result.ok)
+    click.echo(
+        f"{len(results)} package(s), {len(results) - failed} ok, {failed} failed, "
+        f"{sum(r.seconds for r in results):.2f}s build time."
+    )
+    if failed:
+        ctx.exit(1)
+
+
+@cli.command()
+@click.argument("paths", nargs=-1, type=click.Path(path_type=Path))
+@click.option(
+    "--root",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default=".",
+    show_default=True,
+    help="The directory the packages are searched in.",
+)
+@click.option(
+    "--index",
+    "index_file",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Where the index of the packages below ROOT is kept, "
+    "in the cache directory if not set.",
+)
+def affected(
+    paths: typing.Tuple[Path, ...], root: Path, index_file: typing.Optional[Path]
+):
+    """
+    List the packages of type rs_package below --root that have to be built
+    again after PATHS changed, because they use one of them directly or
+    through their includes. Without PATHS they are read from stdin, one per
+    line, like the output of 'git diff --name-only'. Relative PATHS are
+    relative to --root.
+    """
+    from pfcli.package.workspace import WorkspaceIndex, index_file as _index_file
+
+    if not paths:
+        stdin = click.get_text_stream("stdin")
+        paths = tuple(Path(line.strip()) for line in stdin if line.strip())
+
+    root = root.resolve()
+    index_file = index_file or _index_file(root)
+    index = WorkspaceIndex.load(root, index_file)
+    read, removed = index.update()
+    config.decho(
+        f"{len(index.packages)} package(s) in the index, "
+        f"{read} config(s) read, {removed} removed"
+    )
+    try:
+        index.save(index_file)
+    except OSError as err:
+        config.decho(f"could not save the workspace index '{index_file}': {err}")
+
+    for entry in index.affected(paths):
+        click.echo(root.joinpath(entry.path))
+
+
+@cli.command()
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0.05),
+    default=0.5,
+    show_default=True,
+    help="Seconds between checks for changed files.",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of files copied or compressed in parallel.",
+)
+@click.option(
+    "--compression-level",
+    type=click.IntRange(min=0, max=9),
+    default=None,
+    help="zlib compression level for the archive, the zlib default if not set.",
+)
+@click.option(
+    "--staging",
+    type=click.Choice(STAGING_STRATEGIES),
+    default=COPY,
+    show_default=True,
+    help="How files are put into the build directory.",
+)
+@click.option(
+    "--dedupe",
+    is_flag=True,
+    default=False,
+    help="Copy and compress files with the same content only once.",
+)
+@click.option(
+    "--conflicts",
+    type=click.Choice(CONFLICT_POLICIES),
+    default=WARN,
+    show_default=True,
+    help="Warn or fail if files with different content go to the same destination.",
+)
+def watch(
+    interval: float,
+    jobs: int,
+    compression_level: int,
+    staging: str,
+    dedupe: bool,
+    conflicts: str,
+):
+    """
+    Build the package and rebuild it whenever a file of the package
+    or one of its includes changes.
+    """
+    from pfcli.builder import BuildOptions
+    from pfcli.builder.archive import ArchiveOptions
+    from pfcli.builder.watch import Watcher
+
+    options = BuildOptions(
+        jobs=jobs,
+        staging=staging,
+        dedupe=dedupe,
+        conflicts=conflicts,
+        archive=ArchiveOptions(
+            compresslevel=compression_level, jobs=jobs, dedupe=dedupe
+        ),
+    )
+    try:
+        Watcher(Path.cwd(), options, interval=interval).run()
+    except (ValueError, KeyError, OSError) as e:
+        raise click.UsageError(str(e))
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+def serve():
+    """
+    Run a build server. 'pfcli build' hands its builds to it, the loaded
+    packages and what is known about their files are kept between builds.
+
+    The server listens on the Unix socket PFCLI_SOCKET, or on one in the
+    cache directory if it isn't set.
+    """
+    from pfcli.builder.server import serve as _serve
+
+    try:
+        _serve(config.socket_path())
+    except (ValueError, OSError) as e:
+        raise click.UsageError(str(e))
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command("config")
+@click.option(
+    "--resolved",
+    is_flag=True,
+    default=False,
+    help="Show the effective configuration including all includes "
+    "and the package each value comes from.",
+)
+@pass_package
+def show_config(package: Package, resolved: bool):
+    """
+    Show the configuration of the package as JSON.
+    """
+    try:
+        if resolved:
+            from pfcli.builder import Builder
+
+            _config = Builder(package).resolved_config.as_dict()
+        else:
+            _config = package.config.data
+    except (ValueError, KeyError) as e:
+        raise click.UsageError(str(e))
+
+    click.echo(json.dumps(_config, indent=2, ensure_ascii=False, default=str))
 
 
 if __name__ == "__main__":
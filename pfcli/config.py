@@ -1,17 +1,42 @@
 from collections import UserDict
+import hashlib
 import os
 from pathlib import Path
+import pickle
+import tempfile
 
 import click
-import tomli
+
+try:
+    from platformdirs import user_cache_dir
+except ImportError:  # platformdirs is optional
+    user_cache_dir = None
 
 
 CONFIG_FILENAME = "package.toml"
 BUILD_DIR = "_build"
 BUILD_DIR_FILE = ".builddir"
+BUILD_MANIFEST = ".buildmanifest.json"
 RS_PACKAGE_CONFIGURATION = "rs_package_configuration.xml"
 
+# how files are put into the build directory.
+COPY = "copy"
+HARDLINK = "hardlink"
+REFLINK = "reflink"
+SYMLINK = "symlink"
+STAGING_STRATEGIES = (COPY, HARDLINK, REFLINK, SYMLINK)
+
+# what to do if files with different content go to the same destination.
+WARN = "warn"
+ERROR = "error"
+CONFLICT_POLICIES = (WARN, ERROR)
+
+CACHE_DIR_ENV = "PFCLI_CACHE_DIR"
+SOCKET_ENV = "PFCLI_SOCKET"
+_CACHE_VERSION = 1
+
 _DEBUG = False
+_USE_CACHE = True
 
 
 def set_debug(debug: bool):
@@ -19,11 +44,28 @@ def set_debug(debug: bool):
     _DEBUG = debug
 
 
+def get_debug() -> bool:
+    return _DEBUG
+
+
+def set_use_cache(use_cache: bool):
+    global _USE_CACHE
+    _USE_CACHE = use_cache
+
+
+def get_use_cache() -> bool:
+    return _USE_CACHE
+
+
 def decho(msg: str):
     if _DEBUG:
         click.echo(msg)
 
 
+def warn(msg: str):
+    click.echo(f"warning: {msg}", err=True)
+
+
 class Config(UserDict):
     pass
 
@@ -32,10 +74,85 @@ def load(path: Path):
     config_filename = os.path.join(path, CONFIG_FILENAME)
 
     if not os.path.exists(config_filename):
-        raise click.UsageError(message)(
+        raise click.UsageError(
             f"{CONFIG_FILENAME} not found in {path}. This is not a pfcli package."
         )
 
-    _toml = tomli.load(open(config_filename, "rb"))
+    if _USE_CACHE:
+        _toml = _load_cached(config_filename)
+    else:
+        _toml = _parse(config_filename)
 
     return Config(_toml)
+
+
+def _parse(config_filename: str) -> dict:
+    # imported here, configs found in the cache don't need the parser.
+    import tomli
+
+    with open(config_filename, "rb") as f:
+        return tomli.load(f)
+
+
+def cache_dir() -> Path:
+    """The directory of the parsed config cache.
+
+    It can be set with the environment variable PFCLI_CACHE_DIR.
+    """
+    if CACHE_DIR_ENV in os.environ:
+        return Path(os.environ[CACHE_DIR_ENV])
+    if user_cache_dir is not None:
+        return Path(user_cache_dir("pfcli"))
+    return Path.home().joinpath(".cache", "pfcli")
+
+
+def socket_path() -> Path:
+    """The Unix socket 'pfcli serve' listens on.
+
+    It can be set with the environment variable PFCLI_SOCKET, otherwise
+    it is in the cache directory.
+    """
+    if SOCKET_ENV in os.environ:
+        return Path(os.environ[SOCKET_ENV])
+    return cache_dir().joinpath("server.sock")
+
+
+def _load_cached(config_filename: str) -> dict:
+    """Parse config_filename, using the parsed config from the cache if
+    the file has the same mtime and size as when it was cached.
+    """
+    config_filename = os.path.abspath(config_filename)
+    stat = os.stat(config_filename)
+    key = (config_filename, stat.st_mtime_ns, stat.st_size)
+
+    name = hashlib.sha1(config_filename.encode("utf-8")).hexdigest()
+    cache_file = cache_dir().joinpath("configs", f"{name}.pickle")
+
+    try:
+        with open(cache_file, "rb") as f:
+            version, cached_key, data = pickle.load(f)
+        if version == _CACHE_VERSION and cached_key == key:
+            decho(f"using cached config for '{config_filename}'")
+            return data
+    except FileNotFoundError:
+        pass  # not cached yet
+    except Exception as err:  # e.g. written by another version, parse it again
+        decho(f"could not read the cached config of '{config_filename}': {err!r}")
+
+    data = _parse(config_filename)
+
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, parallel builds may read it.
+        fd, tmp_name = tempfile.mkstemp(dir=cache_file.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((_CACHE_VERSION, key, data), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_name, cache_file)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+    except (OSError, pickle.PicklingError) as err:
+        decho(f"could not cache config '{config_filename}': {err}")
+
+    return data
@@ -4,6 +4,7 @@ from pathlib import Path
 import typing
 
 from pfcli import config
+from .scanner import scan, StatIndex
 
 Destination = str
 
@@ -144,27 +145,30 @@ class Package:
 
         return values
 
-    def get_source_files(self, destination: Path) -> typing.List[Path]:
-        sources = self.get_sources(destination)
-        files = self._expand_patterns(sources)
-        return files
-
-    def _expand_patterns(self, patterns: typing.List[str]) -> typing.List[Path]:
-        files = []
-
-        path = Path(self.basepath)
-        for pattern in patterns:
-            pattern_path = Path(pattern)
-            pattern_base = (
-                self.basepath
-                if pattern_path.parent == "."
-                else self.basepath.joinpath(*pattern_path.parts[:1])
-            )
-            pattern_files = list(path.glob(pattern))
-            files.extend(f.relative_to(self.basepath) for f in pattern_files)
+    def scan_sources(
+        self, stat_index: typing.Optional[StatIndex] = None
+    ) -> typing.Dict[Destination, typing.List[Path]]:
+        """Find the source files of all destinations with a single walk of
+        the package.
 
+        Returns the files relative to the basepath by destination.
+        """
+        sources = self.get_all_sources()
+        patterns = self._get_list_extended(sources, "paths")
+        matches = scan(self.basepath, patterns, stat_index)
+
+        files: typing.Dict[Destination, typing.List[Path]] = {}
+        for source in sources:
+            destination_files = files.setdefault(source.destination, [])
+            for pattern in source.paths:
+                destination_files.extend(matches[pattern])
         return files
 
+    def get_source_files(
+        self, destination: Destination, stat_index: typing.Optional[StatIndex] = None
+    ) -> typing.List[Path]:
+        return self.scan_sources(stat_index).get(destination, [])
+
     def get_test_data(self) -> Testdata:
         testdata = self.config["testdata"]
 
@@ -262,7 +266,7 @@ def load_package(path: Path) -> Package:
                 )
             package_path = path.joinpath(inc_path).resolve()
             if package_path.is_relative_to(package.basepath):
-                raise ValueError1(
+                raise ValueError(
                     f"Include '{inc}' in package '{package.name}' is subpath of the package. "
                     "Include paths for packages outside of the package that is including them."
                 )
@@ -273,5 +277,10 @@ def load_package(path: Path) -> Package:
     return package
 
 
+def clear_package_cache():
+    """Forget all loaded packages, so they are loaded again from disk."""
+    _packages.clear()
+
+
 # a dict of processed packages.
 _packages: typing.OrderedDict[Path, Package] = OrderedDict()
@@ -0,0 +1,60 @@
+from pathlib import Path
+import typing
+
+from pfcli.package import Package
+
+
+class IncludeCycleError(ValueError):
+    def __init__(self, cycle: typing.List[Package]):
+        self.cycle = cycle
+        path = " -> ".join(f"'{p.name}' ({p.basepath})" for p in cycle)
+        super().__init__(
+            f"Include cycle detected: {path}.\n"
+            "Packages can't include themselves, directly or through other packages."
+        )
+
+
+def resolve_include_order(package: Package) -> typing.List[Package]:
+    """Linearize the include graph of package.
+
+    Every package comes after all the packages it includes and the
+    package itself is last. A package included more than once, like a
+    shared include in a diamond, is listed once. For includes that form a
+    tree the order is the same as reversing the depth first walk of the
+    includes, so the first include of a package takes precedence over the
+    later ones.
+
+    Raises IncludeCycleError with the packages forming the cycle.
+    """
+    order: typing.List[Package] = []
+    done: typing.Set[Path] = set()
+
+    # the packages currently being visited, and what's left of their
+    # includes. Iterative, so deep include chains can't hit the
+    # recursion limit.
+    path: typing.List[Package] = [package]
+    on_path: typing.Set[Path] = {package.basepath}
+    stack = [iter(reversed(package.includes))]
+
+    while stack:
+        for include in stack[-1]:
+            if include.basepath in on_path:
+                start = next(
+                    i for i, p in enumerate(path) if p.basepath == include.basepath
+                )
+                raise IncludeCycleError(path[start:] + [include])
+            if include.basepath in done:
+                continue
+
+            path.append(include)
+            on_path.add(include.basepath)
+            stack.append(iter(reversed(include.includes)))
+            break
+        else:
+            stack.pop()
+            current = path.pop()
+            on_path.discard(current.basepath)
+            done.add(current.basepath)
+            order.append(current)
+
+    return order
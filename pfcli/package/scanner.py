@@ -0,0 +1,180 @@
+import os
+from pathlib import Path, PurePath
+import re
+import typing
+
+# pathlib globbing is case insensitive on windows.
+_FLAGS = re.IGNORECASE if os.name == "nt" else 0
+
+
+class StatIndex:
+    """A cache of os.stat results, so a file is stat-ed once per build
+    no matter how many stages look at it.
+    """
+
+    def __init__(self):
+        self._stats: typing.Dict[Path, os.stat_result] = {}
+
+    def add(self, path: Path, stat: os.stat_result):
+        self._stats[path] = stat
+
+    def stat(self, path: Path) -> os.stat_result:
+        try:
+            return self._stats[path]
+        except KeyError:
+            stat = self._stats[path] = path.stat()
+            return stat
+
+    def invalidate(self, path: typing.Optional[Path] = None):
+        if path is None:
+            self._stats.clear()
+        else:
+            self._stats.pop(path, None)
+
+    def __contains__(self, path: Path) -> bool:
+        return path in self._stats
+
+    def __len__(self) -> int:
+        return len(self._stats)
+
+
+def _translate_part(part: str) -> str:
+    """Translate a single path segment of a glob pattern into a regex."""
+    regex = ""
+    i = 0
+    while i < len(part):
+        c = part[i]
+        i += 1
+        if c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[":
+            end = part.find("]", i + 1 if part[i : i + 1] in ("!", "]") else i)
+            if end == -1:
+                regex += re.escape(c)
+                continue
+            chars = part[i:end].replace("\\", "\\\\")
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            elif chars.startswith("^"):
+                chars = "\\" + chars
+            regex += f"[{chars}]"
+            i = end + 1
+        else:
+            regex += re.escape(c)
+    return regex
+
+
+def compile_pattern(pattern: str) -> typing.Pattern:
+    """Compile a glob pattern, with the semantics of Path.glob, into a
+    regular expression matching relative posix paths of files.
+
+    '**' matches any number of directories, '*' and '?' never match a '/'.
+    """
+    regex = ""
+    for part in PurePath(pattern).parts:
+        if part == "**":
+            regex += "(?:[^/]+/)*"
+        else:
+            regex += _translate_part(part) + "/"
+    return re.compile(regex.rstrip("/") + r"\Z", _FLAGS)
+
+
+def _literal_prefix(pattern: str) -> typing.Tuple[str, ...]:
+    """The leading directories of pattern without any wildcards."""
+    prefix = []
+    for part in PurePath(pattern).parts[:-1]:
+        if any(c in part for c in "*?["):
+            break
+        prefix.append(part)
+    return tuple(prefix)
+
+
+def _directory_matcher(
+    pattern: str,
+) -> typing.Callable[[typing.Tuple[str, ...]], bool]:
+    """A function telling if files matching pattern can be in a directory,
+    given by its path segments.
+
+    Without a '**' only directories with fewer segments than the pattern,
+    each matching its segment of the pattern, can have matching files.
+    With one, any directory below the segments before it can.
+    """
+    parts = PurePath(pattern).parts
+    recursive = "**" in parts
+    dir_parts = parts[: parts.index("**")] if recursive else parts[:-1]
+    regexes = [re.compile(_translate_part(part) + r"\Z", _FLAGS) for part in dir_parts]
+
+    def matches(segments: typing.Tuple[str, ...]) -> bool:
+        if not recursive and len(segments) > len(regexes):
+            return False
+        return all(regex.match(segment) for regex, segment in zip(regexes, segments))
+
+    return matches
+
+
+def scan(
+    basepath: Path,
+    patterns: typing.Iterable[str],
+    stat_index: typing.Optional[StatIndex] = None,
+) -> typing.Dict[str, typing.List[Path]]:
+    """Match all patterns against the files in basepath in a single walk.
+
+    Only the directories the patterns can match in are visited, symlinked
+    directories aren't followed. Returns the sorted files matching each
+    pattern, relative to basepath. The stat result of every matching file
+    is stored in stat_index.
+    """
+    patterns = list(dict.fromkeys(patterns))
+    matchers = {pattern: compile_pattern(pattern) for pattern in patterns}
+    matches: typing.Dict[str, typing.List[Path]] = {p: [] for p in patterns}
+
+    # a walk from the shortest common literal prefix is enough.
+    roots = set()
+    for pattern in patterns:
+        prefix = _literal_prefix(pattern)
+        if not any(prefix[: len(root)] == root for root in roots):
+            roots = {root for root in roots if root[: len(prefix)] != prefix}
+            roots.add(prefix)
+
+    # only directories that can have matching files are walked into.
+    directory_matchers = [_directory_matcher(pattern) for pattern in patterns]
+
+    def descend(rel_path: str) -> bool:
+        segments = tuple(rel_path.split("/"))
+        return any(matcher(segments) for matcher in directory_matchers)
+
+    for root in sorted(roots):
+        for rel_path, entry in _walk(basepath.joinpath(*root), "/".join(root), descend):
+            matched = False
+            for pattern, matcher in matchers.items():
+                if matcher.match(rel_path):
+                    matches[pattern].append(Path(rel_path))
+                    matched = True
+            if matched and stat_index is not None:
+                stat_index.add(basepath.joinpath(rel_path), entry.stat())
+
+    for files in matches.values():
+        files.sort()
+    return matches
+
+
+def _walk(
+    path: Path, rel_path: str, descend: typing.Callable[[str], bool]
+) -> typing.Iterator[typing.Tuple[str, os.DirEntry]]:
+    """The files below path, only walking into the directories descend is
+    True for, given their path relative to the base path.
+    """
+    try:
+        entries = list(os.scandir(path))
+    except (FileNotFoundError, NotADirectoryError):
+        return
+
+    for entry in entries:
+        entry_rel_path = f"{rel_path}/{entry.name}" if rel_path else entry.name
+        if entry.is_dir(follow_symlinks=False):
+            if descend(entry_rel_path):
+                yield from _walk(Path(entry.path), entry_rel_path, descend)
+        elif entry.is_file():
+            yield entry_rel_path, entry
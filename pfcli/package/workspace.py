@@ -0,0 +1,261 @@
+"""An index of all packages below a root, and which of them are affected by
+changed files.
+
+The index records for every package its type, its includes and the
+files it takes: the [[source]] patterns and the files named by its
+sections. It is kept on disk and updated incrementally, only package
+configs that changed since the last update are read again.
+"""
+from collections import deque
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+import typing
+
+from pfcli import config
+from pfcli.config import decho, BUILD_DIR, CONFIG_FILENAME
+from .scanner import compile_pattern
+
+INDEX_VERSION = 1
+RS_PACKAGE = "rs_package"
+
+
+def find_package_paths(root: Path) -> typing.List[Path]:
+    """All directories below root with a package config, sorted.
+
+    Build directories and hidden directories are skipped.
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(
+            d for d in dirnames if d != BUILD_DIR and not d.startswith(".")
+        )
+        if CONFIG_FILENAME in filenames:
+            paths.append(Path(dirpath).resolve())
+    return paths
+
+
+def _relative(path: Path, root: Path) -> str:
+    """path relative to root as a posix path, with '..' if it is outside."""
+    return Path(os.path.relpath(path, root)).as_posix()
+
+
+def _config_key(path: Path) -> typing.List[int]:
+    stat = path.joinpath(CONFIG_FILENAME).stat()
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+@dataclass
+class PackageEntry:
+    """What the index knows about a package.
+
+    path and includes are relative to the root of the index, sources
+    are the [[source]] patterns and files the files named by the other
+    sections, both relative to the package. config is the mtime and size
+    of the package config when it was read. A package whose config can't
+    be read has the error.
+    """
+
+    path: str
+    name: str
+    type: typing.Optional[str] = None
+    config: typing.List[int] = field(default_factory=list)
+    includes: typing.List[str] = field(default_factory=list)
+    sources: typing.List[str] = field(default_factory=list)
+    files: typing.List[str] = field(default_factory=list)
+    error: typing.Optional[str] = None
+
+    @classmethod
+    def read(cls, root: Path, path: Path) -> "PackageEntry":
+        entry = cls(_relative(path, root), path.name, config=_config_key(path))
+        try:
+            conf = config.load(path)
+            entry.name = conf.get("name", path.name)
+            entry.type = conf.get("type")
+            entry.includes = [
+                _relative(path.joinpath(inc).resolve(), root)
+                for inc in conf.get("include", [])
+            ]
+            entry.sources = [
+                pattern
+                for source in conf.get("source", [])
+                for pattern in source.get("paths", [])
+            ]
+
+            files = [
+                f.get("path")
+                for section in ("testdata", "transaction_form_page_background")
+                for f in conf.get(section, {}).get("file", [])
+            ]
+            files.append(conf.get("fontdefinition", {}).get("path"))
+            files.append(conf.get("transaction_form"))
+        except Exception as err:  # one broken package must not stop the index
+            entry.error = f"{err}".strip()
+            return entry
+
+        entry.files = sorted({Path(f).as_posix() for f in files if isinstance(f, str)})
+        return entry
+
+    def uses(self, rel_path: str) -> bool:
+        """Whether the file rel_path, relative to the package, is part of
+        the package. Everything is for a package with a broken config.
+        """
+        if rel_path == CONFIG_FILENAME or self.error is not None:
+            return True
+        if rel_path in self.files:
+            return True
+        return any(compile_pattern(p).match(rel_path) for p in self.sources)
+
+
+@dataclass
+class WorkspaceIndex:
+    """The packages below root, by their path relative to it."""
+
+    root: Path
+    packages: typing.Dict[str, PackageEntry] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {
+            "version": INDEX_VERSION,
+            "root": str(self.root),
+            "packages": [vars(entry) for entry in self.packages.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "WorkspaceIndex":
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError(
+                f"Unsupported workspace index version '{data.get('version')}'."
+            )
+        try:
+            packages = [PackageEntry(**entry) for entry in data["packages"]]
+            return cls(Path(data["root"]), {entry.path: entry for entry in packages})
+        except (KeyError, TypeError) as err:
+            raise ValueError(f"Invalid workspace index, {err} is missing or wrong.")
+
+    @classmethod
+    def load(cls, root: Path, index_file: Path) -> "WorkspaceIndex":
+        """The index of root saved in index_file, an empty one if there is
+        none or it is of another root.
+        """
+        try:
+            with open(index_file, "rb") as f:
+                index = cls.from_dict(json.load(f))
+            if index.root == root:
+                return index
+            decho(f"'{index_file}' is the index of '{index.root}', not '{root}'")
+        except FileNotFoundError:
+            pass
+        except ValueError as err:
+            decho(f"ignoring the workspace index '{index_file}': {err}")
+        return cls(root)
+
+    def save(self, index_file: Path):
+        index_file.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, a build may read it.
+        fd, tmp_name = tempfile.mkstemp(dir=index_file.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+        os.replace(tmp_name, index_file)
+
+    def update(self) -> typing.Tuple[int, int]:
+        """Find the packages below root again. The configs of new packages
+        and of packages whose config changed are read, the others are
+        taken from the index. Returns how many configs were read and how
+        many packages were removed.
+        """
+        packages = {}
+        read = 0
+        for path in find_package_paths(self.root):
+            rel_path = _relative(path, self.root)
+            entry = self.packages.get(rel_path)
+            if entry is None or entry.config != _config_key(path):
+                decho(f"reading the package config of '{rel_path}'")
+                entry = PackageEntry.read(self.root, path)
+                read += 1
+            packages[rel_path] = entry
+        removed = len(self.packages.keys() - packages.keys())
+        self.packages = packages
+        return read, removed
+
+    def includers(self) -> typing.Dict[str, typing.Set[str]]:
+        """The reverse include graph: the packages including each package.
+        Includes that aren't in the index, below or outside of root, are
+        in it too.
+        """
+        graph: typing.Dict[str, typing.Set[str]] = {}
+        for entry in self.packages.values():
+            for include in entry.includes:
+                graph.setdefault(include, set()).add(entry.path)
+        return graph
+
+    @staticmethod
+    def _owner(rel_path: str, owners: typing.Iterable[str]) -> typing.Optional[str]:
+        """The package rel_path belongs to, the innermost one if packages
+        are nested. owners are package paths relative to the root, which
+        is '.'.
+        """
+        inside_root = rel_path != ".." and not rel_path.startswith("../")
+        best, best_depth = None, -1
+        for owner in owners:
+            if owner == ".":
+                depth = 0 if inside_root else -1
+            elif rel_path.startswith(owner + "/"):
+                depth = owner.count("/") + 1
+            else:
+                continue
+            if depth > best_depth:
+                best, best_depth = owner, depth
+        return best
+
+    def affected(
+        self, paths: typing.Iterable[Path], base: typing.Optional[Path] = None
+    ) -> typing.List[PackageEntry]:
+        """The packages of type rs_package that have to be built again if
+        the files paths changed, added or removed: the packages using them
+        and all packages including these, directly or indirectly.
+
+        Relative paths are relative to base, the root if it isn't set.
+        """
+        base = self.root if base is None else base
+        includers = self.includers()
+        owners = set(self.packages) | set(includers)
+
+        changed = set()
+        for path in paths:
+            rel_path = _relative(base.joinpath(path).resolve(), self.root)
+            owner = self._owner(rel_path, owners)
+            if owner is None:
+                decho(f"'{path}' isn't part of any package")
+                continue
+            entry = self.packages.get(owner)
+            package_path = rel_path if owner == "." else rel_path[len(owner) + 1 :]
+            # includes that aren't in the index, like removed packages,
+            # are affected by any change.
+            if entry is None or entry.uses(package_path):
+                changed.add(owner)
+            else:
+                decho(f"'{path}' isn't used by package '{owner}'")
+
+        seen = set(changed)
+        todo = deque(changed)
+        while todo:
+            for includer in includers.get(todo.popleft(), ()):
+                if includer not in seen:
+                    seen.add(includer)
+                    todo.append(includer)
+
+        return [
+            self.packages[p]
+            for p in sorted(seen)
+            if p in self.packages and self.packages[p].type == RS_PACKAGE
+        ]
+
+
+def index_file(root: Path) -> Path:
+    """Where the index of root is kept by default, in the cache directory."""
+    name = hashlib.sha1(str(root).encode("utf-8")).hexdigest()
+    return config.cache_dir().joinpath("workspaces", f"{name}.json")
@@ -0,0 +1,169 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import json
+import os
+from pathlib import Path
+import threading
+import time
+import typing
+
+
+@dataclass
+class Span:
+    """A timed step of the build, with counters for what it processed."""
+
+    name: str
+    category: str
+    start: float
+    depth: int
+    thread: int
+    end: typing.Optional[float] = None
+    files: int = 0
+    bytes: int = 0
+    args: typing.Dict[str, typing.Any] = field(default_factory=dict)
+
+    @property
+    def seconds(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def add(self, files: int = 0, bytes: int = 0, **args):
+        self.files += files
+        self.bytes += bytes
+        self.args.update(args)
+
+
+class _NullSpan:
+    def add(self, files: int = 0, bytes: int = 0, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    def __init__(self):
+        self.spans: typing.List[Span] = []
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, category: str = "build", **args):
+        depth = getattr(self._local, "depth", 0)
+        span = Span(
+            name,
+            category,
+            time.perf_counter(),
+            depth,
+            threading.get_ident(),
+            args=dict(args),
+        )
+        with self._lock:
+            self.spans.append(span)
+
+        self._local.depth = depth + 1
+        try:
+            yield span
+        finally:
+            span.end = time.perf_counter()
+            self._local.depth = depth
+
+    def summary(self) -> str:
+        """The spans as a table, in the order they started."""
+        rows = [("step", "seconds", "files", "bytes")]
+        for span in self.spans:
+            rows.append(
+                (
+                    "  " * span.depth + span.name,
+                    f"{span.seconds:.3f}",
+                    str(span.files) if span.files else "",
+                    _format_bytes(span.bytes) if span.bytes else "",
+                )
+            )
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = []
+        for index, row in enumerate(rows):
+            lines.append(
+                "  ".join(
+                    [row[0].ljust(widths[0])]
+                    + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+                ).rstrip()
+            )
+            if index == 0:
+                lines.append("  ".join("-" * width for width in widths))
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> dict:
+        """The spans in the Chrome trace event format, to be loaded in
+        chrome://tracing or Perfetto.
+        """
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            args = dict(span.args)
+            if span.files:
+                args["files"] = span.files
+            if span.bytes:
+                args["bytes"] = span.bytes
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",
+                    "ts": round((span.start - self.origin) * 1_000_000, 3),
+                    "dur": round(span.seconds * 1_000_000, 3),
+                    "pid": pid,
+                    "tid": span.thread,
+                    "args": {k: _json_value(v) for k, v in args.items()},
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path: Path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, indent=1)
+
+
+def _format_bytes(size: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def _json_value(value: typing.Any) -> typing.Any:
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+_PROFILER: typing.Optional[Profiler] = None
+
+
+def enable() -> Profiler:
+    """Start collecting spans. Returns the profiler collecting them."""
+    global _PROFILER
+    _PROFILER = Profiler()
+    return _PROFILER
+
+
+def disable():
+    global _PROFILER
+    _PROFILER = None
+
+
+def get_profiler() -> typing.Optional[Profiler]:
+    return _PROFILER
+
+
+@contextmanager
+def span(name: str, category: str = "build", **args):
+    """Time the block as a span of the active profiler. Without an active
+    profiler this does nothing.
+    """
+    if _PROFILER is None:
+        yield _NULL_SPAN
+        return
+    with _PROFILER.span(name, category, **args) as _span:
+        yield _span
@@ -0,0 +1,91 @@
+"""Hand builds to a running 'pfcli serve'.
+
+Requests and responses are JSON objects, one per line, sent over a Unix
+socket. A build request gets the output of the build as text messages,
+followed by one result message. This module is used by every 'pfcli
+build', so it doesn't import the builder.
+"""
+import json
+from pathlib import Path
+import socket
+import typing
+
+import click
+
+from pfcli import __version__
+from pfcli.config import decho, get_debug, get_use_cache, socket_path
+
+PROTOCOL_VERSION = 1
+
+# results of a build request.
+BUILT = "built"
+UP_TO_DATE = "up to date"
+FAILED = "failed"
+# the server can't do the build, e.g. it runs another pfcli version.
+REFUSED = "refused"
+
+
+def send(f: typing.BinaryIO, message: dict):
+    f.write(json.dumps(message).encode("utf-8") + b"\n")
+    f.flush()
+
+
+def receive(f: typing.BinaryIO) -> typing.Iterator[dict]:
+    for line in f:
+        yield json.loads(line)
+
+
+def connect(path: typing.Optional[Path] = None) -> typing.Optional[socket.socket]:
+    """Connect to the server at path, None if none is running there."""
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    path = path or socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def request_build(cwd: Path, params: dict) -> typing.Optional[dict]:
+    """Build the package in cwd on the server, with the options of the
+    build command in params.
+
+    The output of the build is echoed. Returns the result message, with
+    the result and the archive filename, or None if no server is running
+    or it refused the build. A failed build raises ValueError.
+    """
+    sock = connect()
+    if sock is None:
+        return None
+
+    decho(f"handing the build to the server at '{socket_path()}'")
+    with sock, sock.makefile("rwb") as f:
+        send(
+            f,
+            {
+                "version": PROTOCOL_VERSION,
+                "pfcli": __version__,
+                "command": "build",
+                "cwd": str(cwd),
+                "debug": get_debug(),
+                "cache": get_use_cache(),
+                "params": params,
+            },
+        )
+        for message in receive(f):
+            if "text" in message:
+                click.echo(message["text"], nl=False, err=message.get("err", False))
+                continue
+
+            result = message.get("result")
+            if result == FAILED:
+                raise ValueError(message["message"])
+            if result == REFUSED:
+                decho(f"the server refused the build: {message['message']}")
+                return None
+            return message
+
+    raise ValueError("The build server closed the connection during the build.")
@@ -0,0 +1,37 @@
+from pathlib import Path
+import shutil
+
+import pytest
+
+from pfcli import config
+from pfcli.package import clear_package_cache
+
+TESTDATA = Path(__file__).parent.parent.joinpath("testdata")
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """A copy of the testdata packages, with its own config cache."""
+    shutil.copytree(
+        TESTDATA,
+        tmp_path,
+        dirs_exist_ok=True,
+        ignore=shutil.ignore_patterns("_build", "*.zip"),
+    )
+    monkeypatch.setenv(config.CACHE_DIR_ENV, str(tmp_path.joinpath("cache")))
+    # the cli sets them for the whole process.
+    monkeypatch.setattr(config, "_DEBUG", config.get_debug())
+    monkeypatch.setattr(config, "_USE_CACHE", config.get_use_cache())
+    clear_package_cache()
+    yield tmp_path
+    clear_package_cache()
+
+
+@pytest.fixture
+def package_path(workspace, monkeypatch):
+    """The package of the testdata, the current directory while the test
+    runs, the package xml has paths relative to it.
+    """
+    path = workspace.joinpath("ZPF_VERTRAGSBEST_BDNV")
+    monkeypatch.chdir(path)
+    return path
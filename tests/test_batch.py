@@ -0,0 +1,30 @@
+from pfcli.builder.batch import build_all
+
+
+def _add_package(path, package_type: str):
+    path.mkdir()
+    path.joinpath("package.toml").write_text(
+        f'type = "{package_type}"\ninclude = ["../_MISSING"]\n', encoding="utf-8"
+    )
+
+
+def test_build_all(workspace):
+    results = build_all(workspace)
+    assert [(r.path.name, r.ok, r.built) for r in results] == [
+        ("ZPF_VERTRAGSBEST_BDNV", True, True)
+    ]
+    assert not build_all(workspace)[0].built
+
+
+def test_load_errors(workspace):
+    """A package that can't be loaded is a failed build only if it's a
+    package that is built.
+    """
+    _add_package(workspace.joinpath("BROKEN"), "rs_package")
+    _add_package(workspace.joinpath("LIB"), "include")
+
+    results = build_all(workspace)
+    assert [(r.path.name, r.ok) for r in results] == [
+        ("BROKEN", False),
+        ("ZPF_VERTRAGSBEST_BDNV", True),
+    ]
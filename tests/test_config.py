@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from pfcli import config
+
+
+@pytest.fixture
+def package_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv(config.CACHE_DIR_ENV, str(tmp_path.joinpath("cache")))
+    monkeypatch.setattr(config, "_USE_CACHE", True)
+    path = tmp_path.joinpath("package")
+    path.mkdir()
+    path.joinpath(config.CONFIG_FILENAME).write_text(
+        'type = "rs_package"\nname = "first"\n', encoding="utf-8"
+    )
+    return path
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """The config files that were parsed."""
+    files = []
+    parse = config._parse
+
+    def counting_parse(config_filename):
+        files.append(config_filename)
+        return parse(config_filename)
+
+    monkeypatch.setattr(config, "_parse", counting_parse)
+    return files
+
+
+def _cache_files():
+    return list(config.cache_dir().joinpath("configs").iterdir())
+
+
+def test_cached(package_dir, parsed):
+    assert config.load(package_dir)["name"] == "first"
+    assert config.load(package_dir)["name"] == "first"
+    assert len(parsed) == 1
+
+
+def test_changed_config(package_dir, parsed):
+    config.load(package_dir)
+    config_file = package_dir.joinpath(config.CONFIG_FILENAME)
+    config_file.write_text('type = "rs_package"\nname = "second"\n')
+    os.utime(config_file, ns=(1, 1))
+    assert config.load(package_dir)["name"] == "second"
+    assert len(parsed) == 2
+
+
+def test_broken_cache_file(package_dir, parsed):
+    """A cache file that can't be read is replaced."""
+    config.load(package_dir)
+    [cache_file] = _cache_files()
+    cache_file.write_bytes(b"not a pickle")
+
+    assert config.load(package_dir)["name"] == "first"
+    assert config.load(package_dir)["name"] == "first"
+    assert len(parsed) == 2
+    assert _cache_files() == [cache_file]
+
+
+def test_cache_not_writable(package_dir, parsed):
+    """The config is parsed every time if it can't be cached."""
+    config.cache_dir().parent.mkdir(exist_ok=True)
+    config.cache_dir().write_text("a file, not a directory")
+
+    assert config.load(package_dir)["name"] == "first"
+    assert config.load(package_dir)["name"] == "first"
+    assert len(parsed) == 2
+
+
+def test_no_cache(package_dir, parsed, monkeypatch):
+    monkeypatch.setattr(config, "_USE_CACHE", False)
+    config.load(package_dir)
+    config.load(package_dir)
+    assert len(parsed) == 2
+    assert not config.cache_dir().exists()
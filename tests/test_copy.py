@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from pfcli.builder import copy
+from pfcli.config import COPY, HARDLINK, STAGING_STRATEGIES, SYMLINK
+
+
+@pytest.fixture
+def source(tmp_path):
+    source = tmp_path.joinpath("source.tci")
+    source.write_bytes(b"AAAA")
+    return source
+
+
+@pytest.mark.parametrize("staging", STAGING_STRATEGIES)
+def test_stage_file(source, staging):
+    dest = source.with_name("dest.tci")
+    copy.stage_file(source, dest, staging)
+    assert dest.read_bytes() == b"AAAA"
+    assert dest.is_symlink() == (staging == SYMLINK)
+    if staging == HARDLINK:
+        assert dest.stat().st_ino == source.stat().st_ino
+
+
+@pytest.mark.parametrize("staging", STAGING_STRATEGIES)
+def test_stage_over_link(source, staging):
+    """A link to the source from an earlier build is replaced, not written
+    through.
+    """
+    dest = source.with_name("dest.tci")
+    dest.symlink_to(source)
+    other = source.with_name("other.tci")
+    other.write_bytes(b"BBBB")
+
+    copy.stage_file(other, dest, staging)
+    assert source.read_bytes() == b"AAAA"
+    assert dest.read_bytes() == b"BBBB"
+
+
+def _failing(source, dest):
+    dest.write_bytes(b"half")
+    raise OSError("not supported")
+
+
+@pytest.mark.parametrize("staging", STAGING_STRATEGIES)
+def test_fallback(source, staging, monkeypatch):
+    """If the ways to stage a file fail, it's copied."""
+    *attempts, last = copy._STAGING_CHAINS[staging]
+    monkeypatch.setitem(
+        copy._STAGING_CHAINS, staging, [_failing] * len(attempts) + [last]
+    )
+    dest = source.with_name("dest.tci")
+    copy.stage_file(source, dest, staging)
+    assert dest.read_bytes() == b"AAAA"
+    assert not dest.is_symlink()
+
+
+def test_short_copy_file_range(source, monkeypatch):
+    """A copy_file_range that ends early falls back to a plain copy."""
+    if not hasattr(os, "copy_file_range"):
+        pytest.skip("no copy_file_range")
+    copy_file_range = os.copy_file_range
+    calls = []
+
+    def short_copy_file_range(src, dst, count, *args):
+        calls.append(count)
+        return copy_file_range(src, dst, 2, *args) if len(calls) == 1 else 0
+
+    monkeypatch.setattr(os, "copy_file_range", short_copy_file_range)
+    dest = source.with_name("dest.tci")
+    copy.stage_file(source, dest, COPY)
+    assert dest.read_bytes() == b"AAAA"
+    assert calls
@@ -0,0 +1,60 @@
+import zipfile
+
+import pytest
+
+from pfcli.builder.delta import (
+    ArchiveIndex,
+    apply_delta,
+    read_delta_manifest,
+    write_delta,
+)
+
+
+def _zip(path, entries: dict):
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in entries.items():
+            zf.writestr(zipfile.ZipInfo(name, (2022, 3, 7, 0, 0, 0)), content)
+    return str(path)
+
+
+@pytest.fixture
+def archives(tmp_path):
+    base = _zip(tmp_path.joinpath("base.zip"), {"a": "A", "b": "B", "c": "C"})
+    new = _zip(tmp_path.joinpath("new.zip"), {"d": "D", "a": "A", "b": "BB"})
+    return base, new
+
+
+def test_round_trip(archives, tmp_path):
+    base, new = archives
+    delta = str(tmp_path.joinpath("new.delta.zip"))
+    manifest = write_delta(ArchiveIndex.read(base), new, delta)
+    assert (manifest.added, manifest.changed, manifest.removed) == (["d"], ["b"], ["c"])
+    assert read_delta_manifest(delta) == manifest
+    with zipfile.ZipFile(delta) as zf:
+        assert sorted(zf.namelist()) == [".pfcli-delta.json", "b", "d"]
+
+    output = tmp_path.joinpath("applied.zip")
+    apply_delta(base, delta, str(output))
+    assert output.read_bytes() == tmp_path.joinpath("new.zip").read_bytes()
+
+    # the base can be replaced.
+    apply_delta(base, delta, base)
+    assert tmp_path.joinpath("base.zip").read_bytes() == output.read_bytes()
+
+
+def test_unchanged(archives, tmp_path):
+    base, _ = archives
+    delta = str(tmp_path.joinpath("base.delta.zip"))
+    assert write_delta(ArchiveIndex.read(base), base, delta).is_empty
+
+
+def test_wrong_base(archives, tmp_path):
+    base, new = archives
+    delta = str(tmp_path.joinpath("new.delta.zip"))
+    write_delta(ArchiveIndex.read(base), new, delta)
+
+    with pytest.raises(ValueError, match="not the archive the delta was made"):
+        apply_delta(new, delta, str(tmp_path.joinpath("applied.zip")))
+    assert not tmp_path.joinpath("applied.zip").exists()
+    with pytest.raises(ValueError, match="is not a delta archive"):
+        apply_delta(base, new, str(tmp_path.joinpath("applied.zip")))
@@ -0,0 +1,35 @@
+import os
+
+from click.testing import CliRunner
+
+from pfcli.client import cli
+
+
+def _build(*args) -> str:
+    result = CliRunner().invoke(cli, ["--debug", "build", "--no-server", *args])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_up_to_date_reported_once(package_path):
+    _build()
+    output = _build()
+    assert output.count("is up to date") == 1
+
+
+def test_rebuild_after_change(package_path):
+    _build()
+    package_path.joinpath("etc", "fonts.ini").write_text("changed")
+    assert "is up to date" not in _build()
+    assert "is up to date" in _build()
+
+
+def test_deterministic_archive(package_path):
+    """Builds of the same files give the same archive, byte for byte, even
+    if their modification times changed.
+    """
+    _build("--clean")
+    first = package_path.joinpath("huhu.zip").read_bytes()
+    os.utime(package_path.joinpath("etc", "fonts.ini"), (1e9, 1e9))
+    _build("--clean")
+    assert package_path.joinpath("huhu.zip").read_bytes() == first
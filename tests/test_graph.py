@@ -0,0 +1,63 @@
+import pytest
+
+from pfcli.config import Config
+from pfcli.package import Package
+from pfcli.package.graph import IncludeCycleError, resolve_include_order
+
+
+@pytest.fixture
+def packages(tmp_path):
+    """Packages by name, made on first use."""
+
+    class Packages(dict):
+        def __missing__(self, name):
+            package = self[name] = Package(tmp_path.joinpath(name), Config({}))
+            return package
+
+    return Packages()
+
+
+def _include(packages, name, *includes):
+    for include in includes:
+        packages[name].append_include(packages[include])
+
+
+def _names(order):
+    return [p.name for p in order]
+
+
+def test_tree(packages):
+    _include(packages, "p", "a", "b")
+    _include(packages, "a", "c")
+    # the first include comes last, it takes precedence.
+    assert _names(resolve_include_order(packages["p"])) == ["b", "c", "a", "p"]
+
+
+def test_diamond(packages):
+    _include(packages, "p", "a", "b")
+    _include(packages, "a", "d")
+    _include(packages, "b", "d")
+    assert _names(resolve_include_order(packages["p"])) == ["d", "b", "a", "p"]
+
+
+def test_cycle(packages):
+    _include(packages, "p", "a")
+    _include(packages, "a", "b")
+    _include(packages, "b", "a")
+    with pytest.raises(IncludeCycleError) as err:
+        resolve_include_order(packages["p"])
+    assert _names(err.value.cycle) == ["a", "b", "a"]
+
+
+def test_self_include(packages):
+    _include(packages, "p", "p")
+    with pytest.raises(IncludeCycleError) as err:
+        resolve_include_order(packages["p"])
+    assert _names(err.value.cycle) == ["p", "p"]
+
+
+def test_deep_chain(packages):
+    names = [f"p{i}" for i in range(5000)]
+    for name, include in zip(names, names[1:]):
+        _include(packages, name, include)
+    assert _names(resolve_include_order(packages["p0"])) == names[::-1]
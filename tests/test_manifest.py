@@ -0,0 +1,76 @@
+import os
+import shutil
+
+from pfcli.builder import Builder, BuildOptions, copy
+from pfcli.builder.manifest import BuildManifest
+from pfcli.package import clear_package_cache, load_package
+
+
+def _copy(manifest, source, dest):
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(source, dest)
+    manifest.record(source, dest)
+
+
+def test_is_current(tmp_path):
+    source = tmp_path.joinpath("a.tci")
+    source.write_bytes(b"AAAA")
+    build_path = tmp_path.joinpath("_build")
+    dest = build_path.joinpath("etc", "a.tci")
+    manifest = BuildManifest(build_path)
+    _copy(manifest, source, dest)
+    manifest.save()
+
+    manifest = BuildManifest.load(build_path)
+    assert manifest.is_current(source, dest)
+    assert not manifest.is_current(source, dest, "hardlink")
+
+    # touched, the content is the same.
+    os.utime(source, ns=(2_000_000_000_000_000_000, 2_000_000_000_000_000_000))
+    manifest.stat_index.invalidate()
+    assert manifest.is_current(source, dest)
+    assert dest.stat().st_mtime_ns == source.stat().st_mtime_ns
+
+    source.write_bytes(b"BBBB")
+    manifest.stat_index.invalidate()
+    assert not manifest.is_current(source, dest)
+
+
+def test_remove_stale(tmp_path):
+    source = tmp_path.joinpath("a.tci")
+    source.write_bytes(b"AAAA")
+    build_path = tmp_path.joinpath("_build")
+    keep = build_path.joinpath("a.tci")
+    stale = build_path.joinpath("sub", "dir", "a.tci")
+    manifest = BuildManifest(build_path)
+    _copy(manifest, source, keep)
+    _copy(manifest, source, stale)
+
+    assert manifest.remove_stale([keep]) == [stale]
+    assert keep.exists()
+    assert not build_path.joinpath("sub").exists()
+    assert list(manifest.entries) == ["a.tci"]
+
+
+def test_incremental_build(package_path, monkeypatch):
+    """Only changed files are copied again and the files of removed sources
+    are removed from the build directory.
+    """
+    build_path = package_path.joinpath("_build")
+    Builder(load_package(package_path)).build(BuildOptions(force=True))
+    package_path.joinpath("etc", "subdir", "test2.tci").unlink()
+    package_path.joinpath("etc", "fonts.ini").write_text("changed")
+
+    copied = []
+    stage_file = copy.stage_file
+
+    def recording_stage_file(source, dest, staging=copy.COPY):
+        copied.append(dest.relative_to(build_path).as_posix())
+        stage_file(source, dest, staging)
+
+    monkeypatch.setattr(copy, "stage_file", recording_stage_file)
+    clear_package_cache()
+    Builder(load_package(package_path)).build(BuildOptions(force=True))
+    assert copied == ["etc/fonts.ini"]
+    assert build_path.joinpath("etc", "fonts.ini").read_text() == "changed"
+    assert not build_path.joinpath("etc", "test2.tci").exists()
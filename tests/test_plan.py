@@ -0,0 +1,25 @@
+import zipfile
+
+from pfcli.builder import Builder, BuildOptions
+from pfcli.builder.plan import BuildPlan, PlannedBuilder, make_plan
+from pfcli.package import load_package
+
+
+def _names(archive):
+    with zipfile.ZipFile(archive) as zf:
+        return sorted(zf.namelist())
+
+
+def test_planned_build(package_path, tmp_path):
+    """A build from a saved plan packages the files a build of the package
+    does.
+    """
+    plan_file = tmp_path.joinpath("plan.json")
+    make_plan(Builder(load_package(package_path))).save(plan_file)
+    Builder(load_package(package_path)).build(BuildOptions(force=True))
+    expected = _names(package_path.joinpath("huhu.zip"))
+
+    builder = PlannedBuilder(BuildPlan.load(plan_file), archive_dir=tmp_path)
+    assert builder.packages == [] and builder.build_package is None
+    assert builder.build(BuildOptions(clean=True))
+    assert _names(tmp_path.joinpath("huhu.zip")) == expected
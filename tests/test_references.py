@@ -0,0 +1,50 @@
+from pfcli.builder.references import prune_package_files, scan_references
+
+FORM = """<?xml version="1.0" encoding="UTF-8"?>
+<xdp xmlns="http://ns.adobe.com/xdp/">
+  <template>
+    <subform name="page">
+      <subform name="header" usehref="sub/header.xdp#som($template.#subform[0])">
+        <field name="logo"><value><image href="img/logo.png"/></value></field>
+      </subform>
+      <field name="a"><value><image href="http://example.com/x.png"/></value></field>
+      <subform name="body">
+        <subform name="deep"><draw><value><image href="deep.jpg"/></value></draw></subform>
+      </subform>
+    </subform>
+    <subform name="last" usehref="last.xdp"/>
+  </template>
+</xdp>
+"""
+
+
+def test_scan_nested_form(tmp_path):
+    """The references of nested elements are found although the finished
+    elements are dropped while the form is read.
+    """
+    form = tmp_path.joinpath("form.xdp")
+    form.write_text(FORM, encoding="utf-8")
+    assert scan_references(form) == [
+        "sub/header.xdp#som($template.#subform[0])",
+        "img/logo.png",
+        "deep.jpg",
+        "last.xdp",
+    ]
+
+
+def test_prune(tmp_path):
+    build_path = tmp_path.joinpath("_build")
+    form = tmp_path.joinpath("form.xdp")
+    form.write_text(FORM, encoding="utf-8")
+    files = [form]
+    for name in ("header.xdp", "logo.png", "deep.jpg", "last.xdp", "unused.png"):
+        tmp_path.joinpath(name).write_bytes(b"")
+        files.append(tmp_path.joinpath(name))
+    plan = [
+        {"source": f, "dest": build_path.joinpath(f.name), "section": "source"}
+        for f in files
+    ]
+
+    used, dropped = prune_package_files(plan, build_path, form)
+    assert [pf["source"].name for pf in dropped] == ["unused.png"]
+    assert len(used) == 5
@@ -0,0 +1,61 @@
+from pathlib import Path
+
+import pytest
+
+from pfcli.package.scanner import StatIndex, scan
+
+FILES = [
+    "a.xdp",
+    "b.tci",
+    "noext",
+    "logo/a.png",
+    "logo/b.png",
+    "logo/c.jpg",
+    "forms/x/one.xdp",
+    "forms/y/x/two.xdp",
+    "forms/y/z/three.xdp",
+    "forms/x/deeper/four.xdp",
+    "x/five.inc",
+]
+
+PATTERNS = [
+    "*.*",
+    "*",
+    "**/*",
+    "**/*.xdp",
+    "logo/*.png",
+    "logo/[ab].png",
+    "logo/[!a]*",
+    "forms/**/x/*",
+    "**/x/*",
+    "forms/*/x/*.xdp",
+    "forms/x/**",
+]
+
+
+@pytest.fixture
+def basepath(tmp_path) -> Path:
+    for name in FILES:
+        path = tmp_path.joinpath(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+    return tmp_path
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_scan_matches_glob(basepath, pattern):
+    expected = sorted(
+        p.relative_to(basepath) for p in basepath.glob(pattern) if p.is_file()
+    )
+    assert scan(basepath, [pattern])[pattern] == expected
+
+
+def test_scan_all_patterns(basepath):
+    """All patterns in one walk give what they give on their own, and the
+    matched files are stat-ed.
+    """
+    stat_index = StatIndex()
+    matches = scan(basepath, PATTERNS, stat_index)
+    for pattern in PATTERNS:
+        assert matches[pattern] == scan(basepath, [pattern])[pattern]
+    assert len(stat_index) == len(FILES)
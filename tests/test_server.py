@@ -0,0 +1,63 @@
+import io
+import os
+from pathlib import Path
+import zipfile
+
+from pfcli import __version__, config
+from pfcli.builder.server import BuildServer
+from pfcli.package import clear_package_cache
+from pfcli.remote import BUILT, PROTOCOL_VERSION
+
+
+def _write(path: Path, content: bytes, mtime: int):
+    path.write_bytes(content)
+    # the server only sees changes of the mtime or size.
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_repeated_dedupe_builds(package_path):
+    """A build reusing the state of the last one must not take the content
+    of files in the build directory from the previous builds.
+    """
+    subdir = package_path.joinpath("etc", "subdir")
+    test, test2 = subdir.joinpath("test.tci"), subdir.joinpath("test2.tci")
+    server = BuildServer()
+
+    _write(test, b"AAAA", 1_000_000_000_000_000_000)
+    _write(test2, b"BBBB", 1_000_000_000_000_000_000)
+    server.build(package_path, {"dedupe": True})
+    _write(test2, b"AAAA", 1_100_000_000_000_000_000)
+    server.build(package_path, {"dedupe": True})
+    _write(test, b"CCCC", 1_200_000_000_000_000_000)
+    result = server.build(package_path, {"dedupe": True})
+
+    with zipfile.ZipFile(package_path.joinpath(result["archive"])) as zf:
+        assert zf.read("etc/test.tci") == b"CCCC"
+        assert zf.read("etc/test2.tci") == b"AAAA"
+
+
+def _request(package_path: Path, cache: bool) -> dict:
+    return {
+        "version": PROTOCOL_VERSION,
+        "pfcli": __version__,
+        "command": "build",
+        "cwd": str(package_path),
+        "cache": cache,
+        "params": {},
+    }
+
+
+def test_no_cache(package_path):
+    """The server doesn't use the config cache for a client that doesn't."""
+    server = BuildServer()
+    configs = config.cache_dir().joinpath("configs")
+
+    result = server.handle(_request(package_path, False), io.BytesIO())
+    assert result["result"] == BUILT
+    assert not configs.exists()
+    assert config.get_use_cache()
+
+    clear_package_cache()
+    server = BuildServer()
+    server.handle(_request(package_path, True), io.BytesIO())
+    assert configs.exists()
@@ -0,0 +1,26 @@
+import zipfile
+
+from pfcli.builder import Builder, BuildOptions
+from pfcli.config import SYMLINK
+from pfcli.package import clear_package_cache, load_package
+
+
+def _build(path, **options) -> bool:
+    clear_package_cache()
+    return Builder(load_package(path)).build(BuildOptions(force=True, **options))
+
+
+def test_build_after_symlink_build(package_path):
+    """The links in the build directory of a symlink build must not be
+    followed when the next build plans where its files go.
+    """
+    _build(package_path, staging=SYMLINK)
+    assert package_path.joinpath("_build", "etc", "_GLOBALS.tci").is_symlink()
+
+    _build(package_path)
+    assert not package_path.joinpath("_build", "etc", "_GLOBALS.tci").is_symlink()
+    _build(package_path, staging=SYMLINK)
+    _build(package_path, clean=True)
+
+    with zipfile.ZipFile(package_path.joinpath("huhu.zip")) as zf:
+        assert "etc/_GLOBALS.tci" in zf.namelist()
@@ -0,0 +1,64 @@
+import struct
+import zipfile
+
+import pytest
+
+from pfcli.builder import Builder, BuildOptions
+from pfcli.builder.copy import unique_destinations
+from pfcli.builder.verify import verify_archive
+from pfcli.config import RS_PACKAGE_CONFIGURATION
+from pfcli.package import clear_package_cache, load_package
+
+
+def _builder(path) -> Builder:
+    clear_package_cache()
+    return Builder(load_package(path))
+
+
+@pytest.fixture
+def archive(package_path):
+    builder = _builder(package_path)
+    builder.build(BuildOptions(force=True))
+    return package_path.joinpath(builder.archive_filename)
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_matches(package_path, archive, jobs):
+    result = verify_archive(_builder(package_path), jobs=jobs)
+    assert result.ok, result.report()
+    # the files and the package xml.
+    files = unique_destinations(_builder(package_path).package_files)
+    assert result.checked == len(files) + 1
+
+
+def test_differences(package_path, archive):
+    package_path.joinpath("etc", "fonts.ini").write_text("changed")
+    package_path.joinpath("etc", "new.tci").write_text("new")
+    with zipfile.ZipFile(archive, "a") as zf:
+        zf.writestr("etc/extra.tci", "extra")
+
+    result = verify_archive(_builder(package_path), str(archive))
+    assert list(result.mismatched) == ["etc/fonts.ini"]
+    assert list(result.missing) == ["etc/new.tci"]
+    assert result.extra == ["etc/extra.tci"]
+    assert not result.corrupt
+
+
+def test_corrupt(package_path, archive):
+    with zipfile.ZipFile(archive) as zf:
+        info = max(
+            (i for i in zf.infolist() if i.filename != RS_PACKAGE_CONFIGURATION),
+            key=lambda i: i.compress_size,
+        )
+    data = bytearray(archive.read_bytes())
+    # the data follows the local header and its name and extra field.
+    name_length, extra_length = struct.unpack(
+        "<HH", data[info.header_offset + 26 : info.header_offset + 30]
+    )
+    offset = info.header_offset + 30 + name_length + extra_length
+    data[offset + info.compress_size // 2] ^= 0xFF
+    archive.write_bytes(data)
+
+    result = verify_archive(_builder(package_path), jobs=2)
+    assert list(result.corrupt) == [info.filename]
+    assert verify_archive(_builder(package_path), check_data=False).ok
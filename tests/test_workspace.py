@@ -0,0 +1,46 @@
+from pathlib import Path
+
+import pytest
+
+from pfcli.package.workspace import WorkspaceIndex
+
+PACKAGE = "ZPF_VERTRAGSBEST_BDNV"
+
+
+@pytest.fixture
+def index(workspace, tmp_path_factory, monkeypatch):
+    # relative paths must not depend on the current directory.
+    monkeypatch.chdir(tmp_path_factory.mktemp("elsewhere"))
+    index = WorkspaceIndex(workspace.resolve())
+    index.update()
+    return index
+
+
+def _affected(index, *paths, **kwargs):
+    return [entry.path for entry in index.affected(paths, **kwargs)]
+
+
+def test_affected(index):
+    assert _affected(index, f"{PACKAGE}/package.toml") == [PACKAGE]
+    # through the includes.
+    assert _affected(index, "_GLOBALS/package.toml") == [PACKAGE]
+    assert _affected(index, "_VERTRAGSBEST/package.toml") == [PACKAGE]
+    # absolute paths.
+    assert _affected(index, index.root.joinpath("_GLOBALS", "package.toml")) == [
+        PACKAGE
+    ]
+    assert _affected(index, "README.md", "../outside.txt") == []
+
+
+def test_affected_base(index):
+    assert _affected(index, "package.toml", base=index.root.joinpath(PACKAGE)) == [
+        PACKAGE
+    ]
+    assert _affected(index, "package.toml", base=Path("/")) == []
+
+
+def test_update(index):
+    assert index.update() == (0, 0)
+    config_file = index.root.joinpath("_GLOBALS", "package.toml")
+    config_file.write_text(config_file.read_text() + "\n")
+    assert index.update() == (1, 0)